@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+import os
+import secrets
+from typing import Optional
+
+from fastapi import HTTPException
+
+# Admin-only features (debug endpoints, per-request path engines) are disabled
+# unless METRO_ADMIN_TOKEN is set; requests must send it in the X-Admin-Token header
+ADMIN_TOKEN = os.environ.get("METRO_ADMIN_TOKEN")
+
+
+def require_admin(token: Optional[str]) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if token is None or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import math
+import time
+from typing import Any, Callable, List
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from app.services.metro_network import MetroNetwork
+
+
+def estimate_cost(network: MetroNetwork, lines: List[str]) -> int:
+    """Work estimate of a request on a line selection: stations on its (expanded) lines"""
+    try:
+        return max(1, sum(len(network.get_line_stations(ln)) for ln in network._expand_lines(lines)))
+    except ValueError:
+        return 1  # Invalid lines fail fast in the handler
+
+
+class AdmissionController:
+    """
+    Concurrency limit with a bounded, deadline-aware wait queue for one endpoint.
+
+    Admitted work runs in the thread pool, so the event loop keeps serving
+    cheap requests while expensive ones wait or compute. Each request carries
+    a cost estimate (see estimate_cost); the controller learns seconds per
+    cost unit from finished requests and rejects a request with 503 and
+    Retry-After when the queue is full or its estimated wait (work queued and
+    running ahead of it, spread over the slots) exceeds the deadline.
+    """
+
+    def __init__(self, name: str, max_concurrency: int = 2, max_queue: int = 32,
+                 deadline: float = 5.0, seconds_per_unit: float = 2e-5):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.seconds_per_unit = seconds_per_unit  # Moving average of observed cost
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._pending_units = 0  # Cost units queued or running
+        self.admitted = 0
+        self.rejected = 0
+
+    def estimated_wait(self) -> float:
+        return self._pending_units * self.seconds_per_unit / self.max_concurrency
+
+    def _reject(self, wait: float, reason: str) -> HTTPException:
+        self.rejected += 1
+        return HTTPException(
+            status_code=503,
+            detail=f"Server busy ({self.name}: {reason}), please retry",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))}
+        )
+
+    async def run(self, cost: int, func: Callable[..., Any], *args: Any) -> Any:
+        """Run func(*args) in the thread pool once admitted, or raise 503"""
+        wait = self.estimated_wait()
+        if self._waiting >= self.max_queue:
+            raise self._reject(wait, "queue full")
+        if wait > self.deadline:
+            raise self._reject(wait, "estimated wait too long")
+
+        self._waiting += 1
+        self._pending_units += cost
+        acquired = False
+        try:
+            await self._slots.acquire()
+            acquired = True
+        finally:
+            self._waiting -= 1
+            if not acquired:  # Cancelled while waiting (client went away)
+                self._pending_units -= cost
+
+        self.admitted += 1
+        started = time.perf_counter()
+        try:
+            return await run_in_threadpool(func, *args)
+        finally:
+            self._slots.release()
+            self._pending_units -= cost
+            observed = (time.perf_counter() - started) / cost
+            self.seconds_per_unit += 0.2 * (observed - self.seconds_per_unit)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "waiting": self._waiting,
+            "estimated_wait": round(self.estimated_wait(), 4),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
@@ -1,11 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import metro
+from app.responses import FastJSONResponse
+from app.routers import debug, metro
 
 app = FastAPI(
     title="地铁寻路游戏 API",
-    description="地铁最短路径查找和验证 API（支持深圳、上海、北京、广州、武汉、长沙）",
-    version="1.3.0"
+    description=f"地铁最短路径查找和验证 API（支持{'、'.join(info.name for info in metro.city_registry.cities())}）",
+    version="1.3.0",
+    default_response_class=FastJSONResponse
 )
 
 # Configure CORS
@@ -19,6 +21,19 @@ app.add_middleware(
 
 # Include routers
 app.include_router(metro.router, prefix="/api", tags=["metro"])
+app.include_router(debug.router, prefix="/api", tags=["debug"])
+
+
+@app.on_event("startup")
+async def start_data_watcher():
+    # Hot reload, city discovery and idle-city eviction (see CityDataStore)
+    metro.city_data_store.start_watcher()
+
+
+@app.on_event("shutdown")
+async def stop_data_watcher():
+    metro.city_data_store.stop_watcher()
+
 
 @app.get("/")
 async def root():
@@ -26,5 +41,5 @@ async def root():
         "message": "地铁寻路游戏 API",
         "docs": "/docs",
         "version": "1.3.0",
-        "supported_cities": ["sz", "sh", "bj", "gz", "wh", "cs"]
+        "supported_cities": metro.city_registry.codes()
     }
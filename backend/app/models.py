@@ -1,26 +1,53 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import Annotated, Dict, List, Literal, Optional, Union
 from decimal import Decimal
 
 class RandomStationsRequest(BaseModel):
     lines: List[str]
+    difficulty: Optional[str] = None  # easy, medium or hard: sample the city's puzzle bank
 
 class CalculatePathRequest(BaseModel):
     lines: List[str]
     start: str
     end: str
+    # If set, also list simple paths costing at most this much more than the optimum (capped server-side)
+    alternatives_tolerance: Optional[float] = None
+    alternatives_limit: int = 20
 
 class ValidatePathRequest(BaseModel):
-    lines: List[str]
-    start: str
-    end: str
+    # Puzzle: a round_id from /game/round, or lines/start/end (also the fallback
+    # if the round expired); given ones must match the round
+    round_id: Optional[str] = None
+    lines: Optional[List[str]] = None
+    start: Optional[str] = None
+    end: Optional[str] = None
     user_path: List[str]
 
+class StructuredPath(BaseModel):
+    annotated: str  # Path with transfer annotations (for text display)
+    stations: List[str]
+    lines: List[Optional[str]]  # Display line name per station (None for the first)
+    transfers: List[int]  # Station indices where a transfer happens
+
+class RankedPath(StructuredPath):
+    cost: float
+
+class PathDebug(BaseModel):
+    engine: str  # Path engine that ran the shortest-path search, "cache" when served from the result cache
+    requested_engine: str  # Engine asked for (request, city or "auto"); ?engine= bypasses the result cache
+    size_class: str  # Size class of the searched graph (auto picks by it)
+    stations: int
+    settled_states: int  # 0 when served from the result cache
+
 class PathResponse(BaseModel):
+    format: Literal["full"] = "full"
     shortest_cost: float
-    paths: List  # Can be List[str] or List[dict] with transfer info
+    paths: List[StructuredPath]
+    alternatives: Optional[List[RankedPath]] = None  # Near-optimal paths ranked by cost
+    debug: Optional[PathDebug] = None  # Only with ?debug=true
 
 class ValidationResponse(BaseModel):
+    format: Literal["full"] = "full"
     valid: bool
     is_shortest: bool
     user_cost: Optional[float]
@@ -28,15 +55,99 @@ class ValidationResponse(BaseModel):
     message: str
     error_reason: Optional[str] = None  # Detailed error reason
     user_path_annotated: Optional[str] = None  # User path with transfer annotations
-    all_shortest_paths: List  # Can be List[str] or formatted with transfers
+    all_shortest_paths: List[StructuredPath]
+    debug: Optional[PathDebug] = None  # Only with ?debug=true
+
+class RoundRequest(BaseModel):
+    lines: List[str]
+    # Fixed stations; both omitted: random pair, only start: random reachable end
+    start: Optional[str] = None
+    end: Optional[str] = None
+    include_solutions: bool = False  # Also return the structured shortest paths
+    include_reachable: bool = False  # Also list the stations reachable from start
+
+class RoundResponse(BaseModel):
+    round_id: str  # Round session to validate against (see ValidatePathRequest)
+    start: str
+    end: str
+    shortest_cost: float
+    component: int  # Start's component id (as in ComponentsResponse)
+    reachable_components: List[int] = []  # Other component ids reachable from it
+    reachable_stations: Optional[List[str]] = None
+    solutions: Optional[List[StructuredPath]] = None
 
 class RandomStationsResponse(BaseModel):
     start: str
     end: str
+    difficulty: Optional[str] = None  # None: not from the puzzle bank
 
 class StationsResponse(BaseModel):
     stations: List[str]
 
+class MapStation(BaseModel):
+    name: str
+    x: float
+    y: float
+    distance: Optional[float] = None  # From the query point (nearest queries)
+
+class MapStationsResponse(BaseModel):
+    stations: List[MapStation]
+
 class ReachableStationsRequest(BaseModel):
     lines: List[str]
     start: str
+
+class ComponentsRequest(BaseModel):
+    lines: List[str]
+
+class ComponentsResponse(BaseModel):
+    components: Dict[str, int]  # Station -> component id
+    # Component id -> other component ids reachable from it (only non-empty with one-way sections)
+    reachable_components: Dict[int, List[int]] = {}
+
+class StringTableResponse(BaseModel):
+    version: str
+    stations: List[str]
+    lines: List[str]
+
+class CompactPath(BaseModel):
+    stations: List[int]  # Station ids (StringTableResponse.stations)
+    lines: List[Optional[int]]  # Display line id per station (None for the first)
+    transfers: List[int]  # Station indices where a transfer happens
+    annotated: Optional[str] = None  # Only with ?annotated=true
+
+class RankedCompactPath(CompactPath):
+    cost: float
+
+class CompactPathResponse(BaseModel):
+    # ?format=compact: paths as ids into the city's string table
+    format: Literal["compact"]
+    strings_version: str
+    strings: Optional[StringTableResponse] = None  # None if the client sent this strings_version
+    shortest_cost: float
+    paths: List[CompactPath]
+    alternatives: Optional[List[RankedCompactPath]] = None
+    debug: Optional[PathDebug] = None
+
+class CompactValidationResponse(BaseModel):
+    format: Literal["compact"]
+    strings_version: str
+    strings: Optional[StringTableResponse] = None
+    valid: bool
+    is_shortest: bool
+    user_cost: Optional[float]
+    shortest_cost: float
+    message: str
+    error_reason: Optional[str] = None
+    user_path_annotated: Optional[str] = None
+    all_shortest_paths: List[CompactPath]
+    debug: Optional[PathDebug] = None
+
+# calculate-path / validate-path responses, by their format field
+AnyPathResponse = Annotated[Union[PathResponse, CompactPathResponse], Field(discriminator="format")]
+AnyValidationResponse = Annotated[Union[ValidationResponse, CompactValidationResponse], Field(discriminator="format")]
+
+class CityResponse(BaseModel):
+    code: str
+    name: str
+    loaded: bool
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson  # Optional: much faster JSON encoding
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Compact JSON bytes of plain content (orjson when installed, like FastJSONResponse)"""
+    if orjson is not None:
+        # Non-str keys (e.g. component ids) are stringified like the stdlib does
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    """Plain content of JSON bytes (orjson when installed)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response that encodes pre-built dicts/lists straight to bytes.
+
+    Endpoints that return an instance of this class skip FastAPI's response
+    model validation and jsonable_encoder pass, so the content must already
+    match the declared response_model (plain str/int/float/bool/None, lists and
+    dicts). Uses orjson when installed and falls back to the stdlib encoder.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import tracemalloc
+from fastapi import APIRouter, Header, Query
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+from app.admin import require_admin
+from app.routers import metro
+from app.services.memory import deep_sizeof, process_memory
+
+router = APIRouter()
+
+
+def _memory_report(top: int) -> dict:
+    """Memory report (runs in the thread pool; deep-size walks take a while on big caches)"""
+    # Process-wide caches: request results, round sessions
+    shared = {
+        "singleflight": {
+            flight.name: deep_sizeof(flight._cache)
+            for flight in (metro.calculate_path_flight, metro.shortest_paths_flight,
+                           metro.random_pool_flight, metro.round_flight)
+        },
+        "round_sessions": deep_sizeof(metro.round_store._rounds),
+    }
+
+    report = {"process": process_memory(), "cities": metro.city_data_store.memory_report(), "shared": shared}
+    if tracemalloc.is_tracing():
+        # Only when started with PYTHONTRACEMALLOC / -X tracemalloc: top allocation sites
+        snapshot = tracemalloc.take_snapshot()
+        report["tracemalloc"] = [
+            {"site": str(stat.traceback), "bytes": stat.size, "blocks": stat.count}
+            for stat in snapshot.statistics("lineno")[:top]
+        ]
+    return report
+
+
+@router.get("/debug/memory")
+async def debug_memory(
+    x_admin_token: Optional[str] = Header(None),
+    top: int = Query(20, ge=1, le=200, description="tracemalloc: number of allocation sites")
+):
+    """Estimated retained memory per city and subsystem, plus process RSS (admin only, computed on demand)"""
+    require_admin(x_admin_token)
+    return await run_in_threadpool(_memory_report, top)
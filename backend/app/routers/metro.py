@@ -1,73 +1,212 @@
 # -*- coding: utf-8 -*-
-from fastapi import APIRouter, HTTPException, Path
-from typing import List
-import json
+from collections import OrderedDict, deque
+from decimal import Decimal
+from fastapi import APIRouter, Header, HTTPException, Path, Query, Response
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Tuple
+import gzip
+import logging
 import os
+import random
 from app.models import (
     RandomStationsRequest,
     RandomStationsResponse,
     CalculatePathRequest,
-    PathResponse,
+    AnyPathResponse,
     ValidatePathRequest,
-    ValidationResponse,
+    AnyValidationResponse,
     StationsResponse,
-    ReachableStationsRequest
+    MapStationsResponse,
+    ReachableStationsRequest,
+    ComponentsRequest,
+    ComponentsResponse,
+    StringTableResponse,
+    CityResponse,
+    RoundRequest,
+    RoundResponse
 )
+from app.admin import require_admin
+from app.admission import AdmissionController, estimate_cost
+from app.responses import FastJSONResponse
+from app.singleflight import SingleFlight
+from app.services.city_data import CityData, CityDataStore
+from app.services.city_registry import CityRegistry
+from app.services.memory import deep_sizeof
+from app.services.map_tiles import MapTiles, map_payload
 from app.services.metro_network import MetroNetwork
+from app.services.path_engines import DEFAULT_ENGINE, SIZE_CLASSES, benchmarks, engine_names
 from app.services.path_finder import PathFinder
 from app.services.path_validator import PathValidator
+from app.services.puzzle_bank import DIFFICULTIES, PuzzleBank
+from app.services.result_cache import ResultCache
+from app.services.round_sessions import RoundSession, RoundStore
+from app.services.station_search import StationSearchIndex
+from app.services.wire_format import StringTable, encode_paths
 
 router = APIRouter()
 
-# City data file mapping
-CITY_DATA_FILES = {
-    "sz": "stations_coordinates.json",      # Shenzhen
-    "sh": "stations_coordinates_sh.json",   # Shanghai
-    "bj": "stations_coordinates_bj.json",   # Beijing
-    "gz": "stations_coordinates_gz.json",   # Guangzhou
-    "wh": "stations_coordinates_wh.json",   # Wuhan
-    "cs": "stations_coordinates_cs.json",   # Changsha
-}
-
-CITY_NAMES = {
-    "sz": "深圳",
-    "sh": "上海",
-    "bj": "北京",
-    "gz": "广州",
-    "wh": "武汉",
-    "cs": "长沙",
-}
-
-# Cache for metro networks (one per city)
-_metro_networks = {}
-_station_coordinates_cache = {}
+logger = logging.getLogger(__name__)
 
+DATA_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 
-def get_metro_network(city: str) -> MetroNetwork:
-    """Get or create MetroNetwork instance for a city"""
-    if city not in CITY_DATA_FILES:
-        raise HTTPException(status_code=404, detail=f"City not supported: {city}")
-    
-    if city not in _metro_networks:
-        base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        json_file = os.path.join(base_dir, CITY_DATA_FILES[city])
-        _metro_networks[city] = MetroNetwork(json_file)
-    
-    return _metro_networks[city]
+# Cities discovered from stations_coordinates_{code}.json files (+ cities.json metadata)
+city_registry = CityRegistry(DATA_DIR)
+
+# Optional persistent second-tier cache of shortest paths and snapshot tables, shared
+# by worker processes and kept across restarts. Environment: METRO_RESULT_CACHE_PATH
+# (SQLite file, unset disables it), METRO_RESULT_CACHE_MB (size bound, default 256)
+result_cache = ResultCache.from_env()
+
+# Current data version per loaded city, hot-reloaded when a data file changes
+# and unloaded when idle while over the memory budget. Environment:
+# METRO_DATA_POLL_INTERVAL (seconds, 0 disables the watcher),
+# METRO_MEMORY_BUDGET_MB (0 = unlimited), METRO_CITY_IDLE_SECONDS
+city_data_store = CityDataStore(
+    city_registry,
+    poll_interval=float(os.environ.get("METRO_DATA_POLL_INTERVAL", "2")),
+    memory_budget=int(float(os.environ.get("METRO_MEMORY_BUDGET_MB", "64")) * 1024 * 1024),
+    idle_seconds=float(os.environ.get("METRO_CITY_IDLE_SECONDS", "600")),
+    result_cache=result_cache
+)
+
+
+# Admission control for the expensive endpoints. Environment:
+# METRO_PATH_CONCURRENCY (concurrent computations per endpoint), METRO_PATH_QUEUE
+# (waiting requests per endpoint), METRO_PATH_DEADLINE (seconds of estimated wait
+# before shedding with 503, below the frontend's 10 s timeout)
+_admission_settings = dict(
+    max_concurrency=int(os.environ.get("METRO_PATH_CONCURRENCY", "2")),
+    max_queue=int(os.environ.get("METRO_PATH_QUEUE", "32")),
+    deadline=float(os.environ.get("METRO_PATH_DEADLINE", "5"))
+)
+calculate_path_admission = AdmissionController("calculate-path", **_admission_settings)
+validate_path_admission = AdmissionController("validate-path", **_admission_settings)
+random_stations_admission = AdmissionController("random-stations", **_admission_settings)
+round_admission = AdmissionController("round", **_admission_settings)
+
+# Single-flight coalescing of identical concurrent computations, with a short result
+# cache (METRO_RESULT_TTL seconds). Keys include the city's data version.
+_result_ttl = float(os.environ.get("METRO_RESULT_TTL", "2"))
+calculate_path_flight = SingleFlight("calculate-path", ttl=_result_ttl)
+shortest_paths_flight = SingleFlight("validate-path shortest paths", ttl=_result_ttl)
+random_pool_flight = SingleFlight("random-stations pool refill", ttl=0)
+round_flight = SingleFlight("round (fixed stations)", ttl=_result_ttl)
+
+# Solved rounds that validate-path checks against by round_id. Environment:
+# METRO_ROUND_TTL (seconds since last use), METRO_ROUND_MAX (sessions),
+# METRO_ROUND_MEMORY_MB (estimated size of all sessions)
+round_store = RoundStore(
+    ttl=float(os.environ.get("METRO_ROUND_TTL", "1800")),
+    max_rounds=int(os.environ.get("METRO_ROUND_MAX", "10000")),
+    max_bytes=int(float(os.environ.get("METRO_ROUND_MEMORY_MB", "32")) * 1024 * 1024)
+)
+
+# Puzzle banks ({city}.bank, see generate_puzzles.py) that random-stations samples
+# when a difficulty is requested. Environment: METRO_PUZZLE_DIR
+PUZZLE_DIR = os.environ.get("METRO_PUZZLE_DIR", os.path.join(DATA_DIR, "puzzles"))
 
+# Random start/end pairs drawn per batch, and line selections with a pool per city
+RANDOM_POOL_SIZE = 32
+MAX_RANDOM_POOLS = 256
 
-def get_station_coordinates_data(city: str):
-    """Load station coordinates from JSON file for a city"""
-    if city not in CITY_DATA_FILES:
+
+def get_city_data(city: str) -> CityData:
+    """Get the current data version of a city"""
+    try:
+        return city_data_store.get(city)
+    except KeyError:
         raise HTTPException(status_code=404, detail=f"City not supported: {city}")
-    
-    if city not in _station_coordinates_cache:
-        base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        coords_file = os.path.join(base_dir, CITY_DATA_FILES[city])
-        with open(coords_file, 'r', encoding='utf-8') as f:
-            _station_coordinates_cache[city] = json.load(f)
-    
-    return _station_coordinates_cache[city]
+
+
+def get_metro_network(city: str) -> MetroNetwork:
+    """Get the MetroNetwork of a city's current data version"""
+    return get_city_data(city).network
+
+
+def selection_key(metro_network: MetroNetwork, lines: List[str]) -> Tuple[str, ...]:
+    """Canonical form of a line selection (expanded with branch lines, sorted)"""
+    return tuple(sorted(set(metro_network._expand_lines(lines))))
+
+
+def check_engine(engine: Optional[str], admin_token: Optional[str]) -> None:
+    """
+    Passes for engine None (the city's engine); picking an engine is admin-only
+    debugging (see require_admin), and a 400 for an unknown name
+    """
+    if engine is None:
+        return
+    require_admin(admin_token)
+    if engine not in engine_names():
+        raise HTTPException(
+            status_code=400, detail=f"Unknown path engine: {engine} (one of {', '.join(engine_names())})"
+        )
+
+
+def use_compact_format(path_format: str, header_format: Optional[str]) -> bool:
+    """Whether the client asked for the compact (id-encoded) path format"""
+    return "compact" in (path_format, header_format)
+
+
+def compact_strings(metro_network: MetroNetwork, strings_version: Optional[str]) -> dict:
+    """String table fields of a compact response (table omitted if the client has it)"""
+    table = StringTable.for_network(metro_network)
+    return {
+        "strings_version": table.version,
+        "strings": None if strings_version == table.version else table.to_dict()
+    }
+
+
+def get_puzzle_bank(data: CityData) -> Optional[PuzzleBank]:
+    """A city's puzzle bank for its current data version (None if there is none or it is stale)"""
+    path = os.path.join(PUZZLE_DIR, f"{data.city}.bank")
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    cached = data.caches.get("puzzle_bank")
+    if cached is None or cached[0] != mtime:
+        try:
+            bank = PuzzleBank.load(path, data.network)
+        except Exception as e:
+            logger.warning("Puzzle bank for city %s not used: %s", data.city, e)
+            bank = None
+        cached = data.caches["puzzle_bank"] = (mtime, bank)
+    return cached[1]
+
+
+@router.get("/cities", response_model=List[CityResponse])
+async def get_cities():
+    """List supported cities (from the city registry)"""
+    loaded = set(city_data_store.loaded_cities())
+    return [
+        CityResponse(code=info.code, name=info.name, loaded=info.code in loaded)
+        for info in city_registry.cities()
+    ]
+
+
+@router.get("/stats")
+async def get_stats():
+    """Loaded cities, admission control, request coalescing, round session, result cache and path engine stats"""
+    # City sizes and the result cache's SQLite query are taken off the event loop
+    return {
+        "cities": await run_in_threadpool(city_data_store.stats),
+        "admission": {
+            controller.name: controller.stats()
+            for controller in (calculate_path_admission, validate_path_admission,
+                               random_stations_admission, round_admission)
+        },
+        "singleflight": {
+            flight.name: flight.stats()
+            for flight in (calculate_path_flight, shortest_paths_flight, random_pool_flight, round_flight)
+        },
+        "rounds": round_store.stats(),
+        "result_cache": await run_in_threadpool(result_cache.stats) if result_cache is not None else None,
+        "path_engines": {
+            "engines": engine_names(),
+            # auto's engine per size class
+            "auto": {name: benchmarks().best(name) or DEFAULT_ENGINE for name, _ in SIZE_CLASSES}
+        }
+    }
 
 
 @router.get("/{city}/lines", response_model=List[str])
@@ -109,7 +248,7 @@ async def get_stations(
         metro_network = get_metro_network(city)
         if lines:
             line_list = [l.strip() for l in lines.split(',')]
-            metro_network.build_graph(line_list)
+            metro_network = metro_network.with_lines(line_list)
             stations = sorted(metro_network.get_all_stations())
         else:
             # Return all stations from all lines
@@ -125,17 +264,73 @@ async def get_stations(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/{city}/stations/search", response_model=StationsResponse)
+async def search_stations(
+    city: str = Path(..., description="City code: sz or sh"),
+    q: str = Query("", description="Search text (exact and prefix matches rank first)"),
+    lines: str = None,
+    limit: int = Query(20, ge=1, le=200, description="Maximum number of stations")
+):
+    """Search station names, optionally within the stations of the selected lines"""
+    try:
+        metro_network = get_metro_network(city)
+        allowed = None
+        if lines:
+            line_list = [l.strip() for l in lines.split(',')]
+            allowed = metro_network.get_snapshot(line_list).station_masks
+        index = StationSearchIndex.for_network(metro_network)
+        return StationsResponse(stations=index.search(q, allowed, limit))
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/{city}/game/random-stations", response_model=RandomStationsResponse)
 async def random_stations(
     request: RandomStationsRequest,
     city: str = Path(..., description="City code: sz or sh")
 ):
-    """Generate random start and end stations"""
+    """Generate random start and end stations (from the puzzle bank if a difficulty is given)"""
+    data = get_city_data(city)
+    metro_network = data.network
+    key = selection_key(metro_network, request.lines)
+    if request.difficulty is not None:
+        if request.difficulty not in DIFFICULTIES:
+            raise HTTPException(status_code=400, detail=f"Unknown difficulty: {request.difficulty}")
+        bank = await run_in_threadpool(get_puzzle_bank, data)
+        pair = bank.sample(key, request.difficulty) if bank is not None else None
+        if pair is not None:
+            return RandomStationsResponse(start=pair[0], end=pair[1], difficulty=request.difficulty)
+        # No bank for this selection: an ungraded random pair
+    # Pairs are drawn in batches per line selection; concurrent refills of the same pool coalesce
+    pools = data.caches.setdefault("random_pools", OrderedDict())
+    while True:
+        pool = pools.get(key)
+        if pool:
+            pools.move_to_end(key)
+            start, end = pool.popleft()
+            return RandomStationsResponse(start=start, end=end)
+        
+        async def refill():
+            pairs = await random_stations_admission.run(
+                estimate_cost(metro_network, request.lines), _random_station_pairs,
+                metro_network, request.lines, RANDOM_POOL_SIZE
+            )
+            pools.setdefault(key, deque()).extend(pairs)
+            while len(pools) > MAX_RANDOM_POOLS:
+                pools.popitem(last=False)
+        
+        await random_pool_flight.run((data.version, key), refill)
+
+
+def _random_station_pairs(metro_network: MetroNetwork, lines: List[str], count: int) -> List[Tuple[str, str]]:
+    """random-stations worker: a batch of random pairs (runs in the thread pool, see AdmissionController)"""
     try:
-        metro_network = get_metro_network(city)
-        metro_network.build_graph(request.lines)
-        start, end = metro_network.pick_two_random_stations()
-        return RandomStationsResponse(start=start, end=end)
+        metro_network = metro_network.with_lines(lines)
+        return [metro_network.pick_two_random_stations() for _ in range(count)]
     except HTTPException:
         raise
     except ValueError as e:
@@ -153,8 +348,7 @@ async def reachable_stations(
 ):
     """Get all stations reachable from start station within selected lines"""
     try:
-        metro_network = get_metro_network(city)
-        metro_network.build_graph(request.lines)
+        metro_network = get_metro_network(city).with_lines(request.lines)
         
         # Validate start station exists
         all_stations = metro_network.get_all_stations()
@@ -171,15 +365,163 @@ async def reachable_stations(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/{city}/game/calculate-path", response_model=PathResponse)
+@router.post("/{city}/game/components", response_model=ComponentsResponse)
+async def station_components(
+    request: ComponentsRequest,
+    city: str = Path(..., description="City code: sz or sh")
+):
+    """Label every station of the selected lines with its component id.
+    
+    Two stations are reachable from each other iff they share a component id,
+    or the target's component is listed in reachable_components of the start's.
+    """
+    try:
+        metro_network = get_metro_network(city)
+        snapshot = metro_network.get_snapshot(request.lines)
+        components, reachable_components = snapshot.component_labels()
+        return ComponentsResponse(
+            components=components,
+            reachable_components=reachable_components
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{city}/strings", response_model=StringTableResponse)
+async def get_string_table(city: str = Path(..., description="City code: sz or sh")):
+    """Station/line name table referenced by ids in compact path responses"""
+    try:
+        metro_network = get_metro_network(city)
+        return StringTableResponse(**StringTable.for_network(metro_network).to_dict())
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/{city}/game/round", response_model=RoundResponse, response_class=FastJSONResponse)
+async def start_round(
+    request: RoundRequest,
+    city: str = Path(..., description="City code: sz or sh")
+):
+    """Start a round: pick/check start and end and solve it on one snapshot"""
+    data = get_city_data(city)
+    metro_network = data.network
+    
+    async def solve():
+        return await round_admission.run(
+            estimate_cost(metro_network, request.lines), _start_round, city, metro_network, request
+        )
+    
+    if request.start is None or request.end is None:
+        # Random rounds are never shared
+        return FastJSONResponse(await solve())
+    key = (
+        data.version, selection_key(metro_network, request.lines), request.start, request.end,
+        request.include_solutions, request.include_reachable
+    )
+    return FastJSONResponse(await round_flight.run(key, solve))
+
+
+def _start_round(city: str, metro_network: MetroNetwork, request: RoundRequest) -> dict:
+    """round worker: stores the round's session and returns the response payload (runs in the thread pool)"""
+    try:
+        selection = selection_key(metro_network, request.lines)
+        version = metro_network.data_version
+        metro_network = metro_network.with_lines(request.lines)
+        all_stations = metro_network.get_all_stations()
+        
+        start, end = request.start, request.end
+        if start is None:
+            if end is not None:
+                raise HTTPException(status_code=400, detail="Start station is required when end is given")
+            # Random pair; pick_two_random_stations() only guarantees a shared (weak) component
+            for _ in range(10):
+                start, end = metro_network.pick_two_random_stations()
+                if metro_network.is_reachable(start, end):
+                    break
+        if start not in all_stations:
+            raise HTTPException(status_code=400, detail=f"Start station not found: {start}")
+        
+        reachable = metro_network.get_reachable_stations(start)
+        if end is None or not metro_network.is_reachable(start, end):
+            if request.end is not None:
+                if request.end not in all_stations:
+                    raise HTTPException(status_code=400, detail=f"End station not found: {request.end}")
+                raise HTTPException(status_code=400, detail="Stations are not reachable")
+            if not reachable:
+                raise HTTPException(status_code=400, detail=f"No station is reachable from {start}")
+            end = random.choice(sorted(reachable))
+        
+        path_finder = PathFinder(metro_network)
+        paths, cost, paths_with_lines = path_finder.find_all_shortest_paths(start, end)
+        
+        session = RoundSession(
+            city, version, selection, start, end, cost, paths_with_lines, path_finder.debug_info()
+        )
+        round_store.add(session)
+        
+        labels, reachable_components = metro_network.snapshot.component_labels()
+        component = labels[start]
+        return {
+            "round_id": session.round_id,
+            "start": start,
+            "end": end,
+            "shortest_cost": float(cost),
+            "component": component,
+            "reachable_components": reachable_components.get(component, []),
+            "reachable_stations": sorted(reachable) if request.include_reachable else None,
+            "solutions": metro_network.build_structured_paths(paths_with_lines) if request.include_solutions else None
+        }
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/{city}/game/calculate-path", response_model=AnyPathResponse, response_class=FastJSONResponse)
 async def calculate_path(
     request: CalculatePathRequest,
-    city: str = Path(..., description="City code: sz or sh")
+    city: str = Path(..., description="City code: sz or sh"),
+    path_format: str = Query("full", alias="format", description="Path encoding: full or compact"),
+    annotated: bool = Query(False, description="Compact format: also include annotated strings"),
+    strings_version: Optional[str] = Query(None, description="Compact format: string table version the client already has"),
+    engine: Optional[str] = Query(None, description="Path engine (admin debugging): auto or an engine name, default the city's"),
+    debug: bool = Query(False, description="Include engine metadata (debug field)"),
+    x_path_format: Optional[str] = Header(None, description="Alternative to ?format="),
+    x_admin_token: Optional[str] = Header(None, description="Required with ?engine=")
 ):
     """Calculate shortest paths between two stations"""
+    check_engine(engine, x_admin_token)
+    data = get_city_data(city)
+    metro_network = data.network
+    compact = use_compact_format(path_format, x_path_format)
+    key = (
+        data.version, selection_key(metro_network, request.lines), request.start, request.end,
+        request.alternatives_tolerance, request.alternatives_limit, compact, annotated, strings_version,
+        engine, debug
+    )
+    payload = await calculate_path_flight.run(key, lambda: calculate_path_admission.run(
+        estimate_cost(metro_network, request.lines), _calculate_path,
+        metro_network, request, compact, annotated, strings_version, engine, debug
+    ))
+    return FastJSONResponse(payload)
+
+
+def _calculate_path(metro_network: MetroNetwork, request: CalculatePathRequest, compact: bool,
+                    annotated: bool, strings_version: Optional[str], engine: Optional[str] = None,
+                    debug: bool = False) -> dict:
+    """calculate-path worker: the response payload (runs in the thread pool, see AdmissionController)"""
     try:
-        metro_network = get_metro_network(city)
-        metro_network.build_graph(request.lines)
+        metro_network = metro_network.with_lines(request.lines)
         
         # Validate stations exist
         all_stations = metro_network.get_all_stations()
@@ -193,27 +535,61 @@ async def calculate_path(
             raise HTTPException(status_code=400, detail="Stations are not reachable")
         
         # Find shortest paths
-        path_finder = PathFinder(metro_network)
+        path_finder = PathFinder(metro_network, engine=engine)
         paths, cost, paths_with_lines = path_finder.find_all_shortest_paths(request.start, request.end)
+        extra = {"debug": path_finder.debug_info()} if debug else {}
         
         if not paths:
             raise HTTPException(status_code=400, detail="No path found")
         
-        # Build structured paths with line sequences (preserves transfer variants)
-        # Use a set to deduplicate identical annotated paths
-        seen_annotated = set()
-        structured_paths = []
-        for path, line_seq in paths_with_lines:
-            structured = metro_network.build_structured_path(path, line_seq)
-            # Use annotated string for deduplication
-            if structured["annotated"] not in seen_annotated:
-                seen_annotated.add(structured["annotated"])
-                structured_paths.append(structured)
+        near_optimal = None
+        if request.alternatives_tolerance is not None:
+            if request.alternatives_tolerance < 0:
+                raise HTTPException(status_code=400, detail="alternatives_tolerance must not be negative")
+            near_optimal = path_finder.find_near_optimal_paths(
+                request.start, request.end, request.alternatives_tolerance, request.alternatives_limit
+            )
         
-        return PathResponse(
-            shortest_cost=float(cost),
-            paths=structured_paths
-        )
+        if compact:
+            table = StringTable.for_network(metro_network)
+            alternatives = None
+            if near_optimal is not None:
+                alternatives = encode_paths(
+                    metro_network, table,
+                    [(path, line_seq) for path, line_seq, _ in near_optimal],
+                    costs=[path_cost for _, _, path_cost in near_optimal],
+                    include_annotated=annotated
+                )
+            # Pre-built payload matching CompactPathResponse
+            return {
+                "format": "compact",
+                **compact_strings(metro_network, strings_version),
+                "shortest_cost": float(cost),
+                "paths": encode_paths(metro_network, table, paths_with_lines, include_annotated=annotated),
+                "alternatives": alternatives,
+                **extra
+            }
+        
+        # Build structured paths with line sequences (preserves transfer variants),
+        # deduplicated on their annotated strings
+        structured_paths = metro_network.build_structured_paths(paths_with_lines)
+        
+        # Optional near-optimal alternatives, ranked by cost and deduplicated the same way
+        alternatives = None
+        if near_optimal is not None:
+            alternatives = metro_network.build_structured_paths(
+                [(path, line_seq) for path, line_seq, _ in near_optimal],
+                costs=[path_cost for _, _, path_cost in near_optimal]
+            )
+        
+        # Pre-built payload matching PathResponse, encoded directly
+        return {
+            "format": "full",
+            "shortest_cost": float(cost),
+            "paths": structured_paths,
+            "alternatives": alternatives,
+            **extra
+        }
     except HTTPException:
         raise
     except ValueError as e:
@@ -222,31 +598,178 @@ async def calculate_path(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/{city}/game/validate-path", response_model=ValidationResponse)
+@router.post("/{city}/game/validate-path", response_model=AnyValidationResponse, response_class=FastJSONResponse)
 async def validate_path(
     request: ValidatePathRequest,
-    city: str = Path(..., description="City code: sz or sh")
+    city: str = Path(..., description="City code: sz or sh"),
+    path_format: str = Query("full", alias="format", description="Path encoding: full or compact"),
+    annotated: bool = Query(False, description="Compact format: also include annotated strings"),
+    strings_version: Optional[str] = Query(None, description="Compact format: string table version the client already has"),
+    engine: Optional[str] = Query(None, description="Path engine (admin debugging): auto or an engine name, default the city's"),
+    debug: bool = Query(False, description="Include engine metadata (debug field)"),
+    x_path_format: Optional[str] = Header(None, description="Alternative to ?format="),
+    x_admin_token: Optional[str] = Header(None, description="Required with ?engine=")
 ):
-    """Validate user's path"""
+    """Validate user's path (against a round session, or the puzzle in the request)"""
+    check_engine(engine, x_admin_token)
+    data = get_city_data(city)
+    metro_network = data.network
+    compact = use_compact_format(path_format, x_path_format)
+    
+    if request.round_id is not None:
+        session = _current_round(request.round_id, city, metro_network)
+        mismatch = _round_mismatch(session, metro_network, request) if session is not None else None
+        if session is not None and mismatch is None:
+            # Solved when the round started: engine only applies to the fallback
+            payload = await run_in_threadpool(
+                _validate_round_path, session, metro_network, request.user_path, compact, annotated,
+                strings_version, debug
+            )
+            return FastJSONResponse(payload)
+        if request.lines is None or request.start is None or request.end is None:
+            if session is None:
+                raise HTTPException(status_code=404, detail=f"Round not found or expired: {request.round_id}")
+            raise HTTPException(
+                status_code=400, detail=f"Request does not match round {request.round_id}: {mismatch} differs"
+            )
+    elif request.lines is None or request.start is None or request.end is None:
+        raise HTTPException(status_code=400, detail="Either round_id or lines, start and end are required")
+    
+    # The shortest-path half only depends on the puzzle, so identical puzzles share it
+    key = (
+        data.version, selection_key(metro_network, request.lines), request.start, request.end,
+        compact, annotated, engine
+    )
+    shortest = await shortest_paths_flight.run(key, lambda: validate_path_admission.run(
+        estimate_cost(metro_network, request.lines), _shortest_paths,
+        metro_network, request.lines, request.start, request.end, compact, annotated, engine
+    ))
+    payload = await run_in_threadpool(
+        _validate_path, metro_network, request.lines, request.start, request.end,
+        request.user_path, shortest, compact, strings_version, debug
+    )
+    return FastJSONResponse(payload)
+
+
+def _current_round(round_id: str, city: str, metro_network: MetroNetwork) -> Optional[RoundSession]:
+    """The round session of round_id if it is a round of this city's current data version"""
+    session = round_store.get(round_id)
+    if session is None or session.city != city or session.version != metro_network.data_version:
+        return None
+    return session
+
+
+def _round_mismatch(session: RoundSession, metro_network: MetroNetwork,
+                    request: ValidatePathRequest) -> Optional[str]:
+    """
+    The first puzzle field (lines, start or end) the request gives that differs
+    from the round's, None if the request is the round's puzzle
+    """
+    if request.start is not None and request.start != session.start:
+        return "start"
+    if request.end is not None and request.end != session.end:
+        return "end"
+    if request.lines is not None:
+        try:
+            if selection_key(metro_network, request.lines) != session.selection:
+                return "lines"
+        except ValueError:
+            return "lines"
+    return None
+
+
+def _validate_round_path(session: RoundSession, metro_network: MetroNetwork, user_path: List[str],
+                         compact: bool, annotated: bool, strings_version: Optional[str],
+                         debug: bool = False) -> dict:
+    """
+    validate-path worker for a round session: reuses its solved shortest paths
+    (metro_network: the session's data version)
+    """
+    view = metro_network.with_lines(list(session.selection))
+    key = (compact, annotated)
+    structured_paths = session.encoded_paths.get(key)
+    if structured_paths is None:
+        if compact:
+            structured_paths = encode_paths(
+                view, StringTable.for_network(view), session.paths_with_lines, include_annotated=annotated
+            )
+        else:
+            structured_paths = view.build_structured_paths(session.paths_with_lines)
+        if session.encoded_paths.setdefault(key, structured_paths) is structured_paths:
+            round_store.grow(session, deep_sizeof(structured_paths))
+    return _validate_path(
+        view, None, session.start, session.end,
+        user_path, (session.shortest_cost, structured_paths, session.debug), compact, strings_version, debug
+    )
+
+
+def _shortest_paths(metro_network: MetroNetwork, lines: List[str], start: str, end: str,
+                    compact: bool, annotated: bool, engine: Optional[str] = None) -> Tuple[Decimal, List[dict], dict]:
+    """
+    validate-path worker: shortest cost, encoded shortest paths and the search's
+    debug info (runs in the thread pool)
+    """
     try:
-        metro_network = get_metro_network(city)
-        metro_network.build_graph(request.lines)
+        metro_network = metro_network.with_lines(lines)
+
+        # Validate stations exist
+        all_stations = metro_network.get_all_stations()
+        if start not in all_stations:
+            raise HTTPException(status_code=400, detail=f"Start station not found: {start}")
+        if end not in all_stations:
+            raise HTTPException(status_code=400, detail=f"End station not found: {end}")
+
+        # Check if reachable
+        if not metro_network.is_reachable(start, end):
+            raise HTTPException(status_code=400, detail="Stations are not reachable")
+
+        path_finder = PathFinder(metro_network, engine=engine)
+        _, shortest_cost, paths_with_lines = path_finder.find_all_shortest_paths(start, end)
+        
+        if compact:
+            structured_paths = encode_paths(
+                metro_network, StringTable.for_network(metro_network), paths_with_lines,
+                include_annotated=annotated
+            )
+        else:
+            # Build structured shortest paths with line sequences (preserves transfer variants),
+            # deduplicated on their annotated strings
+            structured_paths = metro_network.build_structured_paths(paths_with_lines)
+        return shortest_cost, structured_paths, path_finder.debug_info()
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _validate_path(metro_network: MetroNetwork, lines: Optional[List[str]], start: str, end: str,
+                   user_path: List[str], shortest: Tuple[Decimal, List[dict], Optional[dict]],
+                   compact: bool, strings_version: Optional[str], debug: bool = False) -> dict:
+    """
+    validate-path worker: checks the user's path against the shared shortest-path half
+    (lines None: metro_network already is the puzzle's view)
+    """
+    try:
+        if lines is not None:
+            metro_network = metro_network.with_lines(lines)
+        shortest_cost, structured_paths, debug_info = shortest
+        extra_debug = {"debug": debug_info} if debug else {}
+        # Pre-built payloads matching ValidationResponse / CompactValidationResponse, encoded directly
+        extra = {"format": "compact", **compact_strings(metro_network, strings_version)} if compact else {"format": "full"}
         
         # Validate path
         path_validator = PathValidator(metro_network)
-        is_valid, msg = path_validator.validate_path(request.user_path, request.start, request.end)
-        
-        # Get shortest paths for comparison
-        path_finder = PathFinder(metro_network)
-        shortest_paths, shortest_cost, paths_with_lines = path_finder.find_all_shortest_paths(request.start, request.end)
+        is_valid, msg = path_validator.validate_path(user_path, start, end)
         
         if not is_valid:
             # Provide detailed error reason
             error_reason = msg
             if "Start station must be" in msg:
-                error_reason = f"起点错误：你的路径起点是 {request.user_path[0]}，但应该是 {request.start}"
+                error_reason = f"起点错误：你的路径起点是 {user_path[0]}，但应该是 {start}"
             elif "End station must be" in msg:
-                error_reason = f"终点错误：你的路径终点是 {request.user_path[-1]}，但应该是 {request.end}"
+                error_reason = f"终点错误：你的路径终点是 {user_path[-1]}，但应该是 {end}"
             elif "Station does not exist" in msg:
                 error_reason = f"站点不存在：{msg.split(':')[1].strip()} 不在所选线路中"
             elif "not adjacent" in msg:
@@ -255,34 +778,27 @@ async def validate_path(
             elif "Duplicate stations" in msg:
                 error_reason = "路径中有重复站点，请检查你的路径"
             
-            return ValidationResponse(
-                valid=False,
-                is_shortest=False,
-                user_cost=None,
-                shortest_cost=float(shortest_cost),
-                message="路径不合法",
-                error_reason=error_reason,
-                user_path_annotated=None,
-                all_shortest_paths=[]
-            )
+            return {
+                **extra,
+                "valid": False,
+                "is_shortest": False,
+                "user_cost": None,
+                "shortest_cost": float(shortest_cost),
+                "message": "路径不合法",
+                "error_reason": error_reason,
+                "user_path_annotated": None,
+                "all_shortest_paths": [],
+                **extra_debug
+            }
         
         # Calculate user path cost and optimal line sequence (single computation)
-        user_cost, user_line_sequence = path_finder.analyze_path_optimal(request.user_path)
+        path_finder = PathFinder(metro_network)
+        user_cost, user_line_sequence = path_finder.analyze_path_optimal(user_path)
         
         is_shortest = (user_cost == shortest_cost)
         
-        # Build structured shortest paths with line sequences (preserves transfer variants)
-        # Use a set to deduplicate identical annotated paths
-        seen_annotated = set()
-        structured_paths = []
-        for path, line_seq in paths_with_lines:
-            structured = metro_network.build_structured_path(path, line_seq)
-            if structured["annotated"] not in seen_annotated:
-                seen_annotated.add(structured["annotated"])
-                structured_paths.append(structured)
-        
         # Build structured user path with optimal line sequence
-        user_path_structured = metro_network.build_structured_path(request.user_path, user_line_sequence)
+        user_path_structured = metro_network.build_structured_path(user_path, user_line_sequence)
         user_path_annotated = user_path_structured["annotated"]
         
         if is_shortest:
@@ -292,16 +808,70 @@ async def validate_path(
             message = "路径合法但不是最短"
             error_reason = f"你的路径成本是 {float(user_cost)}，但最短路径成本是 {float(shortest_cost)}。请尝试减少换乘或站点数量。"
         
-        return ValidationResponse(
-            valid=True,
-            is_shortest=is_shortest,
-            user_cost=float(user_cost),
-            shortest_cost=float(shortest_cost),
-            message=message,
-            error_reason=error_reason,
-            user_path_annotated=user_path_annotated,
-            all_shortest_paths=structured_paths
-        )
+        return {
+            **extra,
+            "valid": True,
+            "is_shortest": is_shortest,
+            "user_cost": float(user_cost),
+            "shortest_cost": float(shortest_cost),
+            "message": message,
+            "error_reason": error_reason,
+            "user_path_annotated": user_path_annotated,
+            "all_shortest_paths": structured_paths,
+            **extra_debug
+        }
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def map_filter(metro_network: MetroNetwork, lines: Optional[str]):
+    """Stations of the comma-separated lines (None: no filter)"""
+    if not lines:
+        return None
+    return metro_network.get_snapshot([l.strip() for l in lines.split(',')]).station_masks
+
+
+@router.get("/{city}/map/nearest", response_model=MapStationsResponse)
+async def get_nearest_stations(
+    city: str = Path(..., description="City code: sz or sh"),
+    x: float = Query(..., description="Map x coordinate"),
+    y: float = Query(..., description="Map y coordinate"),
+    k: int = Query(1, ge=1, le=50, description="Number of stations"),
+    lines: str = None
+):
+    """The k stations nearest to a map point, optionally only on the selected lines"""
+    try:
+        data = get_city_data(city)
+        index = data.spatial_index
+        nearest = index.nearest(x, y, k, map_filter(data.network, lines))
+        return {"stations": [index.station(i, distance) for i, distance in nearest]}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{city}/map/bbox", response_model=MapStationsResponse, response_model_exclude_none=True)
+async def get_stations_in_box(
+    city: str = Path(..., description="City code: sz or sh"),
+    x_min: float = Query(...),
+    y_min: float = Query(...),
+    x_max: float = Query(...),
+    y_max: float = Query(...),
+    lines: str = None
+):
+    """Stations inside a map rectangle, optionally only on the selected lines"""
+    try:
+        data = get_city_data(city)
+        index = data.spatial_index
+        found = index.in_box(x_min, y_min, x_max, y_max, map_filter(data.network, lines))
+        return {"stations": [index.station(i) for i in found]}
     except HTTPException:
         raise
     except ValueError as e:
@@ -310,68 +880,56 @@ async def validate_path(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/{city}/map/coordinates")
+@router.get("/{city}/map/coordinates", response_class=FastJSONResponse)
 async def get_map_coordinates(city: str = Path(..., description="City code: sz or sh")):
     """Get station coordinates and line information for map visualization"""
     try:
-        data = get_station_coordinates_data(city)
-        lines_data = data.get("lines", {})
-        
-        # Process lines: merge branch lines (e.g., 5号线+) into main lines
-        merged_lines = {}
-        branch_lines = {}  # Temporarily store branch lines
-        
-        for line_name, line_info in lines_data.items():
-            line_data = dict(line_info) if isinstance(line_info, dict) else {}
-            # Set is_loop to False if not present (backward compatible)
-            if "is_loop" not in line_data:
-                line_data["is_loop"] = False
-            
-            if line_name.endswith("+"):
-                # Store branch line for later merging
-                branch_lines[line_name] = line_data
-            else:
-                merged_lines[line_name] = line_data
-        
-        # Merge branch lines into main lines
-        for branch_name, branch_data in branch_lines.items():
-            main_name = branch_name[:-1]  # Remove "+"
-            if main_name in merged_lines:
-                # Add branch stations info to main line
-                main_line = merged_lines[main_name]
-                if "branch_stations" not in main_line:
-                    main_line["branch_stations"] = []
-                # Store branch info: stations list (the branch line's stations)
-                main_line["branch_stations"] = branch_data.get("stations", [])
-        
-        # Process stations: convert "+" line names to main line names in each station's lines array
-        stations_data = data.get("stations", {})
-        processed_stations = {}
-        for station_name, station_info in stations_data.items():
-            processed_station = dict(station_info)
-            if "lines" in processed_station:
-                # Remove "+" suffix from line names
-                processed_station["lines"] = [
-                    line[:-1] if line.endswith("+") else line
-                    for line in processed_station["lines"]
-                ]
-                # Remove duplicates while preserving order
-                seen = set()
-                unique_lines = []
-                for line in processed_station["lines"]:
-                    if line not in seen:
-                        seen.add(line)
-                        unique_lines.append(line)
-                processed_station["lines"] = unique_lines
-            processed_stations[station_name] = processed_station
-        
-        return {
-            "stations": processed_stations,
-            "lines": merged_lines
-        }
+        data = get_city_data(city)
+        payload = data.caches.get("map_payload")
+        if payload is None:
+            # Branch lines (e.g., 5号线+) merged into main lines, built once per data version
+            payload = data.caches["map_payload"] = map_payload(data.coordinates)
+        return FastJSONResponse(payload)
     except HTTPException:
         raise
-    except FileNotFoundError:
-        raise HTTPException(status_code=500, detail="Station coordinates data not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def get_map_tiles(data: CityData) -> MapTiles:
+    """The tile pyramid of a city's data version (built once, in the thread pool)"""
+    tiles = data.caches.get("map_tiles")
+    if tiles is None:
+        tiles = await run_in_threadpool(MapTiles, data.coordinates, data.version)
+        data.caches["map_tiles"] = tiles
+    return tiles
+
+
+@router.get("/{city}/map/tiles")
+async def get_map_tile_index(city: str = Path(..., description="City code: sz or sh")):
+    """Tile grid of the map: square bounds, zoom levels and each tile's ETag"""
+    data = get_city_data(city)
+    return FastJSONResponse((await get_map_tiles(data)).index())
+
+
+@router.get("/{city}/map/tiles/{z}/{x}/{y}")
+async def get_map_tile(
+    city: str = Path(..., description="City code: sz or sh"),
+    z: int = Path(..., description="Zoom level"),
+    x: int = Path(..., description="Tile column"),
+    y: int = Path(..., description="Tile row"),
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    """One map tile: stations and simplified line polylines (gzip, with ETag)"""
+    data = get_city_data(city)
+    tile = (await get_map_tiles(data)).get(z, x, y)
+    if tile is None:
+        raise HTTPException(status_code=404, detail=f"Tile not found: {z}/{x}/{y}")
+    headers = {"ETag": tile.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if if_none_match is not None and tile.etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    if accept_encoding is not None and "gzip" in accept_encoding:
+        headers["Content-Encoding"] = "gzip"
+        return Response(tile.body, media_type="application/json", headers=headers)
+    return Response(gzip.decompress(tile.body), media_type="application/json", headers=headers)
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.services.city_registry import CityRegistry
+from app.services.memory import deep_sizeof, intern_strings
+from app.services.metro_network import MetroNetwork
+from app.services.result_cache import ResultCache
+from app.services.spatial_index import SpatialIndex
+from app.services.state_graph import StateGraph
+from app.services.station_search import StationSearchIndex
+from app.services.wire_format import StringTable
+
+logger = logging.getLogger(__name__)
+
+
+class CityData:
+    """
+    One immutable version of a city's data file: the parsed JSON, the metro
+    network built from it and every cache derived from them.
+
+    Requests take a CityData once and use it until they finish, so a reload
+    that swaps in a newer version never changes data under a running request.
+    Caches live on the version they were built from (network snapshots and
+    tables, `caches` for router-level payloads), so nothing outlives it.
+    """
+
+    def __init__(self, city: str, path: str, raw: bytes, mtime: float, size: int,
+                 result_cache: Optional[ResultCache] = None, path_engine: Optional[str] = None):
+        self.city = city
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.version = hashlib.sha1(raw).hexdigest()[:12]
+        # Parsed once and shared by the network and the map endpoints. Station and
+        # line names recur throughout the file, so they are interned; parsed_bytes
+        # records the saving as (before, after) deep sizes.
+        parsed = json.loads(raw.decode("utf-8"))
+        self.coordinates = intern_strings(parsed)
+        self.parsed_bytes = (deep_sizeof(parsed), deep_sizeof(self.coordinates))
+        del parsed
+        self.network = MetroNetwork(path, data=self.coordinates)
+        self.network.result_cache = result_cache
+        self.network.data_version = self.version
+        self.network.path_engine = path_engine
+        self.spatial_index = SpatialIndex(self.coordinates)
+        self.caches = {}
+        self.last_used = time.monotonic()
+        # Deep size of everything but the snapshot cache, measured by warm()
+        self._static_bytes: Optional[int] = None
+
+    def estimated_size(self) -> int:
+        """
+        Size in bytes: this version without its snapshot cache as measured
+        when it was warmed, plus the snapshots currently cached (each sized
+        as it is built and as tables are added to it, so inserts and
+        evictions count at once). Cheap enough to call on the event loop.
+        """
+        if self._static_bytes is None:
+            self._measure_static()
+        return self._static_bytes + self.network.snapshot_bytes()
+
+    def _measure_static(self) -> None:
+        self._static_bytes = deep_sizeof(self, {id(self.network._snapshots)})
+
+    def memory_report(self) -> dict:
+        """
+        Deep sizes in bytes per part of this version, each shared object
+        charged once, to the first part listed that reaches it (e.g. sets a
+        derived snapshot shares with its base go to the base).
+        """
+        network = self.network
+        seen = set()
+        report = {"version": self.version, "coordinates": deep_sizeof(self.coordinates, seen)}
+
+        # The network without its snapshots and tables (lines, line tables, memos)
+        seen.update(id(part) for part in (
+            network._snapshots, network.tables, network.result_cache,
+            network.snapshot, network.graph, network.station_lines
+        ))
+        report["network"] = deep_sizeof(network, seen)
+
+        snapshots = []
+        for snapshot in list(network._snapshots.values()):
+            seen.add(id(snapshot.tables))
+            entry = {"lines": len(snapshot.lines), "graph": deep_sizeof(snapshot, seen)}
+            entry["tables"] = {
+                name: deep_sizeof(table, seen) for name, table in list(snapshot.tables.items())
+            }
+            snapshots.append(entry)
+        report["snapshots"] = snapshots
+        report["network_tables"] = {
+            name: deep_sizeof(table, seen) for name, table in list(network.tables.items())
+        }
+        report["spatial_index"] = deep_sizeof(self.spatial_index, seen)
+        report["caches"] = {name: deep_sizeof(cache, seen) for name, cache in list(self.caches.items())}
+
+        report["total"] = (
+            report["coordinates"] + report["network"] + report["spatial_index"]
+            + sum(entry["graph"] + sum(entry["tables"].values()) for entry in snapshots)
+            + sum(report["network_tables"].values()) + sum(report["caches"].values())
+        )
+        return report
+
+    @classmethod
+    def load(cls, city: str, path: str, result_cache: Optional[ResultCache] = None,
+             path_engine: Optional[str] = None) -> "CityData":
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            raw = f.read()
+        return cls(city, path, raw, stat.st_mtime, stat.st_size, result_cache, path_engine)
+
+    def warm(self) -> "CityData":
+        """Prebuild the all-lines snapshot, search index and other tables otherwise built on first request"""
+        network = self.network
+        snapshot = network.get_snapshot(network.get_all_lines())
+        StateGraph.for_snapshot(network, snapshot)
+        StringTable.for_network(network)
+        StationSearchIndex.for_network(network)
+        self._measure_static()
+        return self
+
+
+class CityDataStore:
+    """
+    Current data version of every city, with hot reload and idle eviction.
+
+    Cities come from the registry and are loaded on first use. A watcher
+    thread polls the data files of loaded cities (mtime/size first, content
+    hash to confirm), builds and warms the new version in the background and
+    then swaps it in with a single reference assignment; requests never wait
+    for a rebuild. The same thread rescans the registry and, while the loaded
+    cities exceed memory_budget bytes, unloads the least recently used city
+    idle for at least idle_seconds (with its snapshots and tables; it is
+    reloaded on next use). Networks share result_cache (if any) as their
+    persistent second-tier cache.
+    """
+
+    def __init__(self, registry: CityRegistry, poll_interval: float = 2.0,
+                 memory_budget: int = 0, idle_seconds: float = 600.0,
+                 result_cache: Optional[ResultCache] = None):
+        self.registry = registry
+        self.result_cache = result_cache
+        self.poll_interval = poll_interval
+        self.memory_budget = memory_budget  # Bytes, 0 = unlimited
+        self.idle_seconds = idle_seconds
+        self.evictions = 0
+        self._current: Dict[str, CityData] = {}
+        self._load_lock = threading.Lock()
+        # city -> (mtime, size) of a file version that failed to load (None: missing file)
+        self._failed: Dict[str, Optional[tuple]] = {}
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    def get(self, city: str) -> CityData:
+        """Current data version of a city (KeyError if not in the registry)"""
+        data = self._current.get(city)
+        if data is None:
+            info = self.registry.get(city)
+            if info is None:
+                raise KeyError(city)
+            with self._load_lock:
+                data = self._current.get(city)
+                if data is None:
+                    data = CityData.load(city, info.data_file, self.result_cache, info.path_engine).warm()
+                    self._current[city] = data
+        data.last_used = time.monotonic()
+        return data
+
+    def loaded_cities(self) -> List[str]:
+        return list(self._current.keys())
+
+    def check_for_updates(self) -> List[str]:
+        """Reload every loaded city whose data file changed; returns the reloaded cities"""
+        reloaded = []
+        for city, data in list(self._current.items()):
+            file_stat = None  # None: file missing
+            try:
+                stat = os.stat(data.path)
+                file_stat = (stat.st_mtime, stat.st_size)
+                if file_stat == (data.mtime, data.size) or file_stat == self._failed.get(city, ()):
+                    continue
+                with open(data.path, "rb") as f:
+                    raw = f.read()
+                if hashlib.sha1(raw).hexdigest()[:12] == data.version:
+                    # Touched but unchanged: remember the new mtime, keep the version
+                    data.mtime, data.size = stat.st_mtime, stat.st_size
+                    continue
+                info = self.registry.get(city)
+                new_data = CityData(
+                    city, data.path, raw, stat.st_mtime, stat.st_size, self.result_cache,
+                    info.path_engine if info is not None else data.network.path_engine
+                ).warm()
+            except Exception:
+                # Keep serving the old version (e.g. file is mid-write, invalid or
+                # missing), logging once per failed file version
+                if city not in self._failed or self._failed[city] != file_stat:
+                    logger.exception("Reloading data for city %s failed", city)
+                self._failed[city] = file_stat
+                continue
+            new_data.last_used = data.last_used
+            self._current[city] = new_data
+            self._failed.pop(city, None)
+            reloaded.append(city)
+            logger.info("City %s data reloaded: %s -> %s (parsed %d bytes, %d interned)",
+                        city, data.version, new_data.version, *new_data.parsed_bytes)
+        return reloaded
+
+    def start_watcher(self) -> None:
+        if self.poll_interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="city-data-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self) -> None:
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+            self._watcher = None
+
+    def enforce_memory_budget(self) -> List[str]:
+        """Unload idle cities (least recently used first) while over budget; returns them"""
+        if self.memory_budget <= 0:
+            return []
+        sizes = {city: data.estimated_size() for city, data in list(self._current.items())}
+        total = sum(sizes.values())
+        now = time.monotonic()
+        evicted = []
+        for city in sorted(sizes, key=lambda c: self._current[c].last_used):
+            if total <= self.memory_budget:
+                break
+            if now - self._current[city].last_used < self.idle_seconds:
+                break
+            del self._current[city]
+            total -= sizes[city]
+            evicted.append(city)
+            self.evictions += 1
+            logger.info("City %s unloaded (idle, %d bytes)", city, sizes[city])
+        return evicted
+
+    def stats(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        return {
+            city: {
+                "version": data.version,
+                "estimated_bytes": data.estimated_size(),
+                "parsed_bytes": {"before_interning": data.parsed_bytes[0], "after_interning": data.parsed_bytes[1]},
+                "idle_seconds": round(now - data.last_used, 1),
+            }
+            for city, data in list(self._current.items())
+        }
+
+    def memory_report(self) -> Dict[str, dict]:
+        """CityData.memory_report() of every loaded city (without counting as a use)"""
+        return {city: data.memory_report() for city, data in list(self._current.items())}
+
+    def _watch(self) -> None:
+        # Each step on its own: a failing one must not stop the others or the thread
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.registry.discover()
+            except Exception:
+                logger.exception("Rescanning city data files failed")
+            try:
+                self._apply_registry()
+            except Exception:
+                logger.exception("Applying city registry changes failed")
+            try:
+                self.check_for_updates()
+            except Exception:
+                logger.exception("Checking city data files for updates failed")
+            try:
+                self.enforce_memory_budget()
+            except Exception:
+                logger.exception("Enforcing the city data memory budget failed")
+
+    def _apply_registry(self) -> None:
+        """Unload cities no longer in the registry and apply engine changes of the others"""
+        for city in self.loaded_cities():
+            info = self.registry.get(city)
+            if info is None:
+                self._current.pop(city, None)
+                continue
+            # cities.json engine changes apply without a reload (to views taken from now on)
+            data = self._current.get(city)
+            if data is not None:
+                data.network.path_engine = info.path_engine
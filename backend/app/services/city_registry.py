@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+
+class CityInfo(NamedTuple):
+    code: str
+    name: str
+    data_file: str  # Absolute path of the city's stations_coordinates file
+    path_engine: Optional[str] = None  # PathFinder engine (None: auto)
+
+
+class CityRegistry:
+    """
+    Cities served by the API, discovered from the data directory.
+
+    Every `stations_coordinates_{code}.json` file (code: 2-4 lowercase
+    letters, e.g. "bj") is a city. The optional metadata file `cities.json`
+    gives cities their display name and order, can point a city at a file
+    that does not follow the naming scheme ("file"), can hide one
+    ("enabled": false) and can fix its path engine ("engine", see
+    path_engines; default auto):
+
+        {"sz": {"name": "深圳", "file": "stations_coordinates.json"}, ...}
+
+    Cities with metadata come first in metadata order, the others follow by
+    code and are named by their code.
+    """
+
+    FILE_PATTERN = re.compile(r"^stations_coordinates_([a-z]{2,4})\.json$")
+    METADATA_FILE = "cities.json"
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self._cities: Dict[str, CityInfo] = {}
+        self.discover()
+
+    def discover(self) -> Dict[str, CityInfo]:
+        """Rescan the data directory (new or removed files take effect immediately)"""
+        metadata = {}
+        metadata_path = os.path.join(self.data_dir, self.METADATA_FILE)
+        if os.path.exists(metadata_path):
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+
+        discovered = {}
+        for file_name in sorted(os.listdir(self.data_dir)):
+            match = self.FILE_PATTERN.match(file_name)
+            if match:
+                discovered[match.group(1)] = file_name
+
+        cities = {}
+        for code, meta in metadata.items():
+            file_name = meta.get("file", discovered.get(code))
+            if not meta.get("enabled", True) or file_name is None:
+                continue
+            data_file = os.path.join(self.data_dir, file_name)
+            if os.path.exists(data_file):
+                cities[code] = CityInfo(code, meta.get("name", code), data_file, meta.get("engine"))
+        for code, file_name in discovered.items():
+            if code not in cities and code not in metadata:
+                cities[code] = CityInfo(code, code, os.path.join(self.data_dir, file_name))
+
+        self._cities = cities
+        return cities
+
+    def get(self, code: str) -> Optional[CityInfo]:
+        return self._cities.get(code)
+
+    def codes(self) -> List[str]:
+        return list(self._cities.keys())
+
+    def cities(self) -> List[CityInfo]:
+        return list(self._cities.values())
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+from app.services.graph_snapshot import GraphSnapshot
+
+
+class ChainEdge(NamedTuple):
+    """A run of single-line, degree-2 stations between two hub stations"""
+    edge_id: int
+    source: str
+    target: str
+    line: str                   # Line label used along the whole chain
+    line_id: int                # Its LineTables id
+    interior: Tuple[str, ...]   # Stations strictly between source and target
+
+    @property
+    def length(self) -> int:
+        """Number of station-to-station hops (the travel cost)"""
+        return len(self.interior) + 1
+
+
+class ContractedGraph:
+    """
+    Transfer-hub graph for one graph snapshot.
+
+    Hub stations are transfer stations, line ends, Y-branch junctions, loop
+    closure points and one-way loop stations. Every other station sits on a
+    single line with exactly two (two-way) neighbours, so any route through it
+    just keeps going along that line. Each such chain becomes one ChainEdge.
+
+    Query endpoints that are not hubs are handled by the search itself via
+    `chains_of` (see PathFinder), so the graph can be shared by all queries on
+    the snapshot.
+    """
+
+    def __init__(self, network, snapshot: GraphSnapshot):
+        self.hubs: Set[str] = set()
+        self.out_edges: Dict[str, List[ChainEdge]] = defaultdict(list)
+        # Non-hub station -> [(chain edge, index in its interior), ...]
+        self.chains_of: Dict[str, List[Tuple[ChainEdge, int]]] = defaultdict(list)
+        self._edge_count = 0
+        self._build(network, snapshot)
+
+    @classmethod
+    def for_snapshot(cls, network, snapshot: GraphSnapshot) -> "ContractedGraph":
+        """Get the contracted graph of a snapshot (built once and cached on it)"""
+        contracted = snapshot.tables.get("contracted_graph")
+        if contracted is None:
+            contracted = snapshot.add_table("contracted_graph", cls(network, snapshot))
+        return contracted
+
+    def to_dict(self) -> dict:
+        """Plain data of the contracted graph (for the result cache, see StateGraph)"""
+        return {
+            "hubs": sorted(self.hubs),
+            "edges": sorted(
+                (list(edge) for edges in self.out_edges.values() for edge in edges), key=lambda edge: edge[0]
+            )
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ContractedGraph":
+        contracted = cls.__new__(cls)
+        contracted.hubs = set(data["hubs"])
+        contracted.out_edges = defaultdict(list)
+        contracted.chains_of = defaultdict(list)
+        # Edges in id order, i.e. the order _build created and appended them in
+        for edge_id, source, target, line, line_id, interior in data["edges"]:
+            edge = ChainEdge(edge_id, source, target, line, line_id, tuple(interior))
+            contracted.out_edges[source].append(edge)
+            for idx, s in enumerate(edge.interior):
+                contracted.chains_of[s].append((edge, idx))
+        contracted._edge_count = len(data["edges"])
+        return contracted
+
+    def _build(self, network, snapshot: GraphSnapshot) -> None:
+        graph = snapshot.graph
+        masks = snapshot.station_masks
+
+        forced_hubs = set()
+        for line_name in snapshot.lines:
+            stations = network._get_line_stations(line_name)
+            # Loop closure point, so a loop line always has at least one hub
+            if network._is_loop_line(line_name) and stations:
+                forced_hubs.add(stations[0])
+            forced_hubs.update(network.one_way_loops.get(line_name, []))
+
+        def is_simple(s: str) -> bool:
+            mask = masks.get(s, 0)
+            # Exactly one line label
+            if s in forced_hubs or mask == 0 or mask & (mask - 1):
+                return False
+            neighbors = graph[s]
+            return len(neighbors) == 2 and all(s in graph[nb] for nb in neighbors)
+
+        simple = {s for s in list(graph.keys()) if is_simple(s)}
+        self.hubs = set(graph.keys()) - simple
+
+        covered = set()
+        pending = list(self.hubs)
+        while pending:
+            for hub in pending:
+                for first in graph[hub]:
+                    for line_id, interior, target in self._walk(network, snapshot, simple, hub, first):
+                        line = network.line_tables.label_names[line_id]
+                        edge = ChainEdge(self._edge_count, hub, target, line, line_id, interior)
+                        self._edge_count += 1
+                        self.out_edges[hub].append(edge)
+                        for idx, s in enumerate(interior):
+                            self.chains_of[s].append((edge, idx))
+                            covered.add(s)
+            # A cycle made only of simple stations has no hub to start from:
+            # promote one of its stations and walk again from there
+            leftover = simple - covered
+            pending = []
+            if leftover:
+                promoted = min(leftover)
+                simple.discard(promoted)
+                self.hubs.add(promoted)
+                pending = [promoted]
+
+    def _walk(self, network, snapshot: GraphSnapshot, simple: Set[str], hub: str, first: str
+              ) -> List[Tuple[int, Tuple[str, ...], str]]:
+        """Follow the chain from hub via first to the next hub: [(line id, interior, target), ...]"""
+        tables = network.line_tables
+        masks = snapshot.station_masks
+
+        if first not in simple:
+            # Direct hub-to-hub hop: one edge per line on which they are adjacent
+            return [(line_id, (), first) for line_id in tables.hop_labels(masks, hub, first)]
+
+        (line_id,) = tables.ids_of_mask(masks[first])
+        if line_id not in tables.hop_labels(masks, hub, first):
+            return []
+
+        interior = [first]
+        prev, cur = hub, first
+        while True:
+            (nxt,) = snapshot.graph[cur] - {prev}
+            if line_id not in tables.hop_labels(masks, cur, nxt):
+                return []
+            if nxt not in simple:
+                return [(line_id, tuple(interior), nxt)]
+            interior.append(nxt)
+            prev, cur = cur, nxt
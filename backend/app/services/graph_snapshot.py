@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+import sys
+from collections import defaultdict
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from app.services.memory import deep_sizeof
+
+
+class LineContribution(NamedTuple):
+    """What a single (expanded) line adds to a graph snapshot"""
+    stations: Tuple[str, ...]
+    # (station, line label) pairs, e.g. ("东川路", "5号线:B")
+    labels: Tuple[Tuple[str, str], ...]
+    # LineTables bit of each label above
+    label_bits: Tuple[int, ...]
+    # Directed edges (a, b); bidirectional track appears once per direction
+    edges: Tuple[Tuple[str, str], ...]
+    # False if the line's own edges do not form a strongly connected graph
+    strongly_connected: bool
+
+
+class GraphSnapshot:
+    """
+    Station graph and station-line mapping for one set of selected lines.
+
+    A snapshot is the multiset union of its lines' contributions: every edge and
+    every (station, label) pair carries a reference count, so a line can be added
+    or removed without touching the rest of the graph. Snapshots handed out by
+    MetroNetwork must be treated as read-only; derive() returns a new snapshot
+    and only copies the per-station sets the toggled line actually touches.
+    """
+
+    def __init__(self, lines: FrozenSet[str]):
+        self.lines = lines
+        # Plain dicts: looking up a station that is not selected raises KeyError
+        # instead of adding it to a snapshot other views share
+        self.graph = {}
+        self.station_lines = {}
+        # Station -> bitmask of its line labels (bits from the network's LineTables)
+        self.station_masks = {}
+        self._edge_refs = {}   # (a, b) -> number of lines contributing the edge
+        self._label_refs = {}  # (station, label) -> number of lines contributing the label
+        self._station_refs = {}  # station -> number of line occurrences
+        # Lines whose own edges are not strongly connected (e.g. an open one-way section)
+        self._directed_lines = frozenset()
+
+        # Connected components: station -> component id, component id -> stations.
+        # Computed lazily and then carried over incrementally by derive().
+        self._component_of = None
+        self._component_members = None
+        self._next_component_id = 0
+        # Cached (station -> component id, component id -> reachable component ids)
+        self._component_labels = None
+        # Precomputed per-snapshot tables (e.g. the contracted graph), built lazily
+        # by their owners (see add_table) and never carried over by derive()
+        self.tables = {}
+        # Estimated bytes of the graph data this snapshot added (set by build() /
+        # derive()) and of its tables (updated by add_table)
+        self.graph_bytes = 0
+        self.table_bytes = 0
+
+    @classmethod
+    def build(cls, lines: FrozenSet[str], contributions: Dict[str, LineContribution]) -> "GraphSnapshot":
+        """Build a snapshot from scratch"""
+        snapshot = cls(lines)
+        owned = set()
+        for line_name in lines:
+            snapshot._add_contribution(contributions[line_name], owned)
+        snapshot._directed_lines = frozenset(
+            ln for ln in lines if not contributions[ln].strongly_connected
+        )
+        snapshot.graph_bytes = deep_sizeof(snapshot)
+        return snapshot
+
+    def derive(self, lines: FrozenSet[str], contributions: Dict[str, LineContribution]) -> "GraphSnapshot":
+        """
+        Derive the snapshot for `lines` from this one by adding and removing the
+        differing lines' contributions. Cost is proportional to the toggled lines
+        (plus a C-level shallow copy of the top-level dicts).
+        """
+        added = lines - self.lines
+        removed = self.lines - lines
+
+        snapshot = GraphSnapshot(lines)
+        # Share the per-station sets with the parent; copy-on-write below
+        snapshot.graph = dict(self.graph)
+        snapshot.station_lines = dict(self.station_lines)
+        snapshot.station_masks = dict(self.station_masks)
+        snapshot._edge_refs = dict(self._edge_refs)
+        snapshot._label_refs = dict(self._label_refs)
+        snapshot._station_refs = dict(self._station_refs)
+        snapshot._directed_lines = frozenset(
+            ln for ln in lines if not contributions[ln].strongly_connected
+        )
+
+        # Carry components over incrementally when the parent already has them
+        carry_components = self._component_of is not None and not snapshot._directed_lines
+        if carry_components:
+            snapshot._component_of = dict(self._component_of)
+            snapshot._component_members = dict(self._component_members)
+            snapshot._next_component_id = self._next_component_id
+
+        owned = set()  # Stations whose sets have already been copied for this snapshot
+        # Removals first so that splitting only ever sees the reduced graph
+        for line_name in removed:
+            snapshot._remove_contribution(contributions[line_name], owned)
+        if carry_components:
+            for line_name in removed:
+                snapshot._split_components(contributions[line_name].stations)
+
+        for line_name in added:
+            snapshot._add_contribution(contributions[line_name], owned)
+            if carry_components:
+                snapshot._merge_components(contributions[line_name].stations)
+
+        # What it does not share with the parent: its top-level dicts and the
+        # per-station sets it copied (cost proportional to the toggled lines)
+        snapshot.graph_bytes = sum(sys.getsizeof(d) for d in (
+            snapshot.graph, snapshot.station_lines, snapshot.station_masks, snapshot._edge_refs,
+            snapshot._label_refs, snapshot._station_refs, snapshot._component_of or {},
+            snapshot._component_members or {}
+        )) + sum(
+            sys.getsizeof(snapshot.graph[s]) + sys.getsizeof(snapshot.station_lines.get(s, ()))
+            for s in owned if s in snapshot.graph
+        )
+        return snapshot
+
+    def estimated_size(self) -> int:
+        """Bytes this snapshot adds to its network's snapshot cache (graph data and tables)"""
+        return self.graph_bytes + self.table_bytes
+
+    def add_table(self, name: str, table: Any) -> Any:
+        """Cache a table built from this snapshot (the first one stored wins) and account its size"""
+        stored = self.tables.setdefault(name, table)
+        if stored is table:
+            # Tables may share parts (a state graph holds its contracted graph), so they are sized together
+            self.table_bytes = deep_sizeof(self.tables)
+        return stored
+
+    def _own(self, station: str, owned: Set[str]) -> None:
+        """Give this snapshot private copies of a station's adjacency and label sets"""
+        if station in owned:
+            return
+        owned.add(station)
+        if station in self.graph:
+            self.graph[station] = set(self.graph[station])
+        if station in self.station_lines:
+            self.station_lines[station] = set(self.station_lines[station])
+
+    def _add_contribution(self, contribution: LineContribution, owned: Set[str]) -> None:
+        for s in contribution.stations:
+            self._own(s, owned)
+            self._station_refs[s] = self._station_refs.get(s, 0) + 1
+            # Make sure every station of a selected line is a graph node
+            self.graph.setdefault(s, set())
+
+        for (s, label), bit in zip(contribution.labels, contribution.label_bits):
+            key = (s, label)
+            count = self._label_refs.get(key, 0)
+            if count == 0:
+                self.station_lines.setdefault(s, set()).add(label)
+                self.station_masks[s] = self.station_masks.get(s, 0) | bit
+            self._label_refs[key] = count + 1
+
+        for a, b in contribution.edges:
+            self._own(a, owned)
+            key = (a, b)
+            count = self._edge_refs.get(key, 0)
+            if count == 0:
+                self.graph[a].add(b)
+            self._edge_refs[key] = count + 1
+
+    def _remove_contribution(self, contribution: LineContribution, owned: Set[str]) -> None:
+        for a, b in contribution.edges:
+            self._own(a, owned)
+            key = (a, b)
+            count = self._edge_refs[key] - 1
+            if count == 0:
+                del self._edge_refs[key]
+                self.graph[a].discard(b)
+            else:
+                self._edge_refs[key] = count
+
+        for (s, label), bit in zip(contribution.labels, contribution.label_bits):
+            self._own(s, owned)
+            key = (s, label)
+            count = self._label_refs[key] - 1
+            if count == 0:
+                del self._label_refs[key]
+                self.station_lines[s].discard(label)
+                self.station_masks[s] &= ~bit
+            else:
+                self._label_refs[key] = count
+
+        for s in contribution.stations:
+            count = self._station_refs[s] - 1
+            if count == 0:
+                # Station no longer belongs to any selected line
+                del self._station_refs[s]
+                self.graph.pop(s, None)
+                self.station_lines.pop(s, None)
+                self.station_masks.pop(s, None)
+            else:
+                self._station_refs[s] = count
+
+    # ------------------------------------------------------------------
+    # Connected components
+    # ------------------------------------------------------------------
+
+    @property
+    def has_exact_components(self) -> bool:
+        """
+        True if connected components equal mutual reachability.
+        Every selected line is strongly connected on its own (two-way track,
+        loops and closed one-way loops), so their union is too.
+        """
+        return not self._directed_lines
+
+    def _ensure_components(self) -> None:
+        if self._component_of is not None:
+            return
+        # Label into fresh maps and publish _component_of last: requests on other
+        # threads may read the components of the same snapshot concurrently
+        component_of = {}
+        component_members = {}
+        for seed in self.graph.keys():
+            if seed in component_of:
+                continue
+            cid = len(component_members)
+            members = {seed}
+            stack = [seed]
+            while stack:
+                u = stack.pop()
+                for nb in self.graph[u]:
+                    if nb not in members:
+                        members.add(nb)
+                        stack.append(nb)
+            for s in members:
+                component_of[s] = cid
+            component_members[cid] = members
+        self._component_members = component_members
+        self._next_component_id = len(component_members)
+        self._component_of = component_of
+
+    def _label_component(self, seed: str) -> int:
+        """Flood-fill a new component from seed and return its id"""
+        cid = self._next_component_id
+        self._next_component_id += 1
+        members = {seed}
+        stack = [seed]
+        while stack:
+            u = stack.pop()
+            for nb in self.graph[u]:
+                if nb not in members:
+                    members.add(nb)
+                    stack.append(nb)
+        for s in members:
+            self._component_of[s] = cid
+        self._component_members[cid] = members
+        return cid
+
+    def _merge_components(self, stations: Iterable[str]) -> None:
+        """A newly added line connects all of its stations: merge their components"""
+        touched = set()
+        fresh = []
+        for s in stations:
+            cid = self._component_of.get(s)
+            if cid is None:
+                fresh.append(s)
+            else:
+                touched.add(cid)
+
+        if touched:
+            # Relabel the smaller components into the largest one
+            target = max(touched, key=lambda c: len(self._component_members[c]))
+            members = set(self._component_members[target])
+            for cid in touched:
+                if cid == target:
+                    continue
+                for s in self._component_members.pop(cid):
+                    self._component_of[s] = target
+                    members.add(s)
+        else:
+            target = self._next_component_id
+            self._next_component_id += 1
+            members = set()
+
+        for s in fresh:
+            self._component_of[s] = target
+            members.add(s)
+        self._component_members[target] = members
+
+    def _split_components(self, stations: Iterable[str]) -> None:
+        """Re-label the component a removed line used to belong to"""
+        cid = None
+        for s in stations:
+            cid = self._component_of.get(s)
+            if cid is not None:
+                break
+        if cid is None or cid not in self._component_members:
+            return
+
+        old_members = self._component_members.pop(cid)
+        for s in old_members:
+            del self._component_of[s]
+        for s in old_members:
+            if s in self.graph and s not in self._component_of:
+                self._label_component(s)
+
+    def component_of(self, station: str) -> Optional[int]:
+        """Component id of a station (None if the station is not in the graph)"""
+        self._ensure_components()
+        return self._component_of.get(station)
+
+    def component_members(self, station: str) -> Set[str]:
+        """All stations in the same component as station (read-only)"""
+        self._ensure_components()
+        cid = self._component_of.get(station)
+        if cid is None:
+            return set()
+        return self._component_members[cid]
+
+    def components(self) -> List[Set[str]]:
+        """All components (read-only sets)"""
+        self._ensure_components()
+        return list(self._component_members.values())
+
+    def _strong_components(self) -> List[Set[str]]:
+        """Strongly connected components (iterative Tarjan)"""
+        index_of = {}
+        low = {}
+        on_stack = set()
+        stack = []
+        result = []
+        counter = 0
+
+        for root in self.graph.keys():
+            if root in index_of:
+                continue
+            index_of[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.graph[root]))]
+            while work:
+                u, neighbors = work[-1]
+                advanced = False
+                for v in neighbors:
+                    if v not in index_of:
+                        index_of[v] = low[v] = counter
+                        counter += 1
+                        stack.append(v)
+                        on_stack.add(v)
+                        work.append((v, iter(self.graph[v])))
+                        advanced = True
+                        break
+                    if v in on_stack:
+                        low[u] = min(low[u], index_of[v])
+                if advanced:
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[u])
+                if low[u] == index_of[u]:
+                    component = set()
+                    while True:
+                        w = stack.pop()
+                        on_stack.discard(w)
+                        component.add(w)
+                        if w == u:
+                            break
+                    result.append(component)
+        return result
+
+    def component_labels(self) -> Tuple[Dict[str, int], Dict[int, List[int]]]:
+        """
+        Label every station with a component id, computed once per snapshot.
+
+        Returns (station -> component id, component id -> ids of the other
+        components reachable from it). When every selected line is strongly
+        connected the components are plain connected components and the second
+        map is empty; otherwise they are strongly connected components and the
+        second map is the transitive closure of the condensation.
+        """
+        if self._component_labels is not None:
+            return self._component_labels
+
+        if self.has_exact_components:
+            groups = self.components()
+        else:
+            groups = self._strong_components()
+
+        labels = {}
+        # Number components by their smallest station so ids are stable
+        for cid, members in enumerate(sorted(groups, key=min)):
+            for s in members:
+                labels[s] = cid
+
+        reach = {}
+        if not self.has_exact_components:
+            successors = defaultdict(set)
+            for (a, b) in self._edge_refs:
+                if labels[a] != labels[b]:
+                    successors[labels[a]].add(labels[b])
+            for cid in range(len(groups)):
+                seen = set()
+                stack = [cid]
+                while stack:
+                    c = stack.pop()
+                    for nxt in successors[c]:
+                        if nxt not in seen:
+                            seen.add(nxt)
+                            stack.append(nxt)
+                seen.discard(cid)
+                if seen:
+                    reach[cid] = sorted(seen)
+
+        self._component_labels = (labels, reach)
+        return self._component_labels
+
+    def reachable_from(self, station: str) -> Set[str]:
+        """All stations reachable from station, including itself (read-only if exact)"""
+        if self.has_exact_components:
+            return self.component_members(station)
+        labels, reach = self.component_labels()
+        cid = labels.get(station)
+        if cid is None:
+            return set()
+        targets = set(reach.get(cid, ()))
+        targets.add(cid)
+        return {s for s, c in labels.items() if c in targets}
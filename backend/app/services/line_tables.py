@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+# Transfer kinds between two line labels (see LineTables.transfer_kind)
+SAME_LINE = "same"
+CONTINUATION = "continuation"        # Same Y-branch line system, no real transfer
+REVERSE_TRANSFER = "reverse"         # Y-branch :B segment <-> branch line
+TRANSFER = "transfer"                # Different lines
+
+
+class LineTables:
+    """
+    Precomputed line-label tables for one MetroNetwork.
+
+    Every line label (line names plus the virtual "X:B" segments of Y-branch
+    main lines) gets an integer id and a bit. Stations carry a bitmask of their
+    labels (GraphSnapshot.station_masks), hops carry a bitmask of the labels on
+    which the two stations are adjacent, and every (from, to) label pair has a
+    precomputed transfer cost and kind. The search and path annotation use these
+    tables instead of parsing line names.
+    """
+
+    def __init__(self, network):
+        self.label_names: List[str] = []
+        for line_name in network.lines.keys():
+            self.label_names.append(line_name)
+            if line_name in network.main_line_branches:
+                self.label_names.append(f"{line_name}:B")
+        self.label_ids: Dict[str, int] = {name: i for i, name in enumerate(self.label_names)}
+        self.display_names: List[str] = [
+            network._parse_display_line_name(name) for name in self.label_names
+        ]
+
+        # transfers[from_id][to_id] = (cost, junction or None, cost at junction, kind)
+        self.transfers: List[List[Tuple[Decimal, Optional[str], Decimal, str]]] = [
+            [self._classify(network, f, t) for t in self.label_names] for f in self.label_names
+        ]
+
+        # (a, b) -> bitmask of labels on which a and b are consecutive stations
+        self.adjacent_masks: Dict[Tuple[str, str], int] = {}
+        self._build_adjacency(network)
+
+        # mask -> label ids, filled on demand
+        self._ids_of_mask: Dict[int, Tuple[int, ...]] = {0: ()}
+
+    @staticmethod
+    def _classify(network, from_line: str, to_line: str) -> Tuple[Decimal, Optional[str], Decimal, str]:
+        """Transfer cost/kind of a label pair, with the junction override for reverse transfers"""
+        if from_line == to_line:
+            return Decimal("0"), None, Decimal("0"), SAME_LINE
+        if network._parse_is_y_branch_reverse_transfer(from_line, to_line):
+            junction = network.main_line_branches[network._parse_effective_line(from_line)]["junction"]
+            return Decimal("0"), junction, network.reverse_transfer_penalty, REVERSE_TRANSFER
+        if network._parse_is_y_branch_continuation(from_line, to_line):
+            return Decimal("0"), None, Decimal("0"), CONTINUATION
+        return network.transfer_penalty, None, network.transfer_penalty, TRANSFER
+
+    def _build_adjacency(self, network) -> None:
+        labels_of_base = {}
+        for label_id, name in enumerate(self.label_names):
+            base = name.split(":")[0]
+            labels_of_base[base] = labels_of_base.get(base, 0) | (1 << label_id)
+
+        for line_name in network.lines.keys():
+            stations = network._get_line_stations(line_name)
+            pairs = set(zip(stations, stations[1:]))
+            if len(stations) >= 2:
+                pairs.add((stations[-1], stations[0]))
+            loop = network.one_way_loops.get(line_name, [])
+            pairs.update(zip(loop, loop[1:] + loop[:1]))
+            for a, b in pairs:
+                for u, v in ((a, b), (b, a)):
+                    if network._are_adjacent_on_line(u, v, line_name):
+                        key = (u, v)
+                        self.adjacent_masks[key] = self.adjacent_masks.get(key, 0) | labels_of_base[line_name]
+
+    def bit(self, label: str) -> int:
+        return 1 << self.label_ids[label]
+
+    def ids_of_mask(self, mask: int) -> Tuple[int, ...]:
+        """Label ids contained in a bitmask"""
+        ids = self._ids_of_mask.get(mask)
+        if ids is None:
+            ids = tuple(i for i in range(mask.bit_length()) if mask >> i & 1)
+            self._ids_of_mask[mask] = ids
+        return ids
+
+    def hop_labels(self, station_masks: Dict[str, int], u: str, v: str) -> Tuple[int, ...]:
+        """Label ids on which u -> v is a single hop in the current selection"""
+        return self.ids_of_mask(
+            station_masks.get(u, 0) & station_masks.get(v, 0) & self.adjacent_masks.get((u, v), 0)
+        )
+
+    def transfer_cost(self, station: str, from_id: Optional[int], to_id: Optional[int]) -> Decimal:
+        """Transfer cost at station between two label ids (None = no line yet)"""
+        if from_id is None or to_id is None:
+            return Decimal("0")
+        cost, junction, junction_cost, _ = self.transfers[from_id][to_id]
+        if junction is not None and station == junction:
+            return junction_cost
+        return cost
+
+    def transfer_kind(self, from_id: int, to_id: int) -> str:
+        return self.transfers[from_id][to_id][3]
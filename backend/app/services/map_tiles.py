@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import gzip
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+from app.responses import dumps
+
+# Zoom levels 0..MAX_ZOOM; zoom z splits the map square into 2^z x 2^z tiles
+MAX_ZOOM = 3
+# Douglas–Peucker tolerance at zoom z: one pixel of a TILE_PIXELS wide tile
+TILE_PIXELS = 256
+# Decimal places kept for tile coordinates
+PRECISION = 2
+
+
+def display_line(line_name: str) -> str:
+    """Map display name of a line (branch lines "X+" are drawn as their main line X)"""
+    return line_name[:-1] if line_name.endswith("+") else line_name
+
+
+def map_payload(coordinates: dict) -> dict:
+    """
+    The full /map/coordinates payload: branch lines merged into their main
+    lines (as branch_stations) and "+" line names dropped from stations.
+    """
+    lines_data = coordinates.get("lines", {})
+
+    merged_lines = {}
+    branch_lines = {}
+    for line_name, line_info in lines_data.items():
+        line_data = dict(line_info) if isinstance(line_info, dict) else {}
+        # Set is_loop to False if not present (backward compatible)
+        if "is_loop" not in line_data:
+            line_data["is_loop"] = False
+        if line_name.endswith("+"):
+            branch_lines[line_name] = line_data
+        else:
+            merged_lines[line_name] = line_data
+
+    # Merge branch lines into main lines
+    for branch_name, branch_data in branch_lines.items():
+        main_line = merged_lines.get(display_line(branch_name))
+        if main_line is not None:
+            main_line["branch_stations"] = branch_data.get("stations", [])
+
+    # Stations: main line names only, without duplicates, order preserved
+    processed_stations = {}
+    for station_name, station_info in coordinates.get("stations", {}).items():
+        processed_station = dict(station_info)
+        if "lines" in processed_station:
+            processed_station["lines"] = list(dict.fromkeys(
+                display_line(line) for line in processed_station["lines"]
+            ))
+        processed_stations[station_name] = processed_station
+
+    return {"stations": processed_stations, "lines": merged_lines}
+
+
+def simplify(points: List[Tuple[float, float]], tolerance: float) -> List[Tuple[float, float]]:
+    """Douglas–Peucker polyline simplification (endpoints are always kept)"""
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = (dx * dx + dy * dy) ** 0.5
+        worst, worst_distance = None, tolerance
+        for i in range(first + 1, last):
+            px, py = points[i]
+            if length:
+                distance = abs(dy * px - dx * py + x2 * y1 - y2 * x1) / length
+            else:
+                distance = ((px - x1) ** 2 + (py - y1) ** 2) ** 0.5
+            if distance > worst_distance:
+                worst, worst_distance = i, distance
+        if worst is not None:
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return [p for p, kept in zip(points, keep) if kept]
+
+
+class MapTile:
+    """One pre-built tile: gzip-compressed JSON and its ETag"""
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, payload: dict, version: str):
+        raw = dumps(payload)
+        self.body = gzip.compress(raw, compresslevel=9, mtime=0)
+        self.etag = f'"{version}-{hashlib.sha1(raw).hexdigest()[:12]}"'
+
+
+class MapTiles:
+    """
+    Zoom-level tile pyramid of one city data version.
+
+    The map square (the stations' bounding box, widened to a square) is split
+    into 2^z x 2^z tiles per zoom level. A tile holds the stations inside it
+    (at zoom 0 only interchanges and line ends) and, per display line, the
+    runs of the line's polylines passing through it, simplified with
+    Douglas–Peucker to about a pixel at that zoom. Polyline runs keep their
+    first point outside the tile so lines join up across tiles.
+
+    Every tile is built once and kept as compressed bytes with an ETag.
+    """
+
+    def __init__(self, coordinates: dict, version: str):
+        payload = map_payload(coordinates)
+        stations = {
+            name: info for name, info in payload["stations"].items() if "x" in info and "y" in info
+        }
+        xs = [info["x"] for info in stations.values()] or [0.0]
+        ys = [info["y"] for info in stations.values()] or [0.0]
+        self.x0, self.y0 = min(xs), min(ys)
+        self.size = max(max(xs) - self.x0, max(ys) - self.y0, 1.0)
+        self.version = version
+        self.max_zoom = MAX_ZOOM
+
+        # Polylines (station coordinates along each line of the data file) per display line
+        polylines: Dict[str, List[List[Tuple[float, float]]]] = {}
+        colors: Dict[str, Optional[str]] = {}
+        line_ends = set()
+        for line_name, info in coordinates.get("lines", {}).items():
+            names = [s for s in info.get("stations", []) if s in stations]
+            if not names:
+                continue
+            if info.get("is_loop") and len(names) > 1:
+                names = names + names[:1]
+            else:
+                line_ends.update((names[0], names[-1]))
+            points = [(float(stations[s]["x"]), float(stations[s]["y"])) for s in names]
+            polylines.setdefault(display_line(line_name), []).append(points)
+            colors.setdefault(display_line(line_name), info.get("color"))
+
+        self.tiles: Dict[Tuple[int, int, int], MapTile] = {}
+        for z in range(MAX_ZOOM + 1):
+            n = 2 ** z
+            tiles: Dict[Tuple[int, int], dict] = {
+                (tx, ty): {"z": z, "x": tx, "y": ty, "stations": {}, "lines": {}}
+                for tx in range(n) for ty in range(n)
+            }
+            for name, info in stations.items():
+                if z == 0 and len(info.get("lines", [])) < 2 and name not in line_ends:
+                    continue
+                tile = tiles[self.tile_of(z, info["x"], info["y"])]
+                tile["stations"][name] = {
+                    "x": round(info["x"], PRECISION),
+                    "y": round(info["y"], PRECISION),
+                    "lines": info.get("lines", []),
+                }
+
+            tolerance = self.size / n / TILE_PIXELS
+            for line, line_polylines in polylines.items():
+                for points in line_polylines:
+                    self._add_polyline(tiles, z, line, colors[line], simplify(points, tolerance))
+
+            for (tx, ty), tile in tiles.items():
+                self.tiles[(z, tx, ty)] = MapTile(tile, version)
+
+    def tile_of(self, z: int, x: float, y: float) -> Tuple[int, int]:
+        n = 2 ** z
+        tx = min(max(int((x - self.x0) / self.size * n), 0), n - 1)
+        ty = min(max(int((y - self.y0) / self.size * n), 0), n - 1)
+        return tx, ty
+
+    def _add_polyline(self, tiles: Dict[Tuple[int, int], dict], z: int, line: str,
+                      color: Optional[str], points: List[Tuple[float, float]]) -> None:
+        # Each segment goes to every tile its bounding box touches; consecutive
+        # segments in the same tile extend the same run
+        runs: Dict[Tuple[int, int], List[float]] = {}
+        last_segment: Dict[Tuple[int, int], int] = {}
+        for i in range(len(points) - 1):
+            (x1, y1), (x2, y2) = points[i], points[i + 1]
+            tx1, ty1 = self.tile_of(z, min(x1, x2), min(y1, y2))
+            tx2, ty2 = self.tile_of(z, max(x1, x2), max(y1, y2))
+            for tx in range(tx1, tx2 + 1):
+                for ty in range(ty1, ty2 + 1):
+                    key = (tx, ty)
+                    run = runs.get(key)
+                    if run is None or last_segment[key] != i - 1:
+                        if run is not None:
+                            self._flush_run(tiles[key], line, color, run)
+                        run = runs[key] = [round(x1, PRECISION), round(y1, PRECISION)]
+                    run.extend((round(x2, PRECISION), round(y2, PRECISION)))
+                    last_segment[key] = i
+        for key, run in runs.items():
+            self._flush_run(tiles[key], line, color, run)
+
+    @staticmethod
+    def _flush_run(tile: dict, line: str, color: Optional[str], run: List[float]) -> None:
+        entry = tile["lines"].get(line)
+        if entry is None:
+            entry = tile["lines"][line] = {"color": color, "segments": []}
+        # Flat [x0, y0, x1, y1, ...] point lists
+        entry["segments"].append(run)
+
+    def get(self, z: int, x: int, y: int) -> Optional[MapTile]:
+        return self.tiles.get((z, x, y))
+
+    def index(self) -> dict:
+        """Tile grid description for clients: map square, zoom levels and tile ETags"""
+        return {
+            "version": self.version,
+            "x0": self.x0,
+            "y0": self.y0,
+            "size": self.size,
+            "max_zoom": self.max_zoom,
+            "etags": {f"{z}/{x}/{y}": tile.etag for (z, x, y), tile in self.tiles.items()},
+        }
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import sys
+from typing import Any, Dict, Optional, Set
+
+# Shared, immortal or class-level objects that should not be charged to an owner
+_SKIP_TYPES = (type, type(sys), type(len), type(lambda: None))
+
+
+def deep_sizeof(obj: Any, seen: Optional[Set[int]] = None) -> int:
+    """
+    Approximate deep size in bytes of an object graph (sys.getsizeof summed
+    over containers, instance __dict__/__slots__ and their contents).
+
+    Each object is counted once; pass the same `seen` set to several calls to
+    measure what they add on top of each other.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        obj_id = id(obj)
+        if obj_id in seen or isinstance(obj, _SKIP_TYPES):
+            continue
+        seen.add(obj_id)
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+            for slot in getattr(type(obj), "__slots__", ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return total
+
+
+def intern_strings(obj: Any) -> Any:
+    """
+    Copy of a parsed JSON document with every string (keys and values)
+    interned, so each distinct name is a single object however often it
+    occurs.
+    """
+    if isinstance(obj, str):
+        return sys.intern(obj)
+    if isinstance(obj, dict):
+        return {sys.intern(k) if isinstance(k, str) else k: intern_strings(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [intern_strings(item) for item in obj]
+    return obj
+
+
+def process_memory() -> Dict[str, Optional[int]]:
+    """Resident set size of this process and its peak, in bytes (None where unavailable)"""
+    memory = {"rss": None, "peak_rss": None}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    memory["rss"] = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    memory["peak_rss"] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if memory["peak_rss"] is None:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Kilobytes on Linux, bytes on macOS
+            memory["peak_rss"] = peak if sys.platform == "darwin" else peak * 1024
+        except (ImportError, OSError):
+            pass
+    return memory
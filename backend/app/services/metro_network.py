@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
+import copy
 import json
 import random
-from collections import defaultdict
+import threading
+from collections import OrderedDict, defaultdict
 from decimal import Decimal, getcontext
-from typing import Dict, List, Set, Tuple, Union
+from typing import Dict, FrozenSet, List, Set, Tuple, Union
 import os
 
+from app.services.graph_snapshot import GraphSnapshot, LineContribution
+from app.services.line_tables import CONTINUATION, REVERSE_TRANSFER, LineTables
+
 # Set Decimal precision
 getcontext().prec = 28
 
@@ -13,12 +18,15 @@ getcontext().prec = 28
 class MetroNetwork:
     """Shenzhen Metro Network class"""
     
-    def __init__(self, json_file: str = None):
-        """Initialize metro network"""
-        if json_file is None:
-            # Default to stations_coordinates.json in backend directory
-            json_file = os.path.join(os.path.dirname(__file__), "..", "..", "stations_coordinates.json")
-        self.lines = self._load_lines(json_file)
+    def __init__(self, json_file: str = None, data: dict = None):
+        """Initialize metro network (from json_file, or from its already parsed data)"""
+        if data is not None:
+            self.lines = self._extract_lines(data)
+        else:
+            if json_file is None:
+                # Default to stations_coordinates.json in backend directory
+                json_file = os.path.join(os.path.dirname(__file__), "..", "..", "stations_coordinates.json")
+            self.lines = self._load_lines(json_file)
         self.graph = None
         self.station_lines = None
         self.transfer_penalty = Decimal("2.5")
@@ -39,26 +47,51 @@ class MetroNetwork:
         # The loop goes in the order specified (forward only)
         self.one_way_loops = {}
         
+        # Per-line graph contributions (computed once per line, see _get_line_contribution)
+        self._line_contributions = {}
+        # LRU cache of graph snapshots keyed by the expanded line set
+        self._snapshots = OrderedDict()
+        self.max_snapshots = 64
+        self.snapshot = None
+        # Guards the snapshot cache: requests may run on worker threads
+        self._snapshot_lock = threading.RLock()
+        
         # Detect and setup branch lines
         self._detect_branch_lines()
         
         # Detect one-way loops
         self._detect_one_way_loops()
+        
+        # Label ids/bits, hop adjacency masks and transfer cost tables
+        self.line_tables = LineTables(self)
+        # Other precomputed per-network tables, built lazily by their owners
+        self.tables = {}
+        # (from label, to label) -> line change classification, see _transition
+        self._transitions = {}
+        # Optional persistent cache (ResultCache) and the data version its keys use
+        self.result_cache = None
+        self.data_version = None
+        # PathFinder engine of this city (see path_engines; None: auto)
+        self.path_engine = None
     
     def _load_lines(self, json_file: str) -> Dict[str, Union[List[str], dict]]:
         """Load line data from JSON file (stations_coordinates.json)"""
         try:
             with open(json_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                # Extract the "lines" field from stations_coordinates.json
-                # Format: {"lines": {"1号线": {"color": "#...", "stations": [...], "is_loop": false}, ...}}
-                if "lines" in data:
-                    return data["lines"]
-                # Fallback: if it's the old lines.json format (direct line mapping)
-                return data
+                return self._extract_lines(json.load(f))
         except Exception as e:
             raise RuntimeError(f"Cannot read stations_coordinates.json: {e}")
     
+    @staticmethod
+    def _extract_lines(data: dict) -> Dict[str, Union[List[str], dict]]:
+        """Line data of a parsed data file"""
+        # Extract the "lines" field from stations_coordinates.json
+        # Format: {"lines": {"1号线": {"color": "#...", "stations": [...], "is_loop": false}, ...}}
+        if "lines" in data:
+            return data["lines"]
+        # Fallback: if it's the old lines.json format (direct line mapping)
+        return data
+    
     def _get_line_stations(self, line_name: str) -> List[str]:
         """
         Get stations list for a line (supports both old and new format).
@@ -240,6 +273,14 @@ class MetroNetwork:
         """
         return self.branch_to_main.get(line_name, line_name)
     
+    def _parse_effective_line(self, label: str) -> str:
+        """
+        Get effective line name of a line label, including virtual segments.
+        e.g., "5号线:B" -> "5号线", "5号线+" -> "5号线"
+        """
+        base = label.split(":")[0] if ":" in label else label
+        return self._get_effective_line_name(base)
+    
     def _is_branch_reverse_transfer(self, station: str, from_line: str, to_line: str) -> bool:
         """
         Check if transfer at station between from_line and to_line is a branch reverse transfer.
@@ -298,108 +339,208 @@ class MetroNetwork:
         # Reverse transfer needed if crossing between segments
         return (from_in_main_end and to_in_branch) or (from_in_branch and to_in_main_end)
     
-    def build_graph(self, selected_line_names: List[str]) -> None:
-        """Build graph structure and station-line mapping
+    def _expand_lines(self, selected_line_names: List[str]) -> List[str]:
+        """Auto-include branch lines when main line is selected"""
+        expanded_lines = list(selected_line_names)
+        for line_name in selected_line_names:
+            if line_name in self.main_line_branches:
+                branch_line = self.main_line_branches[line_name]["branch"]
+                if branch_line not in expanded_lines:
+                    expanded_lines.append(branch_line)
+        return expanded_lines
+    
+    def _get_line_contribution(self, line_name: str) -> LineContribution:
+        """
+        Get the station labels and edges a single line adds to the graph.
         
         For Y-branch lines, stations are assigned to virtual line segments:
         - Stations from main_start to junction: use main line name (e.g., "5号线")
         - Stations from junction to main_end: use main line + ":B" (e.g., "5号线:B")
         - Stations on branch line: use branch line name (e.g., "5号线+")
         - Junction station belongs to all three: "5号线", "5号线:B", "5号线+"
-        
-        This allows proper detection of reverse transfers at the junction.
         """
-        # Auto-include branch lines when main line is selected
-        expanded_lines = list(selected_line_names)
-        for line_name in selected_line_names:
-            if line_name in self.main_line_branches:
-                branch_line = self.main_line_branches[line_name]["branch"]
-                if branch_line not in expanded_lines:
-                    expanded_lines.append(branch_line)
+        if line_name in self._line_contributions:
+            return self._line_contributions[line_name]
+        
+        stations = self._get_line_stations(line_name)
+        is_loop = self._is_loop_line(line_name)
+        labels = []
+        edges = []
+        
+        # Check if this is a Y-branch main line with branch segment info
+        if line_name in self.main_line_branches and line_name in self.branch_segments:
+            branch_info = self.main_line_branches[line_name]
+            segments = self.branch_segments[line_name]
+            junction = branch_info["junction"]
+            main_end_segment = segments["main_end_segment"]
+            
+            # Assign stations to appropriate virtual line segments
+            for s in stations:
+                if s == junction:
+                    # Junction belongs to both main line and :B segment
+                    labels.append((s, line_name))  # 5号线
+                    labels.append((s, f"{line_name}:B"))  # 5号线:B
+                elif s in main_end_segment:
+                    # B segment (from junction to main_end)
+                    labels.append((s, f"{line_name}:B"))  # 5号线:B
+                else:
+                    # A segment (from main_start to junction)
+                    labels.append((s, line_name))  # 5号线
+        elif line_name in self.branch_to_main:
+            # This is a branch line (e.g., 5号线+)
+            main_line = self.branch_to_main[line_name]
+            junction = self.main_line_branches[main_line]["junction"]
+            for s in stations:
+                labels.append((s, line_name))  # 5号线+
+                if s == junction:
+                    # Junction also belongs to main line and :B
+                    labels.append((s, main_line))  # 5号线
+                    labels.append((s, f"{main_line}:B"))  # 5号线:B
+        else:
+            # Normal line (no Y-branch)
+            for s in stations:
+                labels.append((s, line_name))
+        
+        # Check if this line has a one-way loop
+        one_way_loop_stations = self.one_way_loops.get(line_name, [])
+        one_way_loop_set = set(one_way_loop_stations)
+        
+        # Connect adjacent stations
+        for a, b in zip(stations, stations[1:]):
+            # Check if this edge is within a one-way loop
+            if a in one_way_loop_set and b in one_way_loop_set:
+                # Within one-way loop: check direction
+                idx_a = one_way_loop_stations.index(a)
+                idx_b = one_way_loop_stations.index(b)
+                # Only add forward direction edge
+                if (idx_a + 1) % len(one_way_loop_stations) == idx_b:
+                    edges.append((a, b))
+                # Note: reverse direction within loop is handled by the loop closing edge
+            else:
+                # Normal bidirectional edge
+                edges.append((a, b))
+                edges.append((b, a))
+        
+        # For loop lines, connect last station to first station
+        if is_loop and len(stations) >= 2:
+            edges.append((stations[-1], stations[0]))
+            edges.append((stations[0], stations[-1]))
+        
+        # For one-way loops, add the closing edge (last -> first in loop)
+        if one_way_loop_stations and len(one_way_loop_stations) >= 2:
+            edges.append((one_way_loop_stations[-1], one_way_loop_stations[0]))
+        
+        contribution = LineContribution(
+            stations=tuple(stations),
+            labels=tuple(labels),
+            label_bits=tuple(self.line_tables.bit(label) for _, label in labels),
+            edges=tuple(edges),
+            strongly_connected=self._is_strongly_connected(stations, edges)
+        )
+        self._line_contributions[line_name] = contribution
+        return contribution
+    
+    @staticmethod
+    def _is_strongly_connected(stations: List[str], edges: List[Tuple[str, str]]) -> bool:
+        """Check that every station can reach and be reached from the first one"""
+        if len(stations) <= 1:
+            return True
+        forward = defaultdict(list)
+        backward = defaultdict(list)
+        for a, b in edges:
+            forward[a].append(b)
+            backward[b].append(a)
+        
+        everything = set(stations)
+        for adjacency in (forward, backward):
+            seen = {stations[0]}
+            stack = [stations[0]]
+            while stack:
+                u = stack.pop()
+                for nb in adjacency[u]:
+                    if nb not in seen:
+                        seen.add(nb)
+                        stack.append(nb)
+            if seen != everything:
+                return False
+        return True
+    
+    def get_snapshot(self, selected_line_names: List[str]) -> GraphSnapshot:
+        """
+        Get the graph snapshot for a line selection.
         
+        Snapshots are cached per expanded line set. A missing snapshot is derived
+        from the closest cached one (typically the selection before a single line
+        was toggled), so its cost is proportional to the toggled lines rather
+        than to the whole network.
+        """
+        expanded_lines = self._expand_lines(selected_line_names)
         if not self._validate_lines(expanded_lines):
             raise ValueError("Invalid line names")
         
-        self.graph = defaultdict(set)
-        self.station_lines = defaultdict(set)
-        
-        # Track which lines are actually selected (for branch line handling)
-        self._selected_lines = set(expanded_lines)
-        
-        for line_name in expanded_lines:
-            stations = self._get_line_stations(line_name)
-            is_loop = self._is_loop_line(line_name)
-            effective_line = self._get_effective_line_name(line_name)
+        key = frozenset(expanded_lines)
+        with self._snapshot_lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None:
+                self._snapshots.move_to_end(key)
+                return snapshot
             
-            # Check if this is a Y-branch main line with branch segment info
-            if line_name in self.main_line_branches and line_name in self.branch_segments:
-                branch_info = self.main_line_branches[line_name]
-                segments = self.branch_segments[line_name]
-                junction = branch_info["junction"]
-                main_end_segment = segments["main_end_segment"]
-                
-                # Assign stations to appropriate virtual line segments
-                for s in stations:
-                    if s == junction:
-                        # Junction belongs to both main line and :B segment
-                        self.station_lines[s].add(line_name)  # 5号线
-                        self.station_lines[s].add(f"{line_name}:B")  # 5号线:B
-                    elif s in main_end_segment:
-                        # B segment (from junction to main_end)
-                        self.station_lines[s].add(f"{line_name}:B")  # 5号线:B
-                    else:
-                        # A segment (from main_start to junction)
-                        self.station_lines[s].add(line_name)  # 5号线
-            elif line_name in self.branch_to_main:
-                # This is a branch line (e.g., 5号线+)
-                main_line = self.branch_to_main[line_name]
-                if main_line in self.main_line_branches:
-                    junction = self.main_line_branches[main_line]["junction"]
-                    for s in stations:
-                        self.station_lines[s].add(line_name)  # 5号线+
-                        if s == junction:
-                            # Junction also belongs to main line and :B
-                            self.station_lines[s].add(main_line)  # 5号线
-                            self.station_lines[s].add(f"{main_line}:B")  # 5号线:B
-                else:
-                    for s in stations:
-                        self.station_lines[s].add(line_name)
+            contributions = {ln: self._get_line_contribution(ln) for ln in key}
+            base = self._closest_snapshot(key)
+            if base is None:
+                snapshot = GraphSnapshot.build(key, contributions)
             else:
-                # Normal line (no Y-branch)
-                for s in stations:
-                    self.station_lines[s].add(line_name)
-            
-            # Check if this line has a one-way loop
-            one_way_loop_stations = self.one_way_loops.get(line_name, [])
-            one_way_loop_set = set(one_way_loop_stations)
-            
-            # Connect adjacent stations
-            for a, b in zip(stations, stations[1:]):
-                # Check if this edge is within a one-way loop
-                if a in one_way_loop_set and b in one_way_loop_set:
-                    # Within one-way loop: check direction
-                    idx_a = one_way_loop_stations.index(a)
-                    idx_b = one_way_loop_stations.index(b)
-                    # Only add forward direction edge
-                    if (idx_a + 1) % len(one_way_loop_stations) == idx_b:
-                        self.graph[a].add(b)
-                    # Note: reverse direction within loop is handled by the loop closing edge
-                else:
-                    # Normal bidirectional edge
-                    self.graph[a].add(b)
-                    self.graph[b].add(a)
-            
-            # For loop lines, connect last station to first station
-            if is_loop and len(stations) >= 2:
-                self.graph[stations[-1]].add(stations[0])
-                self.graph[stations[0]].add(stations[-1])
+                for ln in base.lines - key:
+                    contributions[ln] = self._get_line_contribution(ln)
+                snapshot = base.derive(key, contributions)
             
-            # For one-way loops, add the closing edge (last -> first in loop)
-            if one_way_loop_stations and len(one_way_loop_stations) >= 2:
-                loop_last = one_way_loop_stations[-1]
-                loop_first = one_way_loop_stations[0]
-                # Add closing edge: last station -> first station of one-way loop
-                self.graph[loop_last].add(loop_first)
+            self._snapshots[key] = snapshot
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+            return snapshot
+    
+    def snapshot_bytes(self) -> int:
+        """Estimated size of the cached snapshots and their tables (accounted as they are built)"""
+        return sum(snapshot.estimated_size() for snapshot in list(self._snapshots.values()))
+    
+    def _closest_snapshot(self, key: FrozenSet[str]) -> Union[GraphSnapshot, None]:
+        """Find the cached snapshot that is cheapest to derive from (None if a rebuild is cheaper)"""
+        best = None
+        best_cost = sum(len(self._get_line_stations(ln)) for ln in key)
+        # Most recently used first: ties go to the selection the user just had
+        for lines, snapshot in reversed(self._snapshots.items()):
+            cost = sum(len(self._get_line_stations(ln)) for ln in lines ^ key)
+            if cost < best_cost:
+                best, best_cost = snapshot, cost
+        return best
+    
+    def use_snapshot(self, snapshot: GraphSnapshot) -> None:
+        """Make a snapshot the current graph (graph / station_lines)"""
+        self.snapshot = snapshot
+        self.graph = snapshot.graph
+        self.station_lines = snapshot.station_lines
+        # Track which lines are actually selected (for branch line handling)
+        self._selected_lines = set(snapshot.lines)
+    
+    def with_lines(self, selected_line_names: List[str]) -> "MetroNetwork":
+        """
+        A view of this network with the graph of a line selection, like build_graph()
+        but without changing this instance: the view shares all data, tables and
+        caches, and only has its own graph / station_lines / snapshot. Use it when
+        requests may run concurrently.
+        """
+        view = copy.copy(self)
+        view.use_snapshot(self.get_snapshot(selected_line_names))
+        return view
+    
+    def build_graph(self, selected_line_names: List[str]) -> None:
+        """Build graph structure and station-line mapping
+        
+        See _get_line_contribution() for how Y-branch lines are split into
+        virtual line segments, which allows proper detection of reverse
+        transfers at the junction.
+        """
+        self.use_snapshot(self.get_snapshot(selected_line_names))
     
     def _validate_lines(self, user_lines: List[str]) -> bool:
         """Validate if line names exist"""
@@ -437,6 +578,17 @@ class MetroNetwork:
         if self.graph is None:
             raise RuntimeError("Please build graph first")
         
+        if start == end:
+            return True
+        
+        if self.snapshot is not None:
+            labels, reach = self.snapshot.component_labels()
+            if start not in labels or end not in labels:
+                return False
+            if labels[start] == labels[end]:
+                return True
+            return labels[end] in reach.get(labels[start], ())
+        
         stack = [start]
         visited = {start}
         
@@ -444,7 +596,7 @@ class MetroNetwork:
             u = stack.pop()
             if u == end:
                 return True
-            for nb in self.graph[u]:
+            for nb in self.graph.get(u, ()):
                 if nb not in visited:
                     visited.add(nb)
                     stack.append(nb)
@@ -459,15 +611,18 @@ class MetroNetwork:
         if start not in self.graph:
             raise ValueError(f"Station {start} not found in current graph")
         
-        stack = [start]
-        visited = {start}
-        
-        while stack:
-            u = stack.pop()
-            for nb in self.graph[u]:
-                if nb not in visited:
-                    visited.add(nb)
-                    stack.append(nb)
+        if self.snapshot is not None:
+            visited = set(self.snapshot.reachable_from(start))
+        else:
+            stack = [start]
+            visited = {start}
+            
+            while stack:
+                u = stack.pop()
+                for nb in self.graph[u]:
+                    if nb not in visited:
+                        visited.add(nb)
+                        stack.append(nb)
         
         # Exclude start station itself
         visited.discard(start)
@@ -482,24 +637,27 @@ class MetroNetwork:
         if len(all_nodes) < 2:
             raise RuntimeError("Not enough stations")
         
-        visited = set()
-        components = []
-        
-        for s in all_nodes:
-            if s in visited:
-                continue
-            comp = []
-            stack = [s]
-            visited.add(s)
-            while stack:
-                v = stack.pop()
-                comp.append(v)
-                for nb in self.graph[v]:
-                    if nb not in visited:
-                        visited.add(nb)
-                        stack.append(nb)
-            if len(comp) >= 2:
-                components.append(comp)
+        if self.snapshot is not None and self.snapshot.has_exact_components:
+            components = [list(c) for c in self.snapshot.components() if len(c) >= 2]
+        else:
+            visited = set()
+            components = []
+            
+            for s in all_nodes:
+                if s in visited:
+                    continue
+                comp = []
+                stack = [s]
+                visited.add(s)
+                while stack:
+                    v = stack.pop()
+                    comp.append(v)
+                    for nb in self.graph[v]:
+                        if nb not in visited:
+                            visited.add(nb)
+                            stack.append(nb)
+                if len(comp) >= 2:
+                    components.append(comp)
         
         if not components:
             raise RuntimeError("No valid connected component")
@@ -523,6 +681,16 @@ class MetroNetwork:
         if from_line is None or to_line is None:
             return Decimal("0")
         
+        label_ids = self.line_tables.label_ids
+        if from_line in label_ids and to_line in label_ids:
+            return self.line_tables.transfer_cost(station, label_ids[from_line], label_ids[to_line])
+        return self._parse_transfer_cost(station, from_line, to_line)
+    
+    def _parse_transfer_cost(self, station: str, from_line: str, to_line: str) -> Decimal:
+        """Transfer cost worked out from the line names (fallback for unknown labels)"""
+        if from_line is None or to_line is None:
+            return Decimal("0")
+        
         # Same line, no transfer cost
         if from_line == to_line:
             return Decimal("0")
@@ -587,6 +755,13 @@ class MetroNetwork:
         """
         if line_name is None:
             return None
+        label_id = self.line_tables.label_ids.get(line_name)
+        if label_id is not None:
+            return self.line_tables.display_names[label_id]
+        return self._parse_display_line_name(line_name)
+    
+    def _parse_display_line_name(self, line_name: str) -> str:
+        """Display name worked out from the line name (used to build LineTables)"""
         # Remove virtual segment suffix (e.g., "5号线:B" -> "5号线")
         if ":" in line_name:
             return line_name.split(":")[0]
@@ -606,6 +781,16 @@ class MetroNetwork:
         - "5号线:B" -> "5号线+": NOT continuation (B to C, needs reverse)
         - "5号线+" -> "5号线:B": NOT continuation (C to B, needs reverse)
         """
+        if from_line is None or to_line is None:
+            return False
+        label_ids = self.line_tables.label_ids
+        if from_line != to_line and from_line in label_ids and to_line in label_ids:
+            kind = self.line_tables.transfer_kind(label_ids[from_line], label_ids[to_line])
+            return kind == CONTINUATION
+        return self._parse_is_y_branch_continuation(from_line, to_line)
+    
+    def _parse_is_y_branch_continuation(self, from_line: str, to_line: str) -> bool:
+        """Y-branch continuation check worked out from the line names (used to build LineTables)"""
         if from_line is None or to_line is None:
             return False
         
@@ -640,6 +825,16 @@ class MetroNetwork:
         Check if switching from from_line to to_line is a Y-branch reverse transfer.
         This is when going from B segment to branch segment (or vice versa).
         """
+        if from_line is None or to_line is None:
+            return False
+        label_ids = self.line_tables.label_ids
+        if from_line in label_ids and to_line in label_ids:
+            kind = self.line_tables.transfer_kind(label_ids[from_line], label_ids[to_line])
+            return kind == REVERSE_TRANSFER
+        return self._parse_is_y_branch_reverse_transfer(from_line, to_line)
+    
+    def _parse_is_y_branch_reverse_transfer(self, from_line: str, to_line: str) -> bool:
+        """Y-branch reverse transfer check worked out from the line names (used to build LineTables)"""
         if from_line is None or to_line is None:
             return False
         
@@ -661,41 +856,75 @@ class MetroNetwork:
         
         return (from_is_b and to_is_branch) or (from_is_branch and to_is_b)
     
-    def _annotate_with_line_sequence(self, path: List[str], line_sequence: List[str]) -> str:
-        """Annotate path using pre-computed optimal line sequence"""
-        annotated = []
+    def line_change_markers(self, line_sequence: List[str]) -> Tuple[List[int], Tuple]:
+        """
+        Work out where a line sequence actually transfers.
         
-        for i in range(len(path)):
-            station = path[i]
+        Returns (transfers, markers):
+        - transfers: station indices where a transfer happens (Y-branch continuations excluded)
+        - markers: ((station index, from display line, to display line or None), ...) for each
+          transfer that shows up in the annotated text; None marks a Y-branch reverse transfer.
+          Together with the stations, markers fully determine the annotated string.
+        """
+        transfers = []
+        markers = []
+        for i in range(1, len(line_sequence)):
+            prev_line = line_sequence[i - 1]
             current_line = line_sequence[i]
             
-            if i == 0:
-                annotated.append(station)
-            else:
-                prev_line = line_sequence[i - 1]
-                
-                # Check if transfer happened at previous station
-                if prev_line is not None and current_line is not None and prev_line != current_line:
-                    # Check for Y-branch continuation (no actual transfer)
-                    if self._is_y_branch_continuation(prev_line, current_line):
-                        # No transfer annotation needed
-                        pass
-                    elif self._is_y_branch_reverse_transfer(prev_line, current_line):
-                        # Reverse transfer at Y-branch junction
-                        # Use only the main line name (they're the same after display conversion)
-                        line_display = self._get_display_line_name(prev_line)
-                        annotated[-1] = f"{annotated[-1]}({line_display}反向换乘)"
-                    else:
-                        # Normal transfer between different lines
-                        prev_display = self._get_display_line_name(prev_line)
-                        curr_display = self._get_display_line_name(current_line)
-                        if prev_display != curr_display:
-                            annotated[-1] = f"{annotated[-1]}({prev_display}换乘{curr_display})"
-                
-                annotated.append(station)
+            # Check if transfer happened at previous station
+            if prev_line is None or current_line is None or prev_line == current_line:
+                continue
+            is_transfer, marker = self._transition(prev_line, current_line)
+            if is_transfer:
+                # Transfer happens at station i-1 (the station before line change)
+                transfers.append(i - 1)
+                if marker is not None:
+                    markers.append((i - 1,) + marker)
+        return transfers, tuple(markers)
+    
+    def _transition(self, prev_line: str, current_line: str) -> Tuple[bool, Union[Tuple, None]]:
+        """
+        Classify a line change (memoized per label pair).
         
+        Returns (is_transfer, marker): is_transfer is False for Y-branch continuations;
+        marker is (from display line, to display line or None) when the transfer shows up
+        in the annotated text, None marking a Y-branch reverse transfer.
+        """
+        key = (prev_line, current_line)
+        transition = self._transitions.get(key)
+        if transition is None:
+            if self._is_y_branch_continuation(prev_line, current_line):
+                # Y-branch continuation (no actual transfer)
+                transition = (False, None)
+            elif self._is_y_branch_reverse_transfer(prev_line, current_line):
+                # Reverse transfer at Y-branch junction
+                # Use only the main line name (they're the same after display conversion)
+                transition = (True, (self._get_display_line_name(prev_line), None))
+            else:
+                # Normal transfer between different lines
+                prev_display = self._get_display_line_name(prev_line)
+                curr_display = self._get_display_line_name(current_line)
+                transition = (True, (prev_display, curr_display) if prev_display != curr_display else None)
+            self._transitions[key] = transition
+        return transition
+    
+    @staticmethod
+    def _annotate_with_markers(path: List[str], markers: Tuple) -> str:
+        """Render the annotated path string from line_change_markers() output"""
+        annotated = list(path)
+        for idx, prev_display, curr_display in markers:
+            if curr_display is None:
+                annotated[idx] = f"{annotated[idx]}({prev_display}反向换乘)"
+            else:
+                annotated[idx] = f"{annotated[idx]}({prev_display}换乘{curr_display})"
         return " → ".join(annotated)
     
+    def _annotate_with_line_sequence(self, path: List[str], line_sequence: List[str]) -> str:
+        """Annotate path using pre-computed optimal line sequence"""
+        _, markers = self.line_change_markers(line_sequence)
+        return self._annotate_with_markers(path, markers)
+    
     def _annotate_greedy(self, path: List[str]) -> str:
         """Annotate path using greedy line selection (fallback method)"""
         assert self.station_lines is not None
@@ -759,23 +988,16 @@ class MetroNetwork:
             - transfers: List of station indices where transfer happens
             - colors: List of line colors (one per station)
         """
-        annotated = self.annotate_path_with_transfers(path, line_sequence)
-        
         # Convert line sequence to display-friendly names
         display_lines = [self._get_display_line_name(ln) for ln in line_sequence]
         
-        # Calculate transfer indices (where actual transfer happens)
-        # Exclude Y-branch continuations (same direction, no actual transfer)
-        transfers = []
-        for i in range(1, len(line_sequence)):
-            prev_line = line_sequence[i - 1]
-            curr_line = line_sequence[i]
-            if prev_line and curr_line and prev_line != curr_line:
-                # Skip Y-branch continuations
-                if self._is_y_branch_continuation(prev_line, curr_line):
-                    continue
-                # Transfer happens at station i-1 (the station before line change)
-                transfers.append(i - 1)
+        if path and self.station_lines is not None and line_sequence is not None and len(line_sequence) == len(path):
+            # Transfer indices exclude Y-branch continuations (same direction, no actual transfer)
+            transfers, markers = self.line_change_markers(line_sequence)
+            annotated = self._annotate_with_markers(path, markers)
+        else:
+            annotated = self.annotate_path_with_transfers(path, line_sequence)
+            transfers, _ = self.line_change_markers(line_sequence)
         
         return {
             "annotated": annotated,
@@ -783,3 +1005,65 @@ class MetroNetwork:
             "lines": display_lines,  # Use display-friendly line names
             "transfers": transfers
         }
+    
+    def build_structured_paths(self, paths_with_lines: List[Tuple[List[str], List[str]]],
+                               costs: List[Decimal] = None) -> List[dict]:
+        """
+        Build structured paths for a whole path set, dropping duplicates.
+        
+        Same output as calling build_structured_path() per path and keeping the first
+        of each annotated string, but paths are deduplicated on their line-change
+        signature (stations + transfer markers) before any string is built, and line
+        change classification, display names and transfer annotations are shared
+        across the set. With costs, each entry also gets its "cost".
+        """
+        structured_paths = []
+        seen_signatures = set()
+        seen_annotated = set()
+        display_names = {None: None}
+        annotations = {}
+        
+        for n, (path, line_sequence) in enumerate(paths_with_lines):
+            if not (path and self.station_lines is not None and line_sequence is not None
+                    and len(line_sequence) == len(path)):
+                structured = self.build_structured_path(path, line_sequence)
+            else:
+                transfers, markers = self.line_change_markers(line_sequence)
+                signature = (tuple(path), markers)
+                if signature in seen_signatures:
+                    continue
+                seen_signatures.add(signature)
+                
+                annotated = list(path)
+                for idx, prev_display, curr_display in markers:
+                    annotation = annotations.get((prev_display, curr_display))
+                    if annotation is None:
+                        if curr_display is None:
+                            annotation = f"({prev_display}反向换乘)"
+                        else:
+                            annotation = f"({prev_display}换乘{curr_display})"
+                        annotations[(prev_display, curr_display)] = annotation
+                    annotated[idx] += annotation
+                
+                lines = []
+                for line_name in line_sequence:
+                    display = display_names.get(line_name)
+                    if display is None and line_name not in display_names:
+                        display = self._get_display_line_name(line_name)
+                        display_names[line_name] = display
+                    lines.append(display)
+                
+                structured = {
+                    "annotated": " → ".join(annotated),
+                    "stations": path,
+                    "lines": lines,
+                    "transfers": transfers
+                }
+            
+            if structured["annotated"] in seen_annotated:
+                continue
+            seen_annotated.add(structured["annotated"])
+            if costs is not None:
+                structured["cost"] = float(costs[n])
+            structured_paths.append(structured)
+        return structured_paths
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Engine name that picks by benchmark results (see select_engine)
+AUTO = "auto"
+# auto's choice when there are no usable benchmark results for a size class
+DEFAULT_ENGINE = "compiled"
+# Size classes by station count of the searched graph: (name, max stations), smallest first
+SIZE_CLASSES = (("xs", 40), ("s", 120), ("m", 300), ("l", None))
+# Benchmark results written by compare_engines.py --record
+BENCHMARKS_FILE = os.environ.get(
+    "METRO_ENGINE_BENCHMARKS",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                 "path_engine_benchmarks.json")
+)
+
+
+class PathEngine(NamedTuple):
+    """
+    A shortest-path search PathFinder can run. Functions take the PathFinder
+    (for its network and counters) first:
+
+        find_all_shortest_paths(path_finder, start, end) -> (paths, cost, paths_with_lines)
+        find_all_shortest_paths_from(path_finder, start, ends) -> {end: (...)}, ends other than start
+
+    Engines without a single-source search are run once per end. All engines
+    must give the same cost and paths as the others (compare_engines.py).
+    """
+    name: str
+    find_all_shortest_paths: Callable
+    find_all_shortest_paths_from: Optional[Callable] = None
+    needs_snapshot: bool = True  # Searches the snapshot's contracted graph / tables
+
+
+ENGINES: Dict[str, PathEngine] = {}
+
+
+def register_engine(engine: PathEngine) -> None:
+    ENGINES[engine.name] = engine
+
+
+def engine_names() -> List[str]:
+    return [AUTO] + list(ENGINES)
+
+
+def size_class(stations: int) -> str:
+    for name, max_stations in SIZE_CLASSES:
+        if max_stations is None or stations <= max_stations:
+            return name
+    return SIZE_CLASSES[-1][0]
+
+
+class EngineBenchmarks:
+    """
+    Recorded per-pair search times by size class and engine:
+
+        {"size_classes": {"m": {"compiled": {"pairs": 5145, "seconds": 2.6, "mismatches": 0, "order": 0}, ...}}}
+
+    best() is the fastest registered engine of a size class with no errors or
+    cost / path mismatches against the reference. Order-only differences
+    ("order") do not count: PathFinder serves every engine's paths sorted.
+    """
+
+    def __init__(self, size_classes: Dict[str, Dict[str, dict]]):
+        self.size_classes = size_classes
+
+    @classmethod
+    def load(cls, path: str) -> "EngineBenchmarks":
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(json.load(f).get("size_classes", {}))
+        except FileNotFoundError:
+            return cls({})
+        except (OSError, ValueError, AttributeError):
+            logger.exception("Reading path engine benchmarks %s failed, using %s", path, DEFAULT_ENGINE)
+            return cls({})
+
+    def best(self, size_class_name: str) -> Optional[str]:
+        timings = {
+            name: result["seconds"] / result["pairs"]
+            for name, result in self.size_classes.get(size_class_name, {}).items()
+            if name in ENGINES and result.get("pairs") and not result.get("mismatches")
+        }
+        return min(timings, key=timings.get) if timings else None
+
+
+_benchmarks: Optional[EngineBenchmarks] = None
+_benchmarks_lock = threading.Lock()
+
+
+def benchmarks() -> EngineBenchmarks:
+    """The benchmark results of BENCHMARKS_FILE (read once)"""
+    global _benchmarks
+    if _benchmarks is None:
+        with _benchmarks_lock:
+            if _benchmarks is None:
+                _benchmarks = EngineBenchmarks.load(BENCHMARKS_FILE)
+    return _benchmarks
+
+
+def select_engine(name: Optional[str], stations: int) -> PathEngine:
+    """The engine to run for a requested name (None or "auto": by benchmarks) on a graph of this size"""
+    if name is None or name == AUTO:
+        name = benchmarks().best(size_class(stations)) or DEFAULT_ENGINE
+    engine = ENGINES.get(name)
+    if engine is None:
+        raise ValueError(f"Unknown path engine: {name} (one of {', '.join(engine_names())})")
+    return engine
@@ -2,23 +2,400 @@
 import heapq
 from collections import defaultdict
 from decimal import Decimal
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
+from app.services.contracted_graph import ContractedGraph
 from app.services.metro_network import MetroNetwork
+from app.services.path_engines import ENGINES, PathEngine, register_engine, select_engine, size_class
+from app.services.state_graph import COST_SCALE, StateGraph, from_half_units
+
+
+def _in_path_order(result: tuple) -> tuple:
+    """
+    An engine's (paths, cost, paths_with_lines) with equal-cost paths sorted by
+    stations, then lines. Backtracking order depends on set iteration (and so on
+    the hash seed) and differs between engines; the first path is the one the
+    game shows, so every engine's result is served in this order.
+    """
+    _, cost, paths_with_lines = result
+    if len(paths_with_lines) > 1:
+        paths_with_lines = sorted(paths_with_lines, key=lambda pl: (pl[0], [ln or "" for ln in pl[1]]))
+    return [path for path, _ in paths_with_lines], cost, paths_with_lines
+
+
+def _encode_result(result: tuple) -> dict:
+    """Plain data of a (paths, cost, paths_with_lines) result for the result cache"""
+    _, cost, paths_with_lines = result
+    return {"cost": str(cost), "paths_with_lines": paths_with_lines}
+
+
+def _decode_result(data: dict) -> tuple:
+    paths_with_lines = [(list(path), list(lines)) for path, lines in data["paths_with_lines"]]
+    return [path for path, _ in paths_with_lines], Decimal(data["cost"]), paths_with_lines
 
 
 class PathFinder:
     """Path finding class using Dijkstra algorithm"""
     
-    def __init__(self, metro_network: MetroNetwork):
-        """Initialize path finder"""
+    # Caps for near-optimal route enumeration (find_near_optimal_paths)
+    max_alternative_tolerance = Decimal("6")
+    max_alternatives = 50
+    
+    def __init__(self, metro_network: MetroNetwork, contract: bool = True, compiled: bool = True,
+                 engine: Optional[str] = None):
+        """Initialize path finder
+        
+        Shortest-path searches run on a registered engine (see path_engines),
+        all with identical results:
+            expanded:   Dijkstra over the full station graph
+            contracted: Dijkstra over the snapshot's transfer-hub graph
+            compiled:   Dial's algorithm over the hub graph's precompiled
+                        integer-cost state graph
+        
+        Args:
+            engine: Engine name, or "auto" to pick by recorded benchmark results
+                    for the graph's size class. Defaults to the city's engine
+                    (network.path_engine), else auto.
+            contract: False selects the expanded engine (if engine is not given).
+            compiled: False selects the contracted engine (if engine is not given).
+        
+        Searches with an explicitly chosen engine (engine, contract or compiled
+        given) always run it; otherwise results are shared through the
+        network's result cache.
+        """
         self.network = metro_network
+        self.use_result_cache = engine is None and contract and compiled
+        if engine is None:
+            if not contract:
+                engine = "expanded"
+            elif not compiled:
+                engine = "contracted"
+            else:
+                engine = metro_network.path_engine
+        self.requested_engine = engine
+        self.engine: Optional[PathEngine] = None  # Engine of the last shortest-path search
+        self.settled_states = 0  # States settled by the last shortest-path search
+        self.cached = False  # Last shortest-path search served from the result cache
         self._path_cache = {}  # Cache for path analysis results
+        self._cost_to_go_cache = {}  # end -> _cost_to_go(end), reused by near-optimal searches
+    
+    def _select_engine(self) -> PathEngine:
+        engine = select_engine(self.requested_engine, len(self.network.graph))
+        if engine.needs_snapshot and self.network.snapshot is None:
+            # Graphs built without a snapshot can only be searched station by station
+            engine = ENGINES["expanded"]
+        self.engine = engine
+        self.settled_states = 0
+        self.cached = False
+        return engine
+    
+    def debug_info(self) -> dict:
+        """Engine metadata of the last shortest-path search (for responses' debug field)"""
+        stations = len(self.network.graph) if self.network.graph is not None else 0
+        if self.cached:
+            engine = "cache"
+        else:
+            engine = self.engine.name if self.engine is not None else None
+        return {
+            "engine": engine,
+            "requested_engine": self.requested_engine or "auto",
+            "size_class": size_class(stations),
+            "stations": stations,
+            "settled_states": self.settled_states
+        }
     
-    def find_all_shortest_paths(self, start: str, end: str) -> Tuple[List[List[str]], Decimal]:
+    def find_all_shortest_paths(self, start: str, end: str) -> Tuple[List[List[str]], Decimal, list]:
         """Find all shortest paths using Dijkstra algorithm"""
         if self.network.graph is None or self.network.station_lines is None:
             raise RuntimeError("Please build metro network graph first")
         
+        engine = self._select_engine()
+        cache = self.network.result_cache if self.use_result_cache else None
+        if cache is None or self.network.data_version is None or self.network.snapshot is None:
+            return _in_path_order(engine.find_all_shortest_paths(self, start, end))
+        # Engines agree on the paths and, once sorted, on their order, so they share results
+        key = (
+            "shortest_paths", self.network.data_version,
+            tuple(sorted(self.network.snapshot.lines)), start, end
+        )
+        result = cache.get(key, _decode_result)
+        if result is not None:
+            self.cached = True
+            return result
+        result = _in_path_order(engine.find_all_shortest_paths(self, start, end))
+        cache.put(key, result, _encode_result)
+        return result
+    
+    def _find_all_shortest_paths_contracted(self, start: str, end: str) -> Tuple[List[List[str]], Decimal, list]:
+        """
+        Dijkstra over (hub, line) states of the contracted graph.
+        
+        A chain edge from state (u, u_line) costs its hop count plus the transfer
+        cost at u, exactly like walking it station by station. Non-hub endpoints
+        are handled here: the start walks its own chain out to the nearest hubs,
+        and any chain edge whose interior contains the end also relaxes the end.
+        """
+        contracted = ContractedGraph.for_snapshot(self.network, self.network.snapshot)
+        tables = self.network.line_tables
+        
+        if start == end:
+            return [[start]], Decimal("0"), [([start], [None])]
+        
+        # States are (node, line id); the start state has no line yet
+        dist = defaultdict(lambda: Decimal("Infinity"))
+        # (node, line id) -> [((prev_node, prev_line_id), chain edge, from_idx, to_idx), ...]
+        # The stations between prev_node and node are edge.interior[from_idx:to_idx]
+        parents = defaultdict(list)
+        # Chain edge id -> position of the end station in its interior
+        end_hits = {edge.edge_id: idx for edge, idx in contracted.chains_of.get(end, ())}
+        
+        pq = []
+        counter = 0
+        
+        def relax(state, cost, parent):
+            nonlocal counter
+            if cost < dist[state]:
+                dist[state] = cost
+                parents[state] = [parent]
+                counter += 1
+                heapq.heappush(pq, (cost, counter, state))
+            elif cost == dist[state]:
+                parents[state].append(parent)
+        
+        start_state = (start, None)
+        dist[start_state] = Decimal("0")
+        
+        if start in contracted.hubs:
+            heapq.heappush(pq, (Decimal("0"), counter, start_state))
+        else:
+            # Walk out of the start's chain towards its hubs (and the end, if it is on the way)
+            for edge, idx in contracted.chains_of.get(start, ()):
+                remaining = len(edge.interior) - idx
+                end_idx = end_hits.get(edge.edge_id)
+                if end_idx is not None and end_idx > idx:
+                    relax((end, edge.line_id), Decimal(end_idx - idx), (start_state, edge, idx + 1, end_idx))
+                relax((edge.target, edge.line_id), Decimal(remaining), (start_state, edge, idx + 1, len(edge.interior)))
+        
+        self.settled_states = 0
+        while pq:
+            cur_cost, _, state = heapq.heappop(pq)
+            
+            if cur_cost != dist[state]:
+                continue
+            self.settled_states += 1
+            
+            u, u_line = state
+            for edge in contracted.out_edges.get(u, ()):
+                # Transfer table handles both normal transfers and Y-branch reverse transfers
+                base = cur_cost + tables.transfer_cost(u, u_line, edge.line_id)
+                end_idx = end_hits.get(edge.edge_id)
+                if end_idx is not None:
+                    relax((end, edge.line_id), base + Decimal(end_idx + 1), (state, edge, 0, end_idx))
+                relax((edge.target, edge.line_id), base + Decimal(edge.length), (state, edge, 0, len(edge.interior)))
+        
+        # Find minimum cost for all (end, line) states
+        best_cost = Decimal("Infinity")
+        best_states = []
+        for (node, line), c in dist.items():
+            if node == end:
+                if c < best_cost:
+                    best_cost = c
+                    best_states = [(node, line)]
+                elif c == best_cost:
+                    best_states.append((node, line))
+        
+        if best_cost == Decimal("Infinity"):
+            return [], best_cost, []
+        
+        # Backtrack all shortest paths, expanding chain edges back into stations
+        all_paths_with_lines = []
+        
+        def backtrack(state, acc_nodes, acc_lines):
+            node = state[0]
+            if node == start:
+                path = list(reversed(acc_nodes + [node]))
+                line_seq = list(reversed(acc_lines + [None]))
+                all_paths_with_lines.append((path, line_seq))
+                return
+            for prev_state, edge, from_idx, to_idx in parents[state]:
+                between = edge.interior[from_idx:to_idx]
+                nodes = acc_nodes + [node] + list(reversed(between))
+                lines = acc_lines + [edge.line] * (len(between) + 1)
+                backtrack(prev_state, nodes, lines)
+        
+        for state in best_states:
+            backtrack(state, [], [])
+        
+        all_paths = [path for path, _ in all_paths_with_lines]
+        
+        return all_paths, best_cost, all_paths_with_lines
+    
+    def _find_all_shortest_paths_compiled(self, start: str, end: str) -> Tuple[List[List[str]], Decimal, list]:
+        """
+        Dial's algorithm over the snapshot's precompiled StateGraph.
+        
+        Costs are integers in half units, so the priority queue is an array of
+        FIFO buckets indexed by cost; states of equal cost are settled in the
+        order they were queued, like the heap search's (cost, counter) entries,
+        so parents and path order come out the same. Non-hub endpoints are
+        handled as in _find_all_shortest_paths_contracted, with per-query state
+        ids past the compiled ones.
+        """
+        if start == end:
+            return [[start]], Decimal("0"), [([start], [None])]
+        search = self._search_compiled(start, [end])
+        return self._collect_compiled(search, end)
+    
+    def find_all_shortest_paths_from(self, start: str, ends: List[str]) -> Dict[str, Tuple]:
+        """
+        find_all_shortest_paths(start, end) for many ends, with a single search
+        if the engine has one. Returns {end: (paths, cost, paths_with_lines)}
+        for the ends other than start.
+        """
+        if self.network.graph is None or self.network.station_lines is None:
+            raise RuntimeError("Please build metro network graph first")
+        engine = self._select_engine()
+        ends = [end for end in ends if end != start]
+        if engine.find_all_shortest_paths_from is not None:
+            results = engine.find_all_shortest_paths_from(self, start, ends)
+        else:
+            results = {end: engine.find_all_shortest_paths(self, start, end) for end in ends}
+        return {end: _in_path_order(result) for end, result in results.items()}
+    
+    def _find_all_shortest_paths_from_compiled(self, start: str, ends: List[str]) -> Dict[str, Tuple]:
+        """
+        The compiled search settles every state reachable from start whatever
+        the end is; ends only add sink states (an end inside a chain), so one
+        search with all of them yields exactly the per-pair results.
+        """
+        search = self._search_compiled(start, ends)
+        return {end: self._collect_compiled(search, end) for end in ends}
+    
+    def _search_compiled(self, start: str, ends: List[str]) -> tuple:
+        """The Dial search of _find_all_shortest_paths_compiled, with sink states for all of ends"""
+        state_graph = StateGraph.for_snapshot(self.network, self.network.snapshot)
+        contracted = state_graph.contracted
+        state_ids = state_graph.state_ids
+        out_edges = state_graph.out_edges
+        
+        # Per-query states: a non-hub start, and the ends reached inside a chain
+        extra_states = {}
+        
+        def state_id(state):
+            sid = state_ids.get(state)
+            if sid is None:
+                sid = extra_states.get(state)
+                if sid is None:
+                    sid = len(state_graph.states) + len(extra_states)
+                    extra_states[state] = sid
+            return sid
+        
+        dist = {}
+        # state id -> [(prev state id, chain edge, from_idx, to_idx), ...], as in the heap search
+        parents = {}
+        buckets = [[]]
+        # chain edge id -> [(end, index in its interior), ...]
+        end_hits = defaultdict(list)
+        for end in ends:
+            for edge, idx in contracted.chains_of.get(end, ()):
+                end_hits[edge.edge_id].append((end, idx))
+        
+        def relax(sid, cost, parent):
+            known = dist.get(sid)
+            if known is None or cost < known:
+                dist[sid] = cost
+                parents[sid] = [parent]
+                while len(buckets) <= cost:
+                    buckets.append([])
+                buckets[cost].append(sid)
+            elif cost == known:
+                parents[sid].append(parent)
+        
+        start_sid = state_id((start, None))
+        dist[start_sid] = 0
+        
+        if start in contracted.hubs:
+            buckets[0].append(start_sid)
+        else:
+            for edge, idx in contracted.chains_of.get(start, ()):
+                remaining = len(edge.interior) - idx
+                for end, end_idx in end_hits.get(edge.edge_id, ()):
+                    if end_idx > idx:
+                        relax(state_id((end, edge.line_id)), (end_idx - idx) * COST_SCALE,
+                              (start_sid, edge, idx + 1, end_idx))
+                relax(state_ids[(edge.target, edge.line_id)], remaining * COST_SCALE,
+                      (start_sid, edge, idx + 1, len(edge.interior)))
+        
+        n_compiled = len(out_edges)
+        settled = 0
+        cost = 0
+        # Every edge costs at least one hop, so a bucket never grows while it is scanned
+        while cost < len(buckets):
+            for sid in buckets[cost]:
+                if dist[sid] != cost:
+                    continue
+                settled += 1
+                if sid >= n_compiled:
+                    continue
+                for target, edge_cost, transfer, edge in out_edges[sid]:
+                    for end, end_idx in end_hits.get(edge.edge_id, ()):
+                        relax(state_id((end, edge.line_id)), cost + transfer + (end_idx + 1) * COST_SCALE,
+                              (sid, edge, 0, end_idx))
+                    relax(target, cost + edge_cost, (sid, edge, 0, len(edge.interior)))
+            cost += 1
+        self.settled_states = settled
+        
+        # Station -> its reached state ids, in the order they were first reached
+        states = state_graph.states
+        id_states = {sid: state for state, sid in extra_states.items()}
+        reached = defaultdict(list)
+        for sid in dist:
+            reached[(states[sid] if sid < n_compiled else id_states[sid])[0]].append(sid)
+        return start, start_sid, dist, parents, reached, states, id_states, n_compiled
+    
+    def _collect_compiled(self, search: tuple, end: str) -> Tuple[List[List[str]], Decimal, list]:
+        """Shortest paths to end out of a _search_compiled result"""
+        start, start_sid, dist, parents, reached, states, id_states, n_compiled = search
+        
+        # Find minimum cost for all (end, line) states
+        best_cost = None
+        best_states = []
+        for sid in reached.get(end, ()):
+            c = dist[sid]
+            if best_cost is None or c < best_cost:
+                best_cost = c
+                best_states = [sid]
+            elif c == best_cost:
+                best_states.append(sid)
+        
+        if best_cost is None:
+            return [], Decimal("Infinity"), []
+        
+        # Backtrack all shortest paths, expanding chain edges back into stations
+        all_paths_with_lines = []
+        
+        def backtrack(sid, acc_nodes, acc_lines):
+            if sid == start_sid:
+                path = list(reversed(acc_nodes + [start]))
+                line_seq = list(reversed(acc_lines + [None]))
+                all_paths_with_lines.append((path, line_seq))
+                return
+            node = (states[sid] if sid < n_compiled else id_states[sid])[0]
+            for prev_sid, edge, from_idx, to_idx in parents[sid]:
+                between = edge.interior[from_idx:to_idx]
+                nodes = acc_nodes + [node] + list(reversed(between))
+                lines = acc_lines + [edge.line] * (len(between) + 1)
+                backtrack(prev_sid, nodes, lines)
+        
+        for sid in best_states:
+            backtrack(sid, [], [])
+        
+        all_paths = [path for path, _ in all_paths_with_lines]
+        
+        return all_paths, from_half_units(best_cost), all_paths_with_lines
+    
+    def _find_all_shortest_paths_expanded(self, start: str, end: str) -> Tuple[List[List[str]], Decimal, list]:
+        """Reference Dijkstra over (station, line) states of the full station graph"""
+        
         dist = defaultdict(lambda: Decimal("Infinity"))
         parents = defaultdict(list)
         
@@ -26,13 +403,15 @@ class PathFinder:
         dist[(start, None)] = Decimal("0")
         heapq.heappush(pq, (Decimal("0"), start, None))
         
+        self.settled_states = 0
         while pq:
             cur_cost, u, u_line = heapq.heappop(pq)
             
             if cur_cost != dist[(u, u_line)]:
                 continue
+            self.settled_states += 1
             
-            for v in self.network.graph[u]:
+            for v in self.network.graph.get(u, ()):
                 # Find lines where u and v are both present
                 common_lines = self.network.station_lines[u] & self.network.station_lines[v]
                 
@@ -69,7 +448,7 @@ class PathFinder:
                     best_states.append((node, line))
         
         if best_cost == Decimal("Infinity"):
-            return [], best_cost
+            return [], best_cost, []
         
         # Backtrack all shortest paths with line sequences
         all_paths_with_lines = []
@@ -93,6 +472,150 @@ class PathFinder:
         
         return all_paths, best_cost, all_paths_with_lines
     
+    def _hop_labels(self, u: str, v: str) -> Tuple[int, ...]:
+        """Line label ids on which u -> v is a single hop"""
+        if self.network.snapshot is not None:
+            return self.network.line_tables.hop_labels(self.network.snapshot.station_masks, u, v)
+        # Graph assigned without a snapshot: work it out from the line names
+        label_ids = self.network.line_tables.label_ids
+        common_lines = self.network.station_lines[u] & self.network.station_lines[v]
+        return tuple(sorted(
+            label_ids[ln] for ln in common_lines if self.network._are_adjacent_on_line(u, v, ln)
+        ))
+    
+    def _station_labels(self, station: str) -> Tuple[int, ...]:
+        """Line label ids of a station"""
+        tables = self.network.line_tables
+        if self.network.snapshot is not None:
+            return tables.ids_of_mask(self.network.snapshot.station_masks.get(station, 0))
+        return tuple(sorted(tables.label_ids[ln] for ln in self.network.station_lines[station]))
+    
+    def _cost_to_go(self, end: str) -> dict:
+        """
+        Reverse Dijkstra from end over (station, line) states.
+        Returns {(station, arrival line id): minimum remaining cost to reach end}.
+        """
+        cached = self._cost_to_go_cache.get(end)
+        if cached is not None:
+            return cached
+        graph = self.network.graph
+        tables = self.network.line_tables
+        reverse = defaultdict(list)
+        for u, neighbors in graph.items():
+            for v in neighbors:
+                reverse[v].append(u)
+        
+        dist = {}
+        pq = []
+        counter = 0
+        for line in self._station_labels(end) + (None,):
+            dist[(end, line)] = Decimal("0")
+            pq.append((Decimal("0"), counter, end, line))
+            counter += 1
+        heapq.heapify(pq)
+        
+        while pq:
+            cost, _, v, v_line = heapq.heappop(pq)
+            if cost != dist.get((v, v_line)) or v_line is None:
+                continue
+            for u in reverse[v]:
+                if v_line not in self._hop_labels(u, v):
+                    continue
+                for u_line in self._station_labels(u) + (None,):
+                    new_cost = cost + Decimal("1") + tables.transfer_cost(u, u_line, v_line)
+                    if new_cost < dist.get((u, u_line), Decimal("Infinity")):
+                        dist[(u, u_line)] = new_cost
+                        counter += 1
+                        heapq.heappush(pq, (new_cost, counter, u, u_line))
+        self._cost_to_go_cache[end] = dist
+        return dist
+    
+    def find_near_optimal_paths(self, start: str, end: str, tolerance: Decimal,
+                                limit: int = 20) -> List[Tuple[List[str], List[str], Decimal]]:
+        """
+        Enumerate simple paths whose cost is within `tolerance` of the optimum.
+        
+        Best-first search over partial paths, ordered by cost so far plus the exact
+        remaining cost from a reverse Dijkstra pass (_cost_to_go). That bound is
+        consistent, so complete paths come out in non-decreasing cost order and any
+        branch that cannot finish within optimum + tolerance is never expanded.
+        
+        Each station path is reported with the line sequence(s) achieving its own
+        minimum cost (transfer variants of equal cost are kept, costlier ones are not).
+        
+        Returns: [(path, line_sequence, cost), ...] ranked by cost, at most `limit`
+        distinct station paths.
+        """
+        if self.network.graph is None or self.network.station_lines is None:
+            raise RuntimeError("Please build metro network graph first")
+        
+        tolerance = min(max(Decimal(str(tolerance)), Decimal("0")), self.max_alternative_tolerance)
+        limit = max(1, min(int(limit), self.max_alternatives))
+        
+        if start == end:
+            return [([start], [None], Decimal("0"))]
+        
+        cost_to_go = self._cost_to_go(end)
+        best = cost_to_go.get((start, None))
+        if best is None:
+            return []
+        bound = best + tolerance
+        tables = self.network.line_tables
+        
+        hop_labels_cache = {}
+        results = []
+        path_costs = {}  # station path -> its minimum cost
+        
+        # Heap entries: (estimate, counter, cost, station, line id, parent entry)
+        counter = 0
+        pq = [(best, counter, Decimal("0"), start, None, None)]
+        while pq:
+            estimate, _, cost, u, u_line, parent = heapq.heappop(pq)
+            entry = (u, u_line, parent)
+            
+            if u == end:
+                nodes, lines = [], []
+                node = entry
+                while node is not None:
+                    nodes.append(node[0])
+                    lines.append(node[1])
+                    node = node[2]
+                path = tuple(reversed(nodes))
+                if path not in path_costs:
+                    if len(path_costs) >= limit:
+                        break
+                    path_costs[path] = cost
+                if cost == path_costs[path]:
+                    line_sequence = [
+                        None if ln is None else tables.label_names[ln] for ln in reversed(lines)
+                    ]
+                    results.append((list(path), line_sequence, cost))
+                continue
+            
+            visited = set()
+            node = entry
+            while node is not None:
+                visited.add(node[0])
+                node = node[2]
+            
+            for v in self.network.graph.get(u, ()):
+                if v in visited:
+                    continue
+                key = (u, v)
+                if key not in hop_labels_cache:
+                    hop_labels_cache[key] = self._hop_labels(u, v)
+                for line in hop_labels_cache[key]:
+                    remaining = cost_to_go.get((v, line))
+                    if remaining is None:
+                        continue
+                    new_cost = cost + Decimal("1") + tables.transfer_cost(u, u_line, line)
+                    if new_cost + remaining > bound:
+                        continue
+                    counter += 1
+                    heapq.heappush(pq, (new_cost + remaining, counter, new_cost, v, line, entry))
+        
+        return results
+    
     def analyze_path_optimal(self, path: List[str]) -> Tuple[Decimal, List[str]]:
         """
         Analyze path using dynamic programming to find optimal line selection.
@@ -110,7 +633,8 @@ class PathFinder:
             return self._path_cache[path_key]
         
         n = len(path)
-        # dp[i][line] = (minimum cost to reach station i using line, previous line)
+        tables = self.network.line_tables
+        # dp[i][line id] = (minimum cost to reach station i using line, previous line id)
         dp = [defaultdict(lambda: (Decimal("Infinity"), None)) for _ in range(n)]
         
         # Initialize first station (no cost, no line)
@@ -119,13 +643,8 @@ class PathFinder:
         # Forward pass: compute minimum costs
         for i in range(n - 1):
             u, v = path[i], path[i + 1]
-            common_lines = self.network.station_lines[u] & self.network.station_lines[v]
-            
             # Find valid lines where u and v are adjacent (supports loop lines)
-            valid_lines = []
-            for line_name in common_lines:
-                if self.network._are_adjacent_on_line(u, v, line_name):
-                    valid_lines.append(line_name)
+            valid_lines = self._hop_labels(u, v)
             
             if not valid_lines:
                 # Invalid path
@@ -140,8 +659,8 @@ class PathFinder:
                 for curr_line in valid_lines:
                     # Cost = previous cost + 1 (travel) + transfer penalty (if needed)
                     new_cost = prev_cost + Decimal("1")
-                    # Use get_transfer_cost to handle both normal transfers and Y-branch reverse transfers
-                    transfer_cost = self.network.get_transfer_cost(u, prev_line, curr_line)
+                    # Transfer table handles both normal transfers and Y-branch reverse transfers
+                    transfer_cost = tables.transfer_cost(u, prev_line, curr_line)
                     new_cost += transfer_cost
                     
                     # Update if this is better
@@ -165,7 +684,7 @@ class PathFinder:
         current_line = best_end_line
         
         for i in range(n - 1, 0, -1):
-            line_sequence[i] = current_line
+            line_sequence[i] = tables.label_names[current_line]
             _, prev_line = dp[i][current_line]
             current_line = prev_line
         
@@ -179,3 +698,12 @@ class PathFinder:
         """Calculate minimum cost for a given path"""
         cost, _ = self.analyze_path_optimal(path)
         return cost
+
+
+register_engine(PathEngine(
+    "expanded", PathFinder._find_all_shortest_paths_expanded, needs_snapshot=False
+))
+register_engine(PathEngine("contracted", PathFinder._find_all_shortest_paths_contracted))
+register_engine(PathEngine(
+    "compiled", PathFinder._find_all_shortest_paths_compiled, PathFinder._find_all_shortest_paths_from_compiled
+))
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import json
+import random
+import struct
+from array import array
+from decimal import Decimal
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from app.services.metro_network import MetroNetwork
+from app.services.path_finder import PathFinder
+from app.services.state_graph import to_half_units
+from app.services.wire_format import StringTable
+
+DIFFICULTIES = ("easy", "medium", "hard")
+
+# Near-optimal alternatives within this much of the shortest cost are "traps"
+TRAP_TOLERANCE = Decimal("2")
+MAX_TRAPS = 10
+
+MAGIC = b"METROPB1"
+# selection index, start id, end id, difficulty, cost (half units), transfers,
+# shortest paths, traps
+RECORD = struct.Struct("<HHHBHBHB")
+
+
+class Puzzle(NamedTuple):
+    start: str
+    end: str
+    cost: Decimal
+    transfers: int        # Fewest transfers among the shortest paths
+    shortest_paths: int   # Distinct shortest station paths
+    traps: int            # Costlier station paths within TRAP_TOLERANCE (at most MAX_TRAPS)
+    difficulty: str
+
+
+def difficulty_score(cost: Decimal, transfers: int, shortest_paths: int, traps: int) -> float:
+    """Longer routes, more transfers and more tempting detours are harder; more ways to win are easier"""
+    return float(cost) + 1.5 * transfers + traps - min(shortest_paths - 1, 3)
+
+
+def grade(cost: Decimal, transfers: int, shortest_paths: int, traps: int) -> str:
+    score = difficulty_score(cost, transfers, shortest_paths, traps)
+    if score < 16:
+        return "easy"
+    if score < 26:
+        return "medium"
+    return "hard"
+
+
+def grade_source(path_finder: PathFinder, start: str, ends: List[str],
+                 min_cost: Decimal = Decimal("4")) -> Iterator[Puzzle]:
+    """
+    Graded puzzles from start to each reachable end costing at least min_cost.
+
+    Shortest paths to all ends come from one search (find_all_shortest_paths_from);
+    trap counts use near-optimal enumeration, whose per-end reverse searches
+    the path finder keeps, so reuse one path finder for all sources of a
+    line selection.
+    """
+    network = path_finder.network
+    results = path_finder.find_all_shortest_paths_from(start, ends)
+    for end in ends:
+        result = results.get(end)
+        if result is None or not result[0] or result[1] < min_cost:
+            continue
+        _, cost, paths_with_lines = result
+        transfers = min(len(network.line_change_markers(line_seq)[0]) for _, line_seq in paths_with_lines)
+        shortest_paths = len({tuple(path) for path, _ in paths_with_lines})
+        limit = min(shortest_paths + MAX_TRAPS, PathFinder.max_alternatives)
+        near_optimal = path_finder.find_near_optimal_paths(start, end, TRAP_TOLERANCE, limit)
+        traps = min(len({tuple(path) for path, _, path_cost in near_optimal if path_cost > cost}), MAX_TRAPS)
+        yield Puzzle(start, end, cost, transfers, shortest_paths, traps,
+                     grade(cost, transfers, shortest_paths, traps))
+
+
+def encode_puzzles(network: MetroNetwork, selection: int, puzzles: List[Puzzle]) -> bytes:
+    """Bank records of puzzles of the selection-th line selection"""
+    ids = StringTable.for_network(network).station_ids
+    return b"".join(
+        RECORD.pack(selection, ids[p.start], ids[p.end], DIFFICULTIES.index(p.difficulty),
+                    to_half_units(p.cost), min(p.transfers, 255), min(p.shortest_paths, 65535), p.traps)
+        for p in puzzles
+    )
+
+
+class PuzzleBankWriter:
+    """
+    Streams graded puzzles of one city's data version to a bank file.
+
+    Layout: MAGIC, a length-prefixed JSON header (data version, string table
+    version, line selections) and then fixed-size RECORDs, with stations as
+    StringTable ids.
+    """
+
+    def __init__(self, f: BinaryIO, network: MetroNetwork, city: str, selections: List[List[str]]):
+        self.f = f
+        self.count = 0
+        header = json.dumps({
+            "city": city,
+            "data_version": network.data_version,
+            "strings_version": StringTable.for_network(network).version,
+            "selections": selections,
+            "difficulties": list(DIFFICULTIES),
+        }, ensure_ascii=False).encode("utf-8")
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+
+    def write(self, records: bytes) -> None:
+        """Append records from encode_puzzles"""
+        self.f.write(records)
+        self.count += len(records) // RECORD.size
+
+
+class PuzzleBank:
+    """
+    A city's puzzle bank, loaded for sampling.
+
+    Puzzles are grouped by (line selection, difficulty) into arrays of packed
+    start/end station ids, so sample() is a single random index.
+    """
+
+    def __init__(self, header: dict, stations: List[str], groups: Dict[Tuple[Tuple[str, ...], str], array]):
+        self.header = header
+        self.stations = stations
+        self._groups = groups
+
+    @classmethod
+    def load(cls, path: str, network: MetroNetwork) -> "PuzzleBank":
+        """Load a bank file (ValueError if it is invalid or for another data version)"""
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a puzzle bank: {path}")
+            (header_size,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_size).decode("utf-8"))
+            records = f.read()
+        if header["data_version"] != network.data_version:
+            raise ValueError(
+                f"Puzzle bank {path} is for data version {header['data_version']}, not {network.data_version}"
+            )
+        table = StringTable.for_network(network)
+        if header["strings_version"] != table.version:
+            raise ValueError(f"Puzzle bank {path} has another station table")
+
+        keys = [tuple(sorted(set(network._expand_lines(lines)))) for lines in header["selections"]]
+        groups: Dict[Tuple[Tuple[str, ...], str], array] = {}
+        usable = len(records) - len(records) % RECORD.size
+        for selection, start, end, difficulty, *_ in RECORD.iter_unpack(records[:usable]):
+            group = groups.get((keys[selection], DIFFICULTIES[difficulty]))
+            if group is None:
+                group = groups[(keys[selection], DIFFICULTIES[difficulty])] = array("L")
+            group.append(start << 16 | end)
+        return cls(header, table.stations, groups)
+
+    def sample(self, selection: Tuple[str, ...], difficulty: str,
+               rng: random.Random = random) -> Optional[Tuple[str, str]]:
+        """A random (start, end) of a canonical line selection and difficulty, or None if there is none"""
+        group = self._groups.get((selection, difficulty))
+        if not group:
+            return None
+        packed = group[rng.randrange(len(group))]
+        return self.stations[packed >> 16], self.stations[packed & 0xFFFF]
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(DIFFICULTIES, 0)
+        for (_, difficulty), group in self._groups.items():
+            counts[difficulty] += len(group)
+        return counts
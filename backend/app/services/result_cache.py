@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, Hashable, Optional
+
+from app.responses import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Entries are touched (for eviction order) at most this often, so that
+# cache hits rarely need a write
+TOUCH_INTERVAL = 60.0
+
+# Part of every database key: entries of another value encoding are never hit
+VALUE_FORMAT = "json"
+
+
+class ResultCache:
+    """
+    Persistent second-tier cache in a SQLite database (WAL mode).
+
+    Behind the in-memory caches (snapshot tables, request results) it keeps
+    computed results across restarts and shares them between worker
+    processes: WAL lets any number of readers run next to a writer. Keys are
+    (kind, data version, ...) tuples, i.e. they include the content hash of
+    the data file, so entries of other data versions are simply never hit
+    again and age out. Values are stored as zlib-compressed JSON, so they can
+    only hold plain data: callers convert results with the encode / decode
+    functions they pass (a database file anyone else can write must never be
+    able to run code when read; a malformed value is just a miss).
+
+    The database is bounded to about max_bytes of values: every so many
+    writes, the least recently used entries are deleted until it is under
+    90% of that. Any SQLite error (locked database, full disk, ...) is logged
+    and treated as a miss, since the cache is only an optimization.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, check_every: int = 256):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes_since_check = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, kind TEXT NOT NULL, value BLOB NOT NULL, "
+                "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    @classmethod
+    def from_env(cls) -> Optional["ResultCache"]:
+        """Cache configured by METRO_RESULT_CACHE_PATH / METRO_RESULT_CACHE_MB (None: disabled)"""
+        path = os.environ.get("METRO_RESULT_CACHE_PATH")
+        if not path:
+            return None
+        max_bytes = int(float(os.environ.get("METRO_RESULT_CACHE_MB", "256")) * 1024 * 1024)
+        try:
+            return cls(path, max_bytes)
+        except sqlite3.Error:
+            logger.exception("Opening result cache %s failed, running without it", path)
+            return None
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread (and per process: it is opened lazily)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return hashlib.sha1(repr((VALUE_FORMAT, key)).encode("utf-8")).hexdigest()
+
+    def _count(self, counter: str, n: int = 1) -> None:
+        # Called from threadpool workers: += on an attribute is not atomic
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def get(self, key: tuple, decode: Optional[Callable[[Any], Any]] = None) -> Optional[Any]:
+        """
+        Cached value of key (a tuple starting with its kind), or None; decode
+        turns the stored plain data back into the value
+        """
+        db_key = self._key(key)
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT value, last_used FROM results WHERE key = ?", (db_key,)).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            now = time.time()
+            if now - row[1] > TOUCH_INTERVAL:
+                conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, db_key))
+            value = loads(zlib.decompress(row[0]))
+            if decode is not None:
+                value = decode(value)
+        except Exception:
+            self._count("errors")
+            logger.warning("Result cache read failed", exc_info=True)
+            return None
+        self._count("hits")
+        return value
+
+    def put(self, key: tuple, value: Any, encode: Optional[Callable[[Any], Any]] = None) -> None:
+        """Store value (plain JSON data, or what encode turns it into) under key"""
+        blob = zlib.compress(dumps(encode(value) if encode is not None else value))
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO results (key, kind, value, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (self._key(key), str(key[0]), blob, len(blob), time.time())
+            )
+        except sqlite3.Error:
+            self._count("errors")
+            logger.warning("Result cache write failed", exc_info=True)
+            return
+        with self._lock:
+            self.writes += 1
+            self._writes_since_check += 1
+            if self._writes_since_check < self.check_every:
+                return
+            self._writes_since_check = 0
+        self.evict()
+
+    def evict(self) -> int:
+        """Delete least recently used entries while over max_bytes; returns how many"""
+        deleted = 0
+        try:
+            conn = self._connection()
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            target = self.max_bytes * 0.9
+            while total > self.max_bytes or (deleted and total > target):
+                rows = conn.execute(
+                    "SELECT key, size FROM results ORDER BY last_used LIMIT 64"
+                ).fetchall()
+                if not rows:
+                    break
+                conn.executemany("DELETE FROM results WHERE key = ?", [(row[0],) for row in rows])
+                total -= sum(row[1] for row in rows)
+                deleted += len(rows)
+        except sqlite3.Error:
+            self._count("errors")
+            logger.warning("Result cache eviction failed", exc_info=True)
+        self._count("evictions", deleted)
+        return deleted
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "path": self.path,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "errors": self.errors,
+            }
+        try:
+            entries, size = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+            stats.update(entries=entries, bytes=size)
+        except sqlite3.Error:
+            pass
+        return stats
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from app.services.memory import deep_sizeof
+
+
+class RoundSession:
+    """
+    A solved round: the city data version it was solved on, its line selection
+    (canonical form), its stations and all of its shortest paths (with the
+    search's PathFinder.debug_info()). Only the solution is kept, not the
+    network view, so sessions do not pin snapshots or old data versions and
+    size covers what they hold; a session is only valid for its data version.
+    """
+
+    def __init__(self, city: str, version: str, selection: Tuple[str, ...], start: str, end: str,
+                 shortest_cost: Decimal, paths_with_lines: List[Tuple[List[str], List[str]]],
+                 debug: Optional[dict] = None):
+        self.round_id = secrets.token_urlsafe(12)
+        self.city = city
+        self.version = version
+        self.selection = selection
+        self.start = start
+        self.end = end
+        self.shortest_cost = shortest_cost
+        self.paths_with_lines = paths_with_lines
+        self.debug = debug
+        self.last_used = time.monotonic()
+        # (compact, annotated) -> encoded shortest paths, built on first use
+        self.encoded_paths: Dict[Tuple[bool, bool], List[dict]] = {}
+        self.size = 512 + deep_sizeof(paths_with_lines)
+
+
+class RoundStore:
+    """
+    TTL-bounded store of round sessions with memory caps.
+
+    Sessions expire ttl seconds after their last use and are evicted least
+    recently used first while there are more than max_rounds of them or their
+    estimated size exceeds max_bytes. Counters report hits, misses, expiries
+    and capacity evictions.
+    """
+
+    def __init__(self, ttl: float = 1800.0, max_rounds: int = 10000, max_bytes: int = 32 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_rounds = max_rounds
+        self.max_bytes = max_bytes
+        self._rounds: "OrderedDict[str, RoundSession]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def add(self, session: RoundSession) -> str:
+        with self._lock:
+            self._expire(time.monotonic())
+            self._rounds[session.round_id] = session
+            self._bytes += session.size
+            self.created += 1
+            while self._rounds and (len(self._rounds) > self.max_rounds or self._bytes > self.max_bytes):
+                _, evicted = self._rounds.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evicted += 1
+        return session.round_id
+
+    def get(self, round_id: str) -> Optional[RoundSession]:
+        """The session of a round (refreshing its TTL), or None if unknown or expired"""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            session = self._rounds.get(round_id)
+            if session is None:
+                self.misses += 1
+                return None
+            session.last_used = now
+            self._rounds.move_to_end(round_id)
+            self.hits += 1
+            return session
+
+    def grow(self, session: RoundSession, extra_bytes: int) -> None:
+        """Account for data cached on a session after it was added"""
+        with self._lock:
+            session.size += extra_bytes
+            if session.round_id in self._rounds:
+                self._bytes += extra_bytes
+
+    def _expire(self, now: float) -> None:
+        # Sessions are kept in last-use order, so expired ones are at the front
+        while self._rounds:
+            session = next(iter(self._rounds.values()))
+            if now - session.last_used <= self.ttl:
+                break
+            self._rounds.popitem(last=False)
+            self._bytes -= session.size
+            self.expired += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rounds": len(self._rounds),
+                "estimated_bytes": self._bytes,
+                "created": self.created,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
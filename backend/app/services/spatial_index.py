@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import heapq
+import math
+from typing import Container, Dict, List, Optional, Tuple
+
+# Target average number of stations per grid cell
+STATIONS_PER_CELL = 2
+
+
+class SpatialIndex:
+    """
+    Uniform grid over the station coordinates (x/y) of one city data file.
+
+    Cells are sized for about STATIONS_PER_CELL stations each, so memory is
+    linear in the number of stations. Nearest-station queries scan rings of
+    cells outwards from the query point and stop once no unscanned cell can
+    hold a closer station; box queries scan the covered cells. Both take an
+    optional allowed container of station names (e.g. the stations of the
+    selected lines).
+    """
+
+    def __init__(self, coordinates: dict):
+        self.names: List[str] = []
+        self.xs: List[float] = []
+        self.ys: List[float] = []
+        for name, info in coordinates.get("stations", {}).items():
+            if "x" in info and "y" in info:
+                self.names.append(name)
+                self.xs.append(float(info["x"]))
+                self.ys.append(float(info["y"]))
+
+        n = len(self.names)
+        self.x0 = min(self.xs, default=0.0)
+        self.y0 = min(self.ys, default=0.0)
+        width = max(self.xs, default=0.0) - self.x0
+        height = max(self.ys, default=0.0) - self.y0
+        area = max(width * height, 1.0)
+        self.cell = math.sqrt(area * STATIONS_PER_CELL / max(n, 1)) or 1.0
+        self.cols = int(width / self.cell) + 1
+        self.rows = int(height / self.cell) + 1
+
+        # (col, row) -> station ids in it
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        for i in range(n):
+            self.cells.setdefault(self._cell_of(self.xs[i], self.ys[i]), []).append(i)
+
+    def _cell_of(self, x: float, y: float) -> Tuple[int, int]:
+        col = min(max(int((x - self.x0) / self.cell), 0), self.cols - 1)
+        row = min(max(int((y - self.y0) / self.cell), 0), self.rows - 1)
+        return col, row
+
+    def station(self, i: int, distance: Optional[float] = None) -> dict:
+        station = {"name": self.names[i], "x": self.xs[i], "y": self.ys[i]}
+        if distance is not None:
+            station["distance"] = distance
+        return station
+
+    def nearest(self, x: float, y: float, k: int = 1,
+                allowed: Optional[Container[str]] = None) -> List[Tuple[int, float]]:
+        """The k nearest stations to (x, y) as (station id, distance), nearest first"""
+        if not self.names:
+            return []
+        col, row = self._cell_of(x, y)
+        # Stations in ring r and beyond are at least gap + (r - 1) cells away
+        # (gap: distance to the query cell's nearest edge, 0 outside the grid)
+        gap = max(
+            min(x - (self.x0 + col * self.cell), self.x0 + (col + 1) * self.cell - x),
+            0.0
+        )
+        gap = min(gap, max(min(y - (self.y0 + row * self.cell), self.y0 + (row + 1) * self.cell - y), 0.0))
+        max_ring = max(col, self.cols - 1 - col, row, self.rows - 1 - row)
+
+        # Max-heap of the best k: (-distance, -id)
+        best: List[Tuple[float, int]] = []
+        for ring in range(max_ring + 1):
+            if len(best) == k and -best[0][0] < gap + (ring - 1) * self.cell:
+                break
+            for cell in self._ring(col, row, ring):
+                for i in self.cells.get(cell, ()):
+                    if allowed is not None and self.names[i] not in allowed:
+                        continue
+                    d = math.hypot(self.xs[i] - x, self.ys[i] - y)
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, -i))
+                    elif (-d, -i) > best[0]:
+                        heapq.heapreplace(best, (-d, -i))
+        return [(-neg_i, -neg_d) for neg_d, neg_i in sorted(best, reverse=True)]
+
+    @staticmethod
+    def _ring(col: int, row: int, ring: int) -> List[Tuple[int, int]]:
+        """Cells at Chebyshev distance ring from (col, row)"""
+        if ring == 0:
+            return [(col, row)]
+        cells = []
+        for c in range(col - ring, col + ring + 1):
+            cells.append((c, row - ring))
+            cells.append((c, row + ring))
+        for r in range(row - ring + 1, row + ring):
+            cells.append((col - ring, r))
+            cells.append((col + ring, r))
+        return cells
+
+    def in_box(self, x_min: float, y_min: float, x_max: float, y_max: float,
+               allowed: Optional[Container[str]] = None) -> List[int]:
+        """Ids of the stations inside the box (edges included), in data file order"""
+        if x_min > x_max or y_min > y_max or not self.names:
+            return []
+        c0, r0 = self._cell_of(x_min, y_min)
+        c1, r1 = self._cell_of(x_max, y_max)
+        found = []
+        for c in range(c0, c1 + 1):
+            for r in range(r0, r1 + 1):
+                for i in self.cells.get((c, r), ()):
+                    if (x_min <= self.xs[i] <= x_max and y_min <= self.ys[i] <= y_max
+                            and (allowed is None or self.names[i] in allowed)):
+                        found.append(i)
+        found.sort()
+        return found
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from app.services.contracted_graph import ChainEdge, ContractedGraph
+from app.services.graph_snapshot import GraphSnapshot
+
+# Costs are integers in half units (1 hop = 2, a 2.5 transfer = 5)
+COST_SCALE = 2
+
+
+def to_half_units(cost: Decimal) -> int:
+    half_units = cost * COST_SCALE
+    if half_units != int(half_units):
+        raise ValueError(f"Cost {cost} is not a multiple of 1/{COST_SCALE}")
+    return int(half_units)
+
+
+def from_half_units(half_units: int) -> Decimal:
+    return Decimal(half_units) / COST_SCALE
+
+
+class StateGraph:
+    """
+    Precompiled (hub, line) state graph of one graph snapshot.
+
+    Built on the snapshot's ContractedGraph: every hub gets one state per line
+    label it can be reached on plus a "no line yet" state for starting there,
+    all interned as integer ids. Each state's out-edges already include the
+    transfer cost at the hub, so the search only adds integers:
+
+        state -> [(target state id, total cost, transfer cost, chain edge), ...]
+
+    with the chain's hop count making up the rest of the total (costs in half
+    units). The search that uses it (PathFinder) goes through exactly the
+    same states and relaxations as the heap-based contracted search.
+    """
+
+    def __init__(self, network, snapshot: GraphSnapshot):
+        self.contracted = ContractedGraph.for_snapshot(network, snapshot)
+        tables = network.line_tables
+
+        # State id -> (node, line id or None) and back
+        self.states: List[Tuple[str, Optional[int]]] = []
+        self.state_ids: Dict[Tuple[str, Optional[int]], int] = {}
+        for hub in self.contracted.hubs:
+            self._intern((hub, None))
+        for edges in list(self.contracted.out_edges.values()):
+            for edge in edges:
+                self._intern((edge.target, edge.line_id))
+
+        self.out_edges: List[List[Tuple[int, int, int, ChainEdge]]] = []
+        for node, line_id in self.states:
+            compiled = []
+            for edge in self.contracted.out_edges.get(node, ()):
+                transfer = to_half_units(tables.transfer_cost(node, line_id, edge.line_id))
+                target = self.state_ids[(edge.target, edge.line_id)]
+                compiled.append((target, transfer + edge.length * COST_SCALE, transfer, edge))
+            self.out_edges.append(compiled)
+
+    def to_dict(self) -> dict:
+        """Plain data of the state graph (for the result cache)"""
+        return {
+            "contracted": self.contracted.to_dict(),
+            "states": self.states,
+            "out_edges": [
+                [(target, total, transfer, edge.edge_id) for target, total, transfer, edge in edges]
+                for edges in self.out_edges
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StateGraph":
+        state_graph = cls.__new__(cls)
+        state_graph.contracted = ContractedGraph.from_dict(data["contracted"])
+        edges = {edge.edge_id: edge for chain_edges in state_graph.contracted.out_edges.values()
+                 for edge in chain_edges}
+        state_graph.states = [(node, line_id) for node, line_id in data["states"]]
+        state_graph.state_ids = {state: i for i, state in enumerate(state_graph.states)}
+        state_graph.out_edges = [
+            [(target, total, transfer, edges[edge_id]) for target, total, transfer, edge_id in compiled]
+            for compiled in data["out_edges"]
+        ]
+        return state_graph
+
+    def _intern(self, state: Tuple[str, Optional[int]]) -> int:
+        state_id = self.state_ids.get(state)
+        if state_id is None:
+            state_id = len(self.states)
+            self.state_ids[state] = state_id
+            self.states.append(state)
+        return state_id
+
+    @classmethod
+    def for_snapshot(cls, network, snapshot: GraphSnapshot) -> "StateGraph":
+        """
+        Get the state graph of a snapshot (built once and cached on it, and in
+        the network's persistent result cache if it has one)
+        """
+        state_graph = snapshot.tables.get("state_graph")
+        if state_graph is None:
+            cache = network.result_cache
+            key = ("state_graph", network.data_version, tuple(sorted(snapshot.lines)))
+            if cache is not None and network.data_version is not None:
+                state_graph = cache.get(key, cls.from_dict)
+                if state_graph is None:
+                    state_graph = cls(network, snapshot)
+                    cache.put(key, state_graph, cls.to_dict)
+                else:
+                    snapshot.add_table("contracted_graph", state_graph.contracted)
+            else:
+                state_graph = cls(network, snapshot)
+            state_graph = snapshot.add_table("state_graph", state_graph)
+        return state_graph
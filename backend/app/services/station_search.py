@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import heapq
+from bisect import bisect_left
+from typing import Container, Dict, List, Optional, Tuple
+
+from app.services.metro_network import MetroNetwork
+
+
+class StationSearchIndex:
+    """
+    Station name search index of one MetroNetwork.
+
+    Names are matched case-insensitively: a prefix index (sorted names, found
+    by bisection) answers exact and prefix matches, and a unigram/bigram
+    index answers substring matches (intersect the postings of the query's
+    bigrams, then confirm). Results rank exact matches first, then prefix
+    matches, then other substring matches, each in name order, the same
+    order the station pickers use.
+    """
+
+    def __init__(self, network: MetroNetwork):
+        names = set()
+        for line_name in network.get_all_lines(include_branch_lines=True):
+            names.update(network.get_line_stations(line_name))
+        self.names: List[str] = sorted(names)
+        self.folded: List[str] = [name.casefold() for name in self.names]
+
+        # (folded name, id) in folded order, for prefix ranges
+        self._by_folded: List[Tuple[str, int]] = sorted(
+            (folded, i) for i, folded in enumerate(self.folded)
+        )
+        # 1- and 2-character grams -> ascending ids of names containing them
+        grams: Dict[str, List[int]] = {}
+        for i, folded in enumerate(self.folded):
+            own = set(folded)
+            own.update(folded[j:j + 2] for j in range(len(folded) - 1))
+            for gram in own:
+                grams.setdefault(gram, []).append(i)
+        self._grams: Dict[str, Tuple[int, ...]] = {g: tuple(ids) for g, ids in grams.items()}
+
+    @classmethod
+    def for_network(cls, network: MetroNetwork) -> "StationSearchIndex":
+        """Get the search index of a network (built once and cached on it)"""
+        index = network.tables.get("station_search")
+        if index is None:
+            index = cls(network)
+            network.tables["station_search"] = index
+        return index
+
+    def _prefix_ids(self, query: str) -> List[int]:
+        ids = []
+        pos = bisect_left(self._by_folded, (query, -1))
+        while pos < len(self._by_folded) and self._by_folded[pos][0].startswith(query):
+            ids.append(self._by_folded[pos][1])
+            pos += 1
+        return ids
+
+    def _substring_ids(self, query: str) -> List[int]:
+        if len(query) == 1:
+            return list(self._grams.get(query, ()))
+        postings = []
+        for j in range(len(query) - 1):
+            ids = self._grams.get(query[j:j + 2])
+            if ids is None:
+                return []
+            postings.append(ids)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for ids in postings[1:]:
+            candidates.intersection_update(ids)
+            if not candidates:
+                return []
+        return [i for i in candidates if query in self.folded[i]]
+
+    def search(self, query: str, allowed: Optional[Container[str]] = None, limit: int = 20) -> List[str]:
+        """
+        Station names matching query, best first.
+
+        allowed restricts results to a set of stations (e.g. the stations of
+        the selected lines); an empty query lists stations in name order.
+        """
+        query = query.strip().casefold()
+        if not query:
+            return [
+                name for name in self.names if allowed is None or name in allowed
+            ][:limit]
+
+        def rank(i: int) -> Tuple[int, int]:
+            return (0 if self.folded[i] == query else 1, i)
+
+        matches = [i for i in self._prefix_ids(query) if allowed is None or self.names[i] in allowed]
+        if len(matches) >= limit:
+            return [self.names[i] for i in heapq.nsmallest(limit, matches, key=rank)]
+
+        ranked = sorted(matches, key=rank)
+        prefix_ids = set(matches)
+        others = sorted(
+            i for i in self._substring_ids(query)
+            if i not in prefix_ids and (allowed is None or self.names[i] in allowed)
+        )
+        return [self.names[i] for i in (ranked + others)[:limit]]
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from app.services.metro_network import MetroNetwork
+
+
+class StringTable:
+    """
+    Station and display-line name table for the compact path wire format.
+
+    Ids are assigned in data-file order, so the table only changes when the
+    city's data does; `version` is a content hash clients can cache it by.
+    """
+
+    def __init__(self, network: MetroNetwork):
+        self.stations: List[str] = []
+        self.lines: List[str] = []
+        station_ids: Dict[str, int] = {}
+        line_ids: Dict[str, int] = {}
+        for line_name in network.get_all_lines(include_branch_lines=True):
+            display = network._get_display_line_name(line_name)
+            if display not in line_ids:
+                line_ids[display] = len(self.lines)
+                self.lines.append(display)
+            for s in network.get_line_stations(line_name):
+                if s not in station_ids:
+                    station_ids[s] = len(self.stations)
+                    self.stations.append(s)
+        self.station_ids = station_ids
+        self.line_ids = line_ids
+
+        digest = hashlib.sha1(
+            json.dumps([self.stations, self.lines], ensure_ascii=False).encode("utf-8")
+        )
+        self.version = digest.hexdigest()[:12]
+
+    @classmethod
+    def for_network(cls, network: MetroNetwork) -> "StringTable":
+        """Get the string table of a network (built once and cached on it)"""
+        table = network.tables.get("string_table")
+        if table is None:
+            table = cls(network)
+            network.tables["string_table"] = table
+        return table
+
+    def to_dict(self) -> dict:
+        return {"version": self.version, "stations": self.stations, "lines": self.lines}
+
+
+def encode_paths(network: MetroNetwork, table: StringTable,
+                 paths_with_lines: List[Tuple[List[str], List[str]]],
+                 costs: Optional[List[Decimal]] = None,
+                 include_annotated: bool = False) -> List[dict]:
+    """
+    Encode (path, line_sequence) pairs as compact id-based paths.
+
+    Paths are deduplicated on their transfer markers, which is equivalent to
+    deduplicating on build_structured_path()'s annotated string, without
+    building that string unless include_annotated is set.
+
+    Each entry: {"stations": [station ids], "lines": [line id or None per station],
+    "transfers": [station indices]} plus "cost" if costs are given and
+    "annotated" if requested.
+    """
+    encoded = []
+    seen = set()
+    for n, (path, line_seq) in enumerate(paths_with_lines):
+        transfers, markers = network.line_change_markers(line_seq)
+        signature = (tuple(path), markers)
+        if signature in seen:
+            continue
+        seen.add(signature)
+
+        entry = {
+            "stations": [table.station_ids[s] for s in path],
+            "lines": [
+                None if ln is None else table.line_ids[network._get_display_line_name(ln)]
+                for ln in line_seq
+            ],
+            "transfers": transfers,
+        }
+        if costs is not None:
+            entry["cost"] = float(costs[n])
+        if include_annotated:
+            entry["annotated"] = network._annotate_with_markers(path, markers)
+        encoded.append(entry)
+    return encoded
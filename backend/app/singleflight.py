@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent computations and caches their results briefly.
+
+    The first request for a key (the leader) runs the computation; requests
+    for the same key arriving while it runs await the leader's future instead
+    of computing again, and get its result or its exception. Successful
+    results are then served from a small LRU cache for `ttl` seconds. Keys
+    must identify everything the result depends on, including the data
+    version.
+    """
+
+    def __init__(self, name: str, ttl: float = 2.0, max_entries: int = 1024):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._cache: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.computed = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Result of compute() for key, shared with concurrent and recent callers"""
+        cached = self._cache.get(key)
+        if cached is not None:
+            if time.monotonic() - cached[0] <= self.ttl:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached[1]
+            del self._cache[key]
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # Shield: a follower that goes away must not cancel the leader's work
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        self.computed += 1
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved when nobody was waiting for it
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+        future.set_result(result)
+        if self.ttl > 0:
+            self._cache[key] = (time.monotonic(), result)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "computed": self.computed,
+            "coalesced": self.coalesced,
+            "cache_hits": self.cache_hits,
+            "in_flight": len(self._in_flight),
+        }
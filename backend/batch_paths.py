@@ -0,0 +1,281 @@
+"""
+Solve and grade shortest-path queries in bulk.
+
+Reads JSONL queries, one per line ("lines" defaults to all lines of the city,
+"id" is optional and echoed back):
+
+    {"id": 1, "city": "sz", "start": "福田", "end": "深圳北站"}
+    {"id": 2, "city": "sz", "lines": ["1号线", "4号线"], "start": "福田", "end": "深圳北站",
+     "path": ["福田", "少年宫", "莲花北", "上梅林", "民乐", "白石龙", "深圳北站"]}
+
+A query without "path" is solved (shortest cost and all shortest paths); one
+with "path" is graded like validate-path (PathFinder.analyze_path_optimal
+against the shortest cost). One JSONL result per query is written in input
+order; malformed or failing queries get {"error": ...}.
+
+Queries are read in chunks. Each chunk is grouped by city, line selection and
+start station into batches for a process pool whose workers keep city data
+and line-selection views warm between batches, and whose shortest-path
+searches are shared by the queries of a batch with the same start. At most
+--in-flight chunks are pending at a time, so memory stays constant whatever
+the input size.
+
+    python batch_paths.py queries.jsonl -o results.jsonl --workers 4
+    cat queries.jsonl | python batch_paths.py > results.jsonl
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import time
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.responses import dumps
+from app.services.city_data import CityData
+from app.services.city_registry import CityRegistry
+from app.services.metro_network import MetroNetwork
+from app.services.path_finder import PathFinder
+from app.services.path_validator import PathValidator
+from app.services.result_cache import ResultCache
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Line-selection views kept per worker
+MAX_VIEWS = 16
+
+# Worker state: city data per city, line-selection views (LRU)
+_registry: Optional[CityRegistry] = None
+_result_cache: Optional[ResultCache] = None
+_cities: Dict[str, CityData] = {}
+_views: "collections.OrderedDict[Tuple, MetroNetwork]" = collections.OrderedDict()
+
+# (city, line selection or None for all lines)
+SelectionKey = Tuple[str, Optional[Tuple[str, ...]]]
+
+
+def _init_worker() -> None:
+    global _registry, _result_cache
+    _registry = CityRegistry(DATA_DIR)
+    _result_cache = ResultCache.from_env()
+
+
+def _view(key: SelectionKey) -> MetroNetwork:
+    view = _views.get(key)
+    if view is not None:
+        _views.move_to_end(key)
+        return view
+    city, lines = key
+    data = _cities.get(city)
+    if data is None:
+        info = _registry.get(city)
+        if info is None:
+            raise ValueError(f"Unknown city: {city}")
+        data = _cities[city] = CityData.load(city, info.data_file, _result_cache).warm()
+    network = data.network
+    view = network.with_lines(list(lines) if lines is not None else network.get_all_lines())
+    _views[key] = view
+    if len(_views) > MAX_VIEWS:
+        _views.popitem(last=False)
+    return view
+
+
+def _error(query: dict, message: str) -> dict:
+    result = {"id": query["id"]} if "id" in query else {}
+    result["error"] = message
+    return result
+
+
+def _run_batch(batch: Tuple[SelectionKey, List[dict]]) -> List[bytes]:
+    """Worker: the encoded results of one batch of queries of a single selection, in batch order"""
+    key, queries = batch
+    try:
+        view = _view(key)
+    except Exception as e:
+        return [dumps(_error(query, str(e))) for query in queries]
+
+    all_stations = view.get_all_stations()
+    path_finder = PathFinder(view)  # Per batch: bounds its path analysis cache
+
+    # Shortest paths of every valid (start, end), one search per start
+    ends_by_start: Dict[str, List[str]] = {}
+    for query in queries:
+        start, end = query["start"], query["end"]
+        if start in all_stations and end in all_stations and view.is_reachable(start, end):
+            ends = ends_by_start.setdefault(start, [])
+            if end not in ends:
+                ends.append(end)
+    shortest: Dict[Tuple[str, str], tuple] = {}
+    for start, ends in ends_by_start.items():
+        try:
+            if len(ends) == 1:
+                shortest[start, ends[0]] = path_finder.find_all_shortest_paths(start, ends[0])
+            else:
+                for end, result in path_finder.find_all_shortest_paths_from(start, ends).items():
+                    shortest[start, end] = result
+                if start in ends:
+                    shortest[start, start] = path_finder.find_all_shortest_paths(start, start)
+        except Exception as e:
+            for end in ends:
+                shortest[start, end] = e
+
+    encoded = []
+    for query in queries:
+        try:
+            result = _answer(view, path_finder, query, shortest)
+        except Exception as e:
+            result = _error(query, str(e))
+        encoded.append(dumps(result))
+    return encoded
+
+
+def _answer(view: MetroNetwork, path_finder: PathFinder, query: dict,
+            shortest: Dict[Tuple[str, str], tuple]) -> dict:
+    start, end = query["start"], query["end"]
+    all_stations = view.get_all_stations()
+    if start not in all_stations:
+        return _error(query, f"Start station not found: {start}")
+    if end not in all_stations:
+        return _error(query, f"End station not found: {end}")
+    found = shortest.get((start, end))
+    if found is None:
+        return _error(query, "Stations are not reachable")
+    if isinstance(found, Exception):
+        return _error(query, str(found))
+    paths, cost, paths_with_lines = found
+    if not paths:
+        return _error(query, "No path found")
+
+    result = {"id": query["id"]} if "id" in query else {}
+    user_path = query.get("path")
+    if user_path is None:
+        result["shortest_cost"] = float(cost)
+        result["paths"] = [p["annotated"] for p in view.build_structured_paths(paths_with_lines)]
+        return result
+
+    is_valid, message = PathValidator(view).validate_path(user_path, start, end)
+    if not is_valid:
+        result.update(valid=False, is_shortest=False, user_cost=None, shortest_cost=float(cost),
+                      user_path_annotated=None, error_reason=message)
+        return result
+    user_cost, user_line_sequence = path_finder.analyze_path_optimal(user_path)
+    result.update(
+        valid=True,
+        is_shortest=user_cost == cost,
+        user_cost=float(user_cost),
+        shortest_cost=float(cost),
+        user_path_annotated=view.build_structured_path(user_path, user_line_sequence)["annotated"],
+        error_reason=None,
+    )
+    return result
+
+
+def _parse(line: str) -> Tuple[Optional[SelectionKey], dict]:
+    """(selection key, query) of an input line; key None: the query is an error result already"""
+    try:
+        query = json.loads(line)
+    except ValueError as e:
+        return None, {"error": f"Invalid JSON: {e}"}
+    if not isinstance(query, dict):
+        return None, {"error": "Query must be a JSON object"}
+    for field in ("city", "start", "end"):
+        if not isinstance(query.get(field), str):
+            return None, _error(query, f"Missing or invalid field: {field}")
+    lines = query.get("lines")
+    if lines is not None and not (isinstance(lines, list) and all(isinstance(ln, str) for ln in lines)):
+        return None, _error(query, "lines must be a list of line names")
+    path = query.get("path")
+    if path is not None and not (isinstance(path, list) and all(isinstance(s, str) for s in path)):
+        return None, _error(query, "path must be a list of station names")
+    return (query["city"], tuple(sorted(set(lines))) if lines is not None else None), query
+
+
+def _plan_chunk(lines: List[str], batch_size: int) -> Tuple[List[Optional[bytes]], List[Tuple[List[int], tuple]]]:
+    """
+    Encoded results known up front (parse errors) and the batches of a chunk,
+    each with the chunk positions of its queries
+    """
+    results: List[Optional[bytes]] = [None] * len(lines)
+    groups: Dict[SelectionKey, List[Tuple[int, dict]]] = {}
+    for i, line in enumerate(lines):
+        key, query = _parse(line)
+        if key is None:
+            results[i] = dumps(query)
+        else:
+            groups.setdefault(key, []).append((i, query))
+
+    batches = []
+    for key, members in groups.items():
+        # Same-start queries next to each other share their search
+        members.sort(key=lambda member: member[1]["start"])
+        for lo in range(0, len(members), batch_size):
+            part = members[lo:lo + batch_size]
+            batches.append(([i for i, _ in part], (key, [query for _, query in part])))
+    return results, batches
+
+
+def _chunks(f, size: int) -> Iterator[List[str]]:
+    """Non-blank input lines in lists of up to size"""
+    lines = (line for line in f if line.strip())
+    while True:
+        chunk = list(islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Solve and grade shortest-path queries from a JSONL file")
+    parser.add_argument("input", nargs="?", default="-", help="Query JSONL file (default: stdin)")
+    parser.add_argument("-o", "--output", default="-", help="Result JSONL file (default: stdout)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=2000, help="Queries read and grouped at a time")
+    parser.add_argument("--batch-size", type=int, default=200, help="Max queries per worker task")
+    parser.add_argument("--in-flight", type=int, default=None,
+                        help="Max chunks pending at a time (default: workers + 1)")
+    args = parser.parse_args(argv)
+    in_flight = args.in_flight or args.workers + 1
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    sink = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    started = time.time()
+    done = 0
+    # (results, batches, async results) per chunk, in input order
+    pending = collections.deque()
+
+    def flush_oldest() -> None:
+        nonlocal done
+        results, batches, handles = pending.popleft()
+        for (positions, _), handle in zip(batches, handles):
+            for i, encoded in zip(positions, handle.get()):
+                results[i] = encoded
+        for encoded in results:
+            sink.write(encoded)
+            sink.write(b"\n")
+        done += len(results)
+        print(f"{done} queries, {time.time() - started:.1f}s", file=sys.stderr)
+
+    try:
+        with multiprocessing.Pool(args.workers, initializer=_init_worker) as pool:
+            for chunk in _chunks(source, args.chunk_size):
+                results, batches = _plan_chunk(chunk, args.batch_size)
+                handles = [pool.apply_async(_run_batch, (batch,)) for _, batch in batches]
+                pending.append((results, batches, handles))
+                if len(pending) >= in_flight:
+                    flush_oldest()
+            while pending:
+                flush_oldest()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout.buffer:
+            sink.close()
+        else:
+            sink.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+Differential all-pairs check of the shortest-path engines.
+
+Runs a reference engine and candidate engines over every (start, end) pair
+of each city and line selection on a process pool (one task per start
+station) and diffs, per pair, the shortest cost, the set of shortest paths
+(stations with line sequence) and the set of structured paths built from
+them (annotations, display lines, transfers). The order in which paths are
+served is tallied separately and only counts as a mismatch with
+--strict-order. The reference defaults to the expanded engine, the plain
+Dijkstra over the full station graph. A result that is not a
+(paths, cost, paths_with_lines) triple, or an engine exception, is an error
+for whichever engine returned it, the reference included. Prints the
+mismatches and each candidate's time relative to the reference; exits with
+status 1 if any engine errs or disagrees.
+
+Engines are those registered in app.services.path_engines, each also as
+"<name>_from" if it has a single-source search. --record writes the
+per-pair times and mismatch counts by size class to the benchmark file the
+"auto" engine picks from, with order-only differences counted separately
+("order") so that they do not disqualify an engine.
+
+    python compare_engines.py                                   # all cities, all lines
+    python compare_engines.py --city bj --lines 首都机场线,10号线 --random-selections 20
+    python compare_engines.py --candidate compiled --starts 50
+    python compare_engines.py --random-selections 10 --starts 20 --record path_engine_benchmarks.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.services.city_data import CityData
+from app.services.city_registry import CityRegistry
+from app.services.metro_network import MetroNetwork
+from app.services.path_engines import ENGINES, size_class
+from app.services.path_finder import PathFinder
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Mismatches reported per task (the counts are always complete)
+MAX_EXAMPLES = 5
+
+# Counted per pair, in this order; only the first differing kind is counted
+# (error: the engine failed or returned a malformed result)
+KINDS = ("error", "cost", "paths", "structured", "order")
+
+# engine(start, ends) -> {end: (paths, cost, paths_with_lines)}
+Engine = Callable[[str, List[str]], Dict[str, tuple]]
+
+
+def _per_pair(path_finder: PathFinder) -> Engine:
+    return lambda start, ends: {end: path_finder.find_all_shortest_paths(start, end) for end in ends}
+
+
+def _single_source(path_finder: PathFinder) -> Engine:
+    def engine(start: str, ends: List[str]) -> Dict[str, tuple]:
+        results = path_finder.find_all_shortest_paths_from(start, ends)
+        if start in ends:
+            results[start] = path_finder.find_all_shortest_paths(start, start)
+        return results
+    return engine
+
+
+def _harness_engines() -> Dict[str, Callable[[MetroNetwork], Engine]]:
+    """Every registered engine per pair, plus "<name>_from" for single-source searches"""
+    engines = {}
+    for name, engine in ENGINES.items():
+        engines[name] = lambda view, name=name: _per_pair(PathFinder(view, engine=name))
+        if engine.find_all_shortest_paths_from is not None:
+            engines[f"{name}_from"] = lambda view, name=name: _single_source(PathFinder(view, engine=name))
+    return engines
+
+
+# Engines by name, each built fresh per selection view
+HARNESS_ENGINES = _harness_engines()
+
+# Worker state: city data per city, and the engines of the current selection
+_cities: Dict[str, CityData] = {}
+_current: Dict[str, object] = {}
+
+
+def _selection(city: str, lines: Tuple[str, ...], engines: Tuple[str, ...]) -> Tuple[MetroNetwork, Dict[str, Engine]]:
+    # Tasks come grouped by selection; only the current one's engines are kept
+    if _current.get("key") != (city, lines, engines):
+        data = _cities.get(city)
+        if data is None:
+            data = _cities[city] = CityData.load(city, CityRegistry(DATA_DIR).get(city).data_file)
+        view = data.network.with_lines(list(lines))
+        _current["key"] = (city, lines, engines)
+        _current["view"] = view
+        _current["engines"] = {name: HARNESS_ENGINES[name](view) for name in engines}
+        _current["stations"] = sorted(view.get_all_stations())
+    return _current["view"], _current["engines"]
+
+
+def _run(engine: Engine, start: str, ends: List[str]) -> Tuple[Dict[str, object], float]:
+    """Results per end (an exception's repr if the engine failed) and the time taken"""
+    began = time.perf_counter()
+    try:
+        results = engine(start, ends)
+    except Exception as e:
+        # Rerun per end to find the failing pairs
+        results = {}
+        for end in ends:
+            try:
+                results.update(engine(start, [end]))
+            except Exception as pair_error:
+                results[end] = repr(pair_error)
+        if not results:
+            results = {end: repr(e) for end in ends}
+    return results, time.perf_counter() - began
+
+
+def _malformed(result: object) -> Optional[str]:
+    """Why a result is not a (paths, cost, paths_with_lines) triple (an error repr as is), or None"""
+    if isinstance(result, str):
+        return result
+    if not isinstance(result, tuple) or len(result) != 3:
+        return f"malformed result: {result!r:.200}"
+    paths, cost, paths_with_lines = result
+    if not (isinstance(paths, list) and isinstance(cost, Decimal) and isinstance(paths_with_lines, list)
+            and all(isinstance(pl, tuple) and len(pl) == 2 for pl in paths_with_lines)
+            and paths == [path for path, _ in paths_with_lines]):
+        return f"malformed result: {result!r:.200}"
+    return None
+
+
+def _fingerprint(view: MetroNetwork, result: tuple) -> Tuple[object, ...]:
+    """(cost, path set, structured path set, served order) of a well-formed engine result"""
+    _, cost, paths_with_lines = result
+    path_set = frozenset((tuple(path), tuple(lines)) for path, lines in paths_with_lines)
+    structured = view.build_structured_paths(paths_with_lines)
+    structured_set = frozenset(
+        (p["annotated"], tuple(p["lines"]), tuple(p["transfers"])) for p in structured
+    )
+    return cost, path_set, structured_set, tuple(p["annotated"] for p in structured)
+
+
+def _compare_task(task: tuple) -> tuple:
+    """Worker: one start station of one selection, every end, reference vs candidates"""
+    city, selection, lines, start, reference, candidates = task
+    view, engines = _selection(city, lines, (reference,) + candidates)
+    ends = _current["stations"]
+
+    counts: Dict[str, Dict[str, int]] = {reference: dict.fromkeys(KINDS, 0)}
+    examples = []
+
+    def error(name: str, end: str, message: str) -> None:
+        counts[name]["error"] += 1
+        if len(examples) < MAX_EXAMPLES:
+            examples.append((name, start, end, "error", "-", message))
+
+    ref_results, ref_time = _run(engines[reference], start, ends)
+    times = {reference: ref_time}
+    # None: the reference erred on the pair (counted against it, not the candidates)
+    ref_prints: Dict[str, Optional[tuple]] = {}
+    for end in ends:
+        result = ref_results.get(end, "missing")
+        message = _malformed(result)
+        if message is not None:
+            error(reference, end, message)
+        ref_prints[end] = None if message is not None else _fingerprint(view, result)
+    for name in candidates:
+        results, times[name] = _run(engines[name], start, ends)
+        kinds = counts[name] = dict.fromkeys(KINDS, 0)
+        for end in ends:
+            result = results.get(end, "missing")
+            message = _malformed(result)
+            if message is not None:
+                error(name, end, message)
+                continue
+            expected = ref_prints[end]
+            if expected is None:
+                continue
+            got = _fingerprint(view, result)
+            for kind, ref_value, value in zip(KINDS[1:], expected, got):
+                if ref_value != value:
+                    kinds[kind] += 1
+                    if len(examples) < MAX_EXAMPLES:
+                        examples.append((name, start, end, kind, _describe(ref_value), _describe(value)))
+                    # e.g. a cost mismatch implies the others
+                    break
+    return city, selection, len(ends), times, counts, examples
+
+
+def _describe(value: object) -> str:
+    if isinstance(value, frozenset):
+        # Path set (station tuples) or structured set (annotations): first few of each
+        shown = [item[0] if isinstance(item[0], str) else " → ".join(item[0]) for item in sorted(value)[:3]]
+        return f"{len(value)}: " + "; ".join(shown) + ("; ..." if len(value) > 3 else "")
+    if isinstance(value, tuple):
+        return f"{len(value)}: " + "; ".join(value[:3]) + ("; ..." if len(value) > 3 else "")
+    return str(value)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Diff shortest-path engines over all station pairs")
+    parser.add_argument("--city", action="append", help="City code (repeatable, default: all cities)")
+    parser.add_argument("--lines", action="append",
+                        help="Comma-separated line selection (repeatable, default: all lines)")
+    parser.add_argument("--random-selections", type=int, default=0,
+                        help="Also check this many random line selections per city")
+    parser.add_argument("--reference", default="expanded", choices=sorted(HARNESS_ENGINES))
+    parser.add_argument("--candidate", action="append", choices=sorted(HARNESS_ENGINES),
+                        help="Engine to check (repeatable, default: all others)")
+    parser.add_argument("--starts", type=int, default=0,
+                        help="Check only this many random start stations per selection (default: all)")
+    parser.add_argument("--strict-order", action="store_true",
+                        help="Also fail when the same paths are served in a different order")
+    parser.add_argument("--record", help="Write per-pair times by size class to this benchmark file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    candidates = tuple(args.candidate or [name for name in HARNESS_ENGINES if name != args.reference])
+    registry = CityRegistry(DATA_DIR)
+    rng = random.Random(args.seed)
+
+    tasks = []
+    labels: Dict[Tuple[str, int], str] = {}
+    size_classes: Dict[Tuple[str, int], str] = {}
+    for city in args.city or registry.codes():
+        info = registry.get(city)
+        if info is None:
+            parser.error(f"Unknown city: {city}")
+        network = CityData.load(city, info.data_file).network
+        all_lines = network.get_all_lines()
+        selections = [ln.split(",") for ln in args.lines] if args.lines else [all_lines]
+        for _ in range(args.random_selections):
+            # Log-uniform sizes: single lines as often as whole networks, so every size class is covered
+            size = max(1, round(len(all_lines) ** rng.random()))
+            selections.append(sorted(rng.sample(all_lines, size)))
+        for i, lines in enumerate(selections):
+            view = network.with_lines(lines)
+            stations = sorted(view.get_all_stations())
+            size_classes[city, i] = size_class(len(view.graph))
+            if args.starts:
+                stations = sorted(rng.sample(stations, min(args.starts, len(stations))))
+            labels[city, i] = f"{city} {size_classes[city, i]} [{len(lines)} lines: {','.join(lines[:4])}{'...' if len(lines) > 4 else ''}]"
+            tasks.extend((city, i, tuple(lines), start, args.reference, candidates) for start in stations)
+
+    started = time.time()
+    pairs: Dict[Tuple[str, int], int] = {}
+    times: Dict[Tuple[str, int], Dict[str, float]] = {}
+    counts: Dict[Tuple[str, int], Dict[str, Dict[str, int]]] = {}
+    examples = []
+    with multiprocessing.Pool(args.workers) as pool:
+        for done, result in enumerate(pool.imap_unordered(_compare_task, tasks, chunksize=2), 1):
+            city, selection, n_pairs, task_times, task_counts, task_examples = result
+            key = (city, selection)
+            pairs[key] = pairs.get(key, 0) + n_pairs
+            for name, seconds in task_times.items():
+                times.setdefault(key, {}).setdefault(name, 0.0)
+                times[key][name] += seconds
+            for name, kinds in task_counts.items():
+                total = counts.setdefault(key, {}).setdefault(name, {})
+                for kind, n in kinds.items():
+                    total[kind] = total.get(kind, 0) + n
+            examples.extend((key,) + example for example in task_examples)
+            if done % 100 == 0 or done == len(tasks):
+                print(f"{done}/{len(tasks)} sources, {time.time() - started:.1f}s", file=sys.stderr)
+
+    mismatched = 0
+    totals = {name: 0.0 for name in (args.reference,) + candidates}
+    for key in sorted(pairs):
+        ref_errors = counts[key][args.reference]["error"]
+        print(f"{labels[key]}: {pairs[key]} pairs, {args.reference} {times[key][args.reference]:.2f}s"
+              + (f", {ref_errors} error" if ref_errors else ""))
+        mismatched += ref_errors
+        for name in candidates:
+            kinds = counts[key][name]
+            ratio = times[key][args.reference] / max(times[key][name], 1e-9)
+            status = "ok" if not any(kinds.values()) else ", ".join(
+                f"{n} {kind}" for kind, n in kinds.items() if n
+            )
+            print(f"  {name}: {status}, {times[key][name]:.2f}s ({ratio:.2f}x)")
+            mismatched += sum(n for kind, n in kinds.items() if kind != "order" or args.strict_order)
+        for name, seconds in times[key].items():
+            totals[name] += seconds
+
+    # Differing content first; order-only differences are shown with --strict-order
+    examples = [e for e in examples if e[4] != "order"] + [e for e in examples if e[4] == "order" and args.strict_order]
+    for key, name, start, end, kind, expected, got in examples[:20]:
+        print(f"MISMATCH {labels[key]} {name} {start} -> {end} ({kind})\n"
+              f"  {args.reference}: {expected}\n  {name}: {got}")
+
+    print(f"Total: {sum(pairs.values())} pairs, {mismatched} mismatches; " + ", ".join(
+        f"{name} {totals[args.reference] / max(totals[name], 1e-9):.2f}x" for name in candidates
+    ) + f" vs {args.reference}")
+
+    if args.record:
+        # Per-pair engines only: these are what PathFinder runs
+        recorded: Dict[str, Dict[str, dict]] = {}
+        for key in pairs:
+            for name in (args.reference,) + candidates:
+                if name not in ENGINES:
+                    continue
+                entry = recorded.setdefault(size_classes[key], {}).setdefault(
+                    name, {"pairs": 0, "seconds": 0.0, "mismatches": 0, "order": 0}
+                )
+                entry["pairs"] += pairs[key]
+                entry["seconds"] = round(entry["seconds"] + times[key][name], 4)
+                # The reference only has errors
+                kinds = counts[key][name]
+                entry["mismatches"] += sum(n for kind, n in kinds.items() if kind != "order")
+                entry["order"] += kinds["order"]
+        with open(args.record, "w", encoding="utf-8") as f:
+            json.dump({"reference": args.reference, "size_classes": recorded}, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"Benchmarks written to {args.record}")
+    return 1 if mismatched else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Generate puzzle banks for the random-stations endpoint.
+
+Grades every (start, end) pair of each city and line selection (see
+app.services.puzzle_bank) on a process pool, one task per start station,
+and streams the puzzles to puzzles/{city}.bank.
+
+    python generate_puzzles.py                      # all cities, all lines
+    python generate_puzzles.py --city sz --lines 1号线,2号线 --lines 1号线,5号线,11号线
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+from app.services.city_data import CityData
+from app.services.city_registry import CityRegistry
+from app.services.path_finder import PathFinder
+from app.services.puzzle_bank import PuzzleBankWriter, encode_puzzles, grade_source
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Worker state: city data per city, and the path finder of the current selection
+_cities: Dict[str, CityData] = {}
+_current: Dict[str, object] = {}
+
+
+def _path_finder(city: str, lines: Tuple[str, ...]) -> PathFinder:
+    # Tasks come grouped by selection, so keeping only the current one's path
+    # finder (and its per-end reverse searches) bounds worker memory
+    if _current.get("key") != (city, lines):
+        network = _cities[city].network.with_lines(list(lines))
+        _current["key"] = (city, lines)
+        # The compiled engine: its single-source search grades a start in one pass
+        _current["path_finder"] = PathFinder(network, engine="compiled")
+        _current["stations"] = sorted(network.get_all_stations())
+    return _current["path_finder"]
+
+
+def _grade_task(task: Tuple[str, int, Tuple[str, ...], str, Decimal]) -> Tuple[str, int, bytes]:
+    city, selection, lines, start, min_cost = task
+    data = _cities.get(city)
+    if data is None:
+        data = _cities[city] = CityData.load(city, CityRegistry(DATA_DIR).get(city).data_file)
+    path_finder = _path_finder(city, lines)
+    puzzles = list(grade_source(path_finder, start, _current["stations"], min_cost))
+    return city, selection, encode_puzzles(data.network, selection, puzzles)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate graded puzzle banks")
+    parser.add_argument("--city", action="append", help="City code (repeatable, default: all cities)")
+    parser.add_argument("--lines", action="append",
+                        help="Comma-separated line selection (repeatable, default: all lines)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output-dir", default=os.path.join(DATA_DIR, "puzzles"))
+    parser.add_argument("--min-cost", type=Decimal, default=Decimal("4"),
+                        help="Skip puzzles with a shorter shortest cost")
+    args = parser.parse_args(argv)
+
+    registry = CityRegistry(DATA_DIR)
+    cities = args.city or registry.codes()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    tasks = []
+    writers = {}
+    files = []
+    for city in cities:
+        info = registry.get(city)
+        if info is None:
+            parser.error(f"Unknown city: {city}")
+        data = CityData.load(city, info.data_file)
+        network = data.network
+        selections = [ln.split(",") for ln in args.lines] if args.lines else [network.get_all_lines()]
+        for i, lines in enumerate(selections):
+            stations = sorted(network.with_lines(lines).get_all_stations())
+            tasks.extend((city, i, tuple(lines), start, args.min_cost) for start in stations)
+        f = open(os.path.join(args.output_dir, f"{city}.bank.tmp"), "wb")
+        files.append((f, city))
+        writers[city] = PuzzleBankWriter(f, network, city, selections)
+
+    started = time.time()
+    done = 0
+    with multiprocessing.Pool(args.workers) as pool:
+        for city, selection, records in pool.imap_unordered(_grade_task, tasks, chunksize=4):
+            writers[city].write(records)
+            done += 1
+            if done % 100 == 0 or done == len(tasks):
+                print(f"{done}/{len(tasks)} sources, {time.time() - started:.1f}s", file=sys.stderr)
+
+    for f, city in files:
+        f.close()
+        os.replace(f.name, os.path.join(args.output_dir, f"{city}.bank"))
+        print(f"{city}: {writers[city].count} puzzles")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
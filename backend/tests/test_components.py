@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from tests.test_path_finder import load_city
+
+AIRPORT = "首都机场线"
+
+
+def open_airport_loop(network) -> None:
+    """Drop the airport loop's closing edge (2号航站楼 -> 三元桥): an open one-way section"""
+    contribution = network._get_line_contribution(AIRPORT)
+    network._line_contributions[AIRPORT] = contribution._replace(
+        edges=tuple(edge for edge in contribution.edges if edge != ("2号航站楼", "三元桥")),
+        strongly_connected=False
+    )
+
+
+class ComponentsTest(unittest.TestCase):
+    """/game/components labels agree with /game/reachable-stations for every start"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = TestClient(app)
+
+    def check_selection(self, lines) -> dict:
+        r = self.client.post("/api/bj/game/components", json={"lines": lines})
+        self.assertEqual(r.status_code, 200)
+        result = r.json()
+        components, reachable_components = result["components"], result["reachable_components"]
+        for start, component in components.items():
+            with self.subTest(start=start):
+                # What a client does with the response (reachable-stations leaves out the start)
+                targets = {component, *reachable_components.get(str(component), [])}
+                expected = sorted(s for s, c in components.items() if c in targets and s != start)
+                r = self.client.post("/api/bj/game/reachable-stations", json={"lines": lines, "start": start})
+                self.assertEqual(r.json()["stations"], expected)
+        return result
+
+    def test_closed_one_way_loop(self):
+        # The loop returns to 三元桥: every station reaches every other one
+        for lines in ([AIRPORT], [AIRPORT, "10号线"]):
+            result = self.check_selection(lines)
+            self.assertEqual(len(set(result["components"].values())), 1)
+            self.assertEqual(result["reachable_components"], {})
+
+    def test_open_one_way_section(self):
+        network = load_city("bj").network
+        open_airport_loop(network)
+        with mock.patch("app.routers.metro.get_metro_network", return_value=network):
+            result = self.check_selection([AIRPORT, "10号线"])
+        components, reachable_components = result["components"], result["reachable_components"]
+        self.assertTrue(reachable_components)
+        # 三元桥 reaches the terminals one way only
+        self.assertIn(components["3号航站楼"], reachable_components[str(components["三元桥"])])
+        self.assertIn(components["2号航站楼"], reachable_components[str(components["3号航站楼"])])
+        self.assertNotIn(str(components["2号航站楼"]), reachable_components)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+
+from app.services.graph_snapshot import GraphSnapshot
+from tests.test_path_finder import load_city
+
+TOGGLES = 150
+
+
+class DeriveTest(unittest.TestCase):
+    """Snapshots derived one line toggle at a time equal a fresh build"""
+
+    def check_toggles(self, city: str, forced: list) -> None:
+        network = load_city(city).network
+        all_lines = network.get_all_lines()
+        rng = random.Random(city)
+        selection = set(rng.sample(all_lines, len(all_lines) // 2))
+        snapshot = network.get_snapshot(sorted(selection))
+        snapshot.component_labels()
+        snapshot.components()
+
+        toggles = forced + [rng.choice(all_lines) for _ in range(TOGGLES)]
+        for step, line_name in enumerate(toggles):
+            selection ^= {line_name}
+            if not selection:
+                selection.add(line_name)
+            key = frozenset(network._expand_lines(sorted(selection)))
+            contributions = {ln: network._get_line_contribution(ln) for ln in key | snapshot.lines}
+            derived = snapshot.derive(key, contributions)
+            fresh = GraphSnapshot.build(key, contributions)
+            with self.subTest(step=step, toggled=line_name):
+                self.assertEqual(derived.graph, fresh.graph)
+                self.assertEqual(derived.station_lines, fresh.station_lines)
+                self.assertEqual(derived.station_masks, fresh.station_masks)
+                self.assertEqual(derived.has_exact_components, fresh.has_exact_components)
+                self.assertEqual(derived.component_labels(), fresh.component_labels())
+                if derived.has_exact_components:
+                    self.assertEqual(
+                        sorted(map(sorted, derived.components())), sorted(map(sorted, fresh.components()))
+                    )
+            derived.components()  # Also on directed snapshots, so the next derive() carries them over
+            snapshot = derived
+
+    def test_y_branch(self):
+        # 5号线 brings in its branch 5号线+ (and the 5号线:B segment labels)
+        self.check_toggles("sh", ["5号线", "5号线", "10号线", "11号线", "10号线"])
+
+    def test_one_way_loop(self):
+        # 首都机场线's loop is one-way: components switch to strongly connected ones
+        self.check_toggles("bj", ["首都机场线", "10号线", "首都机场线", "首都机场线"])
+
+    def test_plain_lines(self):
+        self.check_toggles("sz", [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+from decimal import Decimal
+
+from app.services.city_data import CityData
+from app.services.city_registry import CityRegistry
+from app.services.path_engines import ENGINES
+from app.services.path_finder import PathFinder
+from app.services.result_cache import ResultCache
+
+DATA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_city(city: str, result_cache: ResultCache = None) -> CityData:
+    info = CityRegistry(DATA_DIR).get(city)
+    return CityData.load(city, info.data_file, result_cache)
+
+
+class NoRouteTest(unittest.TestCase):
+    """Every engine returns (paths, cost, paths_with_lines), also when there is no path"""
+
+    @classmethod
+    def setUpClass(cls):
+        # 6号线支线 does not meet 1号线
+        cls.view = load_city("sz").network.with_lines(["1号线", "6号线支线"])
+
+    def test_unreachable_end(self):
+        for name in ENGINES:
+            with self.subTest(engine=name):
+                paths, cost, paths_with_lines = PathFinder(self.view, engine=name).find_all_shortest_paths(
+                    "罗湖", "光明城站"
+                )
+                self.assertEqual(paths, [])
+                self.assertEqual(cost, Decimal("Infinity"))
+                self.assertEqual(paths_with_lines, [])
+
+    def test_unreachable_ends_single_source(self):
+        for name in ENGINES:
+            with self.subTest(engine=name):
+                results = PathFinder(self.view, engine=name).find_all_shortest_paths_from(
+                    "罗湖", ["光明城站", "深大"]
+                )
+                paths, cost, paths_with_lines = results["光明城站"]
+                self.assertEqual((paths, cost, paths_with_lines), ([], Decimal("Infinity"), []))
+                self.assertTrue(results["深大"][0])
+
+
+class ResultCacheTest(unittest.TestCase):
+    """Cached results are reported as such; an explicit engine always runs"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = ResultCache(os.path.join(directory.name, "results.db"))
+        # The cache keeps one connection per thread; this test only uses this one
+        self.addCleanup(lambda: cache._connection().close())
+        self.view = load_city("sz", cache).network.with_lines(["1号线", "2号线", "4号线"])
+
+    def test_cache_hit(self):
+        first = PathFinder(self.view)
+        expected = first.find_all_shortest_paths("罗湖", "深圳北站")
+        self.assertIn(first.debug_info()["engine"], ENGINES)
+
+        second = PathFinder(self.view)
+        self.assertEqual(second.find_all_shortest_paths("罗湖", "深圳北站"), expected)
+        self.assertEqual(second.debug_info()["engine"], "cache")
+        self.assertEqual(second.debug_info()["settled_states"], 0)
+
+    def test_explicit_engine_bypasses_cache(self):
+        expected = PathFinder(self.view).find_all_shortest_paths("罗湖", "深圳北站")
+        for name in ENGINES:
+            with self.subTest(engine=name):
+                path_finder = PathFinder(self.view, engine=name)
+                self.assertEqual(path_finder.find_all_shortest_paths("罗湖", "深圳北站"), expected)
+                self.assertEqual(path_finder.debug_info()["engine"], name)
+                self.assertGreater(path_finder.debug_info()["settled_states"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
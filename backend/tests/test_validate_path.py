@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.path_engines import ENGINES
+
+
+class ValidatePathNoRouteTest(unittest.TestCase):
+    """validate-path for a puzzle without a route is a clear 400, and leaves the shared snapshot alone"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = TestClient(app)
+
+    def setUp(self):
+        # ?engine= is admin-only
+        patcher = mock.patch("app.admin.ADMIN_TOKEN", "test-token")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def validate(self, lines, start, end, engine=None, token="test-token"):
+        params = {"engine": engine} if engine is not None else {}
+        return self.client.post(
+            "/api/sz/game/validate-path", params=params, headers={"X-Admin-Token": token},
+            json={"lines": lines, "start": start, "end": end, "user_path": [start, end]}
+        )
+
+    def test_unreachable(self):
+        for engine in [None] + list(ENGINES):
+            with self.subTest(engine=engine):
+                r = self.validate(["1号线", "6号线支线"], "罗湖", "光明城站", engine)
+                self.assertEqual(r.status_code, 400)
+                self.assertEqual(r.json()["detail"], "Stations are not reachable")
+
+    def test_unknown_station(self):
+        for engine in [None] + list(ENGINES):
+            with self.subTest(engine=engine):
+                r = self.validate(["1号线", "2号线"], "FAKE", "罗湖", engine)
+                self.assertEqual(r.status_code, 400)
+                self.assertEqual(r.json()["detail"], "Start station not found: FAKE")
+                r = self.validate(["1号线", "2号线"], "罗湖", "FAKE", engine)
+                self.assertEqual(r.status_code, 400)
+                self.assertEqual(r.json()["detail"], "End station not found: FAKE")
+
+        stations = self.client.get("/api/sz/stations", params={"lines": "1号线,2号线"}).json()["stations"]
+        self.assertNotIn("FAKE", stations)
+
+    def test_engine_requires_admin(self):
+        r = self.validate(["1号线", "2号线"], "罗湖", "大剧院", "expanded", token="wrong")
+        self.assertEqual(r.status_code, 403)
+        with mock.patch("app.admin.ADMIN_TOKEN", None):
+            r = self.validate(["1号线", "2号线"], "罗湖", "大剧院", "expanded")
+            self.assertEqual(r.status_code, 404)
+            r = self.validate(["1号线", "2号线"], "罗湖", "大剧院")
+            self.assertEqual(r.status_code, 200)
+
+
+class ValidateRoundTest(unittest.TestCase):
+    """validate-path with a round_id: 404 for an unknown round, 400 for a request that is not its puzzle"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = TestClient(app)
+        cls.round = cls.client.post(
+            "/api/sz/game/round", json={"lines": ["1号线", "2号线"], "start": "罗湖", "end": "大剧院"}
+        ).json()
+
+    def validate(self, **puzzle):
+        return self.client.post("/api/sz/game/validate-path", json={"user_path": ["罗湖", "国贸", "老街", "大剧院"], **puzzle})
+
+    def test_round(self):
+        r = self.validate(round_id=self.round["round_id"], start="罗湖")
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.json()["is_shortest"])
+
+    def test_unknown_round(self):
+        r = self.validate(round_id="missing", start="罗湖")
+        self.assertEqual(r.status_code, 404)
+
+    def test_mismatched_request(self):
+        round_id = self.round["round_id"]
+        for field, puzzle in (("start", {"start": "老街"}), ("end", {"end": "老街"}),
+                              ("lines", {"lines": ["1号线"]})):
+            with self.subTest(field=field):
+                r = self.validate(round_id=round_id, **puzzle)
+                self.assertEqual(r.status_code, 400)
+                self.assertEqual(r.json()["detail"], f"Request does not match round {round_id}: {field} differs")
+        # With the whole puzzle given, the request's own puzzle is validated instead
+        r = self.validate(round_id=round_id, lines=["1号线"], start="罗湖", end="大剧院")
+        self.assertEqual(r.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
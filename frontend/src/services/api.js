@@ -34,33 +34,77 @@ export default {
     return api.get(`/${city}/stations`, { params })
   },
 
+  // Search station names (exact and prefix matches first), optionally within lines
+  searchStations(city, q, lines = null, limit = 20) {
+    const params = { q, limit }
+    if (lines) params.lines = lines.join(',')
+    return api.get(`/${city}/stations/search`, { params })
+  },
+
   // Get reachable stations from start station
   getReachableStations(city, lines, start) {
     return api.post(`/${city}/game/reachable-stations`, { lines, start })
   },
 
+  // Get station -> component id map for selected lines
+  getComponents(city, lines) {
+    return api.post(`/${city}/game/components`, { lines })
+  },
+
   // Generate random start and end stations
   randomStations(city, lines) {
     return api.post(`/${city}/game/random-stations`, { lines })
   },
 
   // Calculate shortest path
-  calculatePath(city, lines, start, end) {
-    return api.post(`/${city}/game/calculate-path`, { lines, start, end })
+  // options: { alternatives_tolerance, alternatives_limit } to also get near-optimal routes
+  calculatePath(city, lines, start, end, options = {}) {
+    return api.post(`/${city}/game/calculate-path`, { lines, start, end, ...options })
+  },
+
+  // Start a round: random or fixed start/end, solved in one request
+  // options: { start, end, include_solutions, include_reachable }
+  startRound(city, lines, options = {}) {
+    return api.post(`/${city}/game/round`, { lines, ...options })
   },
 
   // Validate user's path
-  validatePath(city, lines, start, end, userPath) {
+  // (roundId: the round from startRound; the server falls back to lines/start/end if it expired)
+  validatePath(city, lines, start, end, userPath, roundId = null) {
     return api.post(`/${city}/game/validate-path`, {
       lines,
       start,
       end,
-      user_path: userPath
+      user_path: userPath,
+      round_id: roundId
     })
   },
 
   // Get map coordinates for visualization
   getMapCoordinates(city) {
     return api.get(`/${city}/map/coordinates`)
+  },
+
+  // Map tile grid (bounds, zoom levels, tile ETags) and single tiles (ETag-revalidated by the browser)
+  getMapTileIndex(city) {
+    return api.get(`/${city}/map/tiles`)
+  },
+
+  getMapTile(city, z, x, y) {
+    return api.get(`/${city}/map/tiles/${z}/${x}/${y}`)
+  },
+
+  // Stations nearest to a map point (lines: optional array of line names)
+  getNearestStations(city, x, y, k = 1, lines = null) {
+    const params = { x, y, k }
+    if (lines) params.lines = lines.join(',')
+    return api.get(`/${city}/map/nearest`, { params })
+  },
+
+  // Stations inside a map rectangle
+  getStationsInBox(city, xMin, yMin, xMax, yMax, lines = null) {
+    const params = { x_min: xMin, y_min: yMin, x_max: xMax, y_max: yMax }
+    if (lines) params.lines = lines.join(',')
+    return api.get(`/${city}/map/bbox`, { params })
   }
 }
@@ -49,11 +49,14 @@ export const useGameStore = defineStore('game', {
     // Station selection
     availableStations: [],  // All stations in selected lines
     reachableStations: [],  // Stations reachable from start station
+    stationComponents: null,  // Station -> component id (for selected lines)
+    reachableComponents: {},  // Component id -> other reachable component ids (one-way sections only)
     
     // Game state
     startStation: '',
     endStation: '',
     userPath: [],
+    roundId: null,  // Server-side round session (see api.startRound)
     
     // Results
     systemPaths: [],
@@ -147,9 +150,12 @@ export const useGameStore = defineStore('game', {
         this.linesData = {}
         this.availableStations = []
         this.reachableStations = []
+        this.stationComponents = null
+        this.reachableComponents = {}
         this.startStation = ''
         this.endStation = ''
         this.userPath = []
+        this.roundId = null
         this.systemPaths = []
         this.shortestCost = 0
         this.validationResult = null
@@ -217,6 +223,8 @@ export const useGameStore = defineStore('game', {
       this.endStation = ''
       this.availableStations = []
       this.reachableStations = []
+      this.stationComponents = null
+      this.reachableComponents = {}
     },
 
     async validateAndClearStations() {
@@ -226,8 +234,8 @@ export const useGameStore = defineStore('game', {
         return
       }
 
-      // Load available stations for current lines
-      await this.loadAvailableStations()
+      // Load available stations and components for current lines
+      await Promise.all([this.loadAvailableStations(), this.loadComponents()])
 
       // Check if start station is still valid
       if (this.startStation && !this.availableStations.includes(this.startStation)) {
@@ -263,12 +271,48 @@ export const useGameStore = defineStore('game', {
       }
     },
 
+    // Server-side station search within the selected lines
+    async searchStations(query, limit = 200) {
+      if (!this.hasSelectedLines) return []
+      const response = await api.searchStations(this.city, query, this.selectedLines, limit)
+      return response.data.stations
+    },
+
+    async loadComponents() {
+      if (!this.hasSelectedLines) {
+        this.stationComponents = null
+        this.reachableComponents = {}
+        return
+      }
+
+      try {
+        const response = await api.getComponents(this.city, this.selectedLines)
+        this.stationComponents = response.data.components
+        this.reachableComponents = response.data.reachable_components || {}
+      } catch (error) {
+        console.error('Failed to load station components:', error)
+        this.stationComponents = null
+        this.reachableComponents = {}
+      }
+    },
+
     async loadReachableStations() {
       if (!this.hasSelectedLines || !this.startStation) {
         this.reachableStations = []
         return
       }
 
+      // Answer locally from the component map when we have it
+      const components = this.stationComponents
+      if (components && this.startStation in components) {
+        const startComponent = components[this.startStation]
+        const targets = new Set([startComponent, ...(this.reachableComponents[startComponent] || [])])
+        this.reachableStations = Object.keys(components)
+          .filter(station => station !== this.startStation && targets.has(components[station]))
+          .sort()
+        return
+      }
+
       try {
         const response = await api.getReachableStations(this.city, this.selectedLines, this.startStation)
         this.reachableStations = response.data.stations
@@ -307,18 +351,14 @@ export const useGameStore = defineStore('game', {
         this.validationResult = null
         this.showAnswer = false
         
-        const response = await api.randomStations(this.city, this.selectedLines)
+        // 一次请求完成随机起终点和最短路径 cost（答案在需要时再获取）
+        const response = await api.startRound(this.city, this.selectedLines)
         this.startStation = response.data.start
         this.endStation = response.data.end
-        // 同时获取最短路径的 cost
-        const pathResponse = await api.calculatePath(
-          this.city,
-          this.selectedLines,
-          response.data.start,
-          response.data.end
-        )
-        this.shortestCost = pathResponse.data.shortest_cost
-        this.systemPaths = pathResponse.data.paths
+        this.roundId = response.data.round_id
+        this.shortestCost = response.data.shortest_cost
+        this.systemPaths = []
+        await this.loadReachableStations()
         // 自动填写起点和终点
         this.userPath = [this.startStation, this.endStation]
         this.gameStatus = 'playing'
@@ -343,15 +383,11 @@ export const useGameStore = defineStore('game', {
           this.validationResult = null
           this.showAnswer = false
           
-          // 获取最短路径的 cost
-          const pathResponse = await api.calculatePath(
-            this.city,
-            this.selectedLines,
-            start,
-            end
-          )
-          this.shortestCost = pathResponse.data.shortest_cost
-          this.systemPaths = pathResponse.data.paths
+          // 获取最短路径的 cost（答案在需要时再获取）
+          const response = await api.startRound(this.city, this.selectedLines, { start, end })
+          this.roundId = response.data.round_id
+          this.shortestCost = response.data.shortest_cost
+          this.systemPaths = []
           // 自动填写起点和终点
           this.userPath = [this.startStation, this.endStation]
           this.gameStatus = 'playing'
@@ -414,7 +450,8 @@ export const useGameStore = defineStore('game', {
           this.selectedLines,
           this.startStation,
           this.endStation,
-          this.userPath
+          this.userPath,
+          this.roundId
         )
         this.validationResult = response.data
         this.shortestCost = response.data.shortest_cost
@@ -467,6 +504,7 @@ export const useGameStore = defineStore('game', {
       this.endStation = ''
       this.reachableStations = []
       this.userPath = []
+      this.roundId = null
       this.systemPaths = []
       this.shortestCost = 0
       this.validationResult = null
@@ -484,6 +522,7 @@ export const useGameStore = defineStore('game', {
       this.endStation = ''
       this.reachableStations = []
       this.userPath = []
+      this.roundId = null
       this.systemPaths = []
       this.shortestCost = 0
       this.validationResult = null